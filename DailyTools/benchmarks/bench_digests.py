@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import tempfile
+import time
+
+from bench_handlers import load_bot
+from stubs import CITIES, StubUpstreams
+
+
+# Subscribe `users` users to the same delivery slot, spread over `cities`
+# locations and both temperature units, then deliver that slot once
+async def benchmark(args):
+    upstreams = StubUpstreams(latency=args.upstream_latency / 1000)
+    await upstreams.start()
+    bot = load_bot(upstreams, tempfile.mkdtemp(prefix="dailytools-bench-"), args.storage)
+    bot.outbound.chat_rate = bot.outbound.chat_burst = 1e9
+
+    await bot.start_services()
+    try:
+        cities = [f"{CITIES[n % len(CITIES)]} {n // len(CITIES)}" if n >= len(CITIES) else CITIES[n] for n in range(args.cities)]
+        started = time.perf_counter()
+        for n in range(args.users):
+            city = cities[n % len(cities)]
+            await bot.digests.subscribe(1_000_000 + n, {
+                "location": bot.normalize_location(city),
+                "label": f"{city}, Benchland",
+                "time": "07:30",
+                "tz": "Europe/London",
+                "unit": "fahrenheit" if n % 3 == 0 else "celsius"
+            })
+        print(f"subscribe:          {args.users} users in {time.perf_counter() - started:.2f}s")
+
+        calls_before = bot.weather_api.calls
+        sent_before = bot.client.sent
+        started = time.perf_counter()
+        # A day from now every slot is due
+        delivered = await bot.digests.run_due(time.time() + 86400)
+        elapsed = time.perf_counter() - started
+        print(f"delivery:           {delivered} digests in {elapsed:.2f}s ({delivered / elapsed:,.0f}/s)")
+        print(f"messages sent:      {bot.client.sent - sent_before}")
+        print(f"weather API calls:  {bot.weather_api.calls - calls_before} for {args.cities} distinct locations")
+        print(f"digests:            {bot.digests.stats()}")
+    finally:
+        await bot.stop_services()
+        await upstreams.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver one daily digest slot to many subscribers, offline.")
+    parser.add_argument("--users", type=int, default=100000, help="subscribers in the slot")
+    parser.add_argument("--cities", type=int, default=50, help="distinct locations they subscribe to")
+    parser.add_argument("--upstream-latency", type=float, default=20, help="stub API latency in ms")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import gc
+import importlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from stubs import StubClient, StubUpstreams, build_event, make_user, session_script
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_bytes():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Import bot/main.py and build it around the stub client and upstreams.
+# Settings the benchmark doesn't care about can be overridden from the shell.
+def load_bot(upstreams, workdir, storage):
+    os.environ.update(upstreams.environ())
+    defaults = {
+        "W_API": "bench",
+        "NEWS_API": "bench",
+        "STORAGE_BACKEND": storage,
+        "STORAGE_PATH": os.path.join(workdir, "bench.db"),
+        "RATE_LIMIT_BURST": "1000000",
+        "SEND_RATE_PER_SECOND": "1000000",
+        "LOG_FILE": os.path.join(workdir, "bench.log"),
+        "LOG_LEVEL": "ERROR"
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+    sys.path.insert(0, os.path.abspath(BOT_DIR))
+    started = time.perf_counter()
+    bot = importlib.import_module("main")
+    print(f"import:             {(time.perf_counter() - started) * 1000:.0f}ms")
+    bot.configure_logging()
+    bot.create_app(StubClient())
+    return bot
+
+
+async def run_user(bot, user_id, rounds, latencies):
+    user = make_user(user_id)
+    for _ in range(rounds):
+        for kind, payload in session_script(user_id):
+            event = build_event(bot.client, user, kind, payload)
+            started = time.perf_counter()
+            for result in await bot.client.dispatch(event):
+                # Handlers queue the update and return a future for its completion
+                if isinstance(result, asyncio.Future):
+                    await result
+            latencies.append(time.perf_counter() - started)
+
+
+async def run_users(bot, first_id, users, rounds, concurrency, latencies):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def run(user_id):
+        async with gate:
+            await run_user(bot, user_id, rounds, latencies)
+
+    await asyncio.gather(*(run(first_id + n) for n in range(users)))
+
+
+async def benchmark(args):
+    upstreams = StubUpstreams(latency=args.upstream_latency / 1000)
+    await upstreams.start()
+    workdir = tempfile.mkdtemp(prefix="dailytools-bench-")
+    bot = load_bot(upstreams, workdir, args.storage)
+    if not args.real_pacing:
+        # Telegram's per-chat limit would otherwise dominate every latency
+        bot.outbound.chat_rate = bot.outbound.chat_burst = 1e9
+
+    await bot.start_services()
+    try:
+        await run_users(bot, 1, args.warmup, 1, args.concurrency, [])
+
+        gc.collect()
+        if args.trace_memory:
+            tracemalloc.start()
+        rss_before = peak_rss_bytes()
+        baseline = bot.client.sent + bot.client.edited
+        latencies = []
+        started = time.perf_counter()
+        await run_users(bot, 1_000_000, args.users, args.rounds, args.concurrency, latencies)
+        elapsed = time.perf_counter() - started
+        rss_after = peak_rss_bytes()
+        retained = None
+        if args.trace_memory:
+            gc.collect()
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        latencies.sort()
+        print(f"users:              {args.users} ({args.concurrency} at a time), {args.rounds} session(s) each")
+        print(f"updates:            {len(latencies)} in {elapsed:.2f}s")
+        print(f"throughput:         {len(latencies) / elapsed:,.0f} updates/s")
+        print(
+            f"latency:            p50 {percentile(latencies, 0.5) * 1000:.2f}ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms, max {latencies[-1] * 1000:.2f}ms"
+        )
+        print(f"replies:            {bot.client.sent + bot.client.edited - baseline}")
+        print(f"handler errors:     {bot.client.errors + bot.mailboxes.failed}")
+        print(f"mailboxes:          {bot.mailboxes.stats()}")
+        print(f"upstream requests:  {upstreams.requests}")
+        if rss_before is not None:
+            print(f"peak RSS growth:    {(rss_after - rss_before) / args.users:,.0f} bytes/user")
+        if retained is not None:
+            print(f"retained (traced):  {retained / args.users:,.0f} bytes/user")
+    finally:
+        await bot.stop_services()
+        await upstreams.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic user sessions against the bot's handlers, offline.")
+    parser.add_argument("--users", type=int, default=10000, help="simulated users")
+    parser.add_argument("--concurrency", type=int, default=None, help="users active at once (default: all)")
+    parser.add_argument("--rounds", type=int, default=1, help="sessions per user")
+    parser.add_argument("--warmup", type=int, default=100, help="users run before measuring")
+    parser.add_argument("--upstream-latency", type=float, default=20, help="stub API latency in ms")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--real-pacing", action="store_true", help="keep the per-chat send limit")
+    parser.add_argument("--trace-memory", action="store_true", help="measure retained memory with tracemalloc (slow)")
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or args.users
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+sys.path.insert(0, os.path.abspath(BOT_DIR))
+
+from storage import DEFAULT_PREFERENCES, MemoryStorage  # noqa: E402
+
+
+# The record layout before UserData was compacted: four eager dicts per user,
+# with preferences stored as a full copy of the defaults
+class LegacyUserData:
+    __slots__ = ("preferences", "notes", "reminders", "scores")
+
+    def __init__(self):
+        self.preferences = dict(DEFAULT_PREFERENCES)
+        self.notes = {}
+        self.reminders = {}
+        self.scores = {}
+
+
+class LegacyMemoryStorage(MemoryStorage):
+    async def _record(self, user_id, create=True):
+        record = self._users.get(user_id)
+        if record is None:
+            record = self._users[user_id] = LegacyUserData()
+        return record
+
+    async def get_preferences(self, user_id):
+        record = await self._record(user_id)
+        return dict(record.preferences)
+
+    async def set_preference(self, user_id, key, value):
+        record = await self._record(user_id)
+        record.preferences[key] = value
+
+
+# What each kind of user does to their record. "start" is the user who ran
+# /start and opened settings once, which only reads.
+async def touch(storage, user_id, scenario):
+    await storage.get_preferences(user_id)
+    if scenario == "preference":
+        await storage.set_preference(user_id, "temperature_unit", "fahrenheit")
+    elif scenario == "score":
+        await storage.incr_score(user_id, "dice")
+
+
+async def measure(storage_class, users, scenario):
+    storage = storage_class()
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    for user_id in range(users):
+        await touch(storage, user_id, scenario)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained, elapsed
+
+
+async def benchmark(args):
+    layouts = [("compact", MemoryStorage)]
+    if not args.skip_legacy:
+        layouts.append(("legacy", LegacyMemoryStorage))
+    print(f"users: {args.users:,}")
+    for scenario in args.scenarios:
+        for name, storage_class in layouts:
+            retained, elapsed = await measure(storage_class, args.users, scenario)
+            print(
+                f"{scenario:<11} {name:<8} {retained / args.users:8,.1f} bytes/user  "
+                f"{retained / 2 ** 20:9,.1f} MiB total  {elapsed:6.2f}s"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure memory retained per user by the in-memory storage records.")
+    parser.add_argument("--users", type=int, default=1_000_000, help="simulated users")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=("start", "preference", "score"),
+        default=["start", "preference", "score"], help="what each user does"
+    )
+    parser.add_argument("--skip-legacy", action="store_true", help="don't measure the old four-dict layout")
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import asyncio
+import itertools
+import logging
+import random
+from types import SimpleNamespace
+
+from aiohttp import web
+from telethon import TelegramClient, events
+from telethon.sessions import MemorySession
+
+logger = logging.getLogger(__name__)
+
+CITIES = ("London", "Paris", "Berlin", "Madrid", "Rome", "Tokyo", "Lagos", "Lima", "Oslo", "Cairo")
+
+
+# Telegram client that never connects. Handlers register on it as usual;
+# `dispatch` runs an event through them the way Telethon does, and anything
+# the bot sends is counted (after building the reply markup, as Telethon would).
+class StubClient(TelegramClient):
+    def __init__(self):
+        super().__init__(MemorySession(), 1, "stub")
+        self.sent = 0
+        self.edited = 0
+        self.answered = 0
+        self.errors = 0
+
+    async def send_message(self, entity, message="", buttons=None, **kwargs):
+        if buttons is not None:
+            self.build_reply_markup(buttons)
+        self.sent += 1
+
+    async def edit_message(self, entity, message=None, text=None, buttons=None, **kwargs):
+        if buttons is not None:
+            self.build_reply_markup(buttons)
+        self.edited += 1
+
+    async def answer_callback(self, message=None, alert=False):
+        self.answered += 1
+
+    # Same loop as TelegramClient._dispatch_update, minus update decoding.
+    # Returns what the handlers returned.
+    async def dispatch(self, event):
+        results = []
+        for builder, callback in self._event_builders:
+            if not isinstance(builder, event.builder_type):
+                continue
+            if not builder.resolved:
+                await builder.resolve(self)
+            passed = builder.filter(event)
+            if asyncio.iscoroutine(passed):
+                passed = await passed
+            if not passed:
+                continue
+            try:
+                results.append(await callback(event))
+            except events.StopPropagation:
+                break
+            except Exception:
+                self.errors += 1
+                logger.exception("Unhandled exception on %s", getattr(callback, "__name__", callback))
+        return results
+
+
+# Only the fields of a telethon Message that the filters and handlers read
+class _Message:
+    __slots__ = ("message", "text", "sender_id", "out", "fwd_from")
+
+    def __init__(self, sender_id, text):
+        self.message = self.text = text
+        self.sender_id = sender_id
+        self.out = False
+        self.fwd_from = None
+
+
+class MessageEvent:
+    builder_type = events.NewMessage
+
+    def __init__(self, client, user, text="", geo=None):
+        self.client = client
+        self._sender = user
+        self.sender_id = user.id
+        self.chat_id = user.id
+        self.message = _Message(user.id, text)
+        self.text = self.raw_text = text
+        self.geo = geo
+        self.pattern_match = None
+
+    async def get_sender(self):
+        return self._sender
+
+    async def respond(self, *args, **kwargs):
+        return await self.client.send_message(self.chat_id, *args, **kwargs)
+
+
+class CallbackEvent:
+    builder_type = events.CallbackQuery
+
+    def __init__(self, client, user, data):
+        self.client = client
+        self._sender = user
+        self.sender_id = user.id
+        self.chat_id = user.id
+        self.data = data
+        self.query = SimpleNamespace(data=data, chat_instance=0)
+        self.pattern_match = self.data_match = None
+
+    async def get_sender(self):
+        return self._sender
+
+    async def respond(self, *args, **kwargs):
+        return await self.client.send_message(self.chat_id, *args, **kwargs)
+
+    async def edit(self, *args, **kwargs):
+        return await self.client.edit_message(self.chat_id, *args, **kwargs)
+
+    async def answer(self, message=None, alert=False):
+        return await self.client.answer_callback(message, alert)
+
+
+def make_user(user_id):
+    return SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Bench")
+
+
+# One user's session: (kind, payload) steps touching every feature once
+def session_script(user_id):
+    city = CITIES[user_id % len(CITIES)]
+    return [
+        ("message", "/start"),
+        ("callback", b"help"),
+        ("callback", b"help_commands"),
+        ("message", f"/weather {city}"),
+        ("callback", b"weather_search"),
+        ("message", CITIES[(user_id + 1) % len(CITIES)]),
+        ("geo", SimpleNamespace(lat=51.5, long=-0.12)),
+        ("callback", b"digest_menu"),
+        ("callback", b"digest_subscribe"),
+        ("message", city),
+        ("message", "07:30"),
+        ("message", "/joke"),
+        ("callback", b"joke"),
+        ("callback", b"news_menu"),
+        ("callback", b"news_world"),
+        ("callback", b"games_menu"),
+        ("callback", b"game_dice"),
+        ("callback", b"game_trivia"),
+        ("callback", b"trivia_0"),
+        ("callback", b"create_note"),
+        ("message", "Shopping"),
+        ("message", "milk, eggs, bread"),
+        ("callback", b"view_notes"),
+        ("callback", b"find_note"),
+        ("message", "milk"),
+        ("callback", b"set_reminder"),
+        ("message", "Call home"),
+        ("message", "2h"),
+        ("message", "/settings"),
+        ("callback", b"settings_temp"),
+        ("callback", b"set_temp_fahrenheit"),
+        ("callback", b"main_menu")
+    ]
+
+
+def build_event(client, user, kind, payload):
+    if kind == "callback":
+        return CallbackEvent(client, user, payload)
+    if kind == "geo":
+        return MessageEvent(client, user, "", geo=payload)
+    return MessageEvent(client, user, payload)
+
+
+# Local stand-ins for weatherapi, newsapi, opentdb and both joke APIs.
+# `latency` seconds are added to every response.
+class StubUpstreams:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self._serial = itertools.count()
+        self._runner = None
+        self.base_url = None
+
+    async def start(self, host="127.0.0.1"):
+        app = web.Application()
+        app.router.add_get("/weather", self._weather)
+        app.router.add_get("/news", self._news)
+        app.router.add_get("/trivia", self._trivia)
+        app.router.add_get("/jokes/official", self._official_jokes)
+        app.router.add_get("/jokes/jokeapi", self._jokeapi_jokes)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # Environment overrides pointing the bot at these stubs
+    def environ(self):
+        return {
+            "WEATHER_API_URL": f"{self.base_url}/weather",
+            "NEWS_API_URL": f"{self.base_url}/news",
+            "TRIVIA_API_URL": f"{self.base_url}/trivia",
+            "OFFICIAL_JOKE_API_URL": f"{self.base_url}/jokes/official",
+            "JOKEAPI_URL": f"{self.base_url}/jokes/jokeapi"
+        }
+
+    async def _respond(self, data):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response(data)
+
+    async def _weather(self, request):
+        place = request.query.get("q", "Nowhere")
+        day = {
+            "condition": {"text": "Partly cloudy"},
+            "maxtemp_c": 21.0, "mintemp_c": 12.0, "maxtemp_f": 69.8, "mintemp_f": 53.6
+        }
+        return await self._respond({
+            "location": {"name": place, "country": "Benchland", "tz_id": "Europe/London"},
+            "current": {
+                "condition": {"text": random.choice(("Sunny", "Light rain", "Overcast"))},
+                "temp_c": 18.0, "temp_f": 64.4, "humidity": 60, "wind_kph": 11.2,
+                "air_quality": {"us-epa-index": 2}
+            },
+            "forecast": {"forecastday": [
+                {"date": f"2024-06-0{i}", "day": day} for i in range(1, 4)
+            ]}
+        })
+
+    async def _news(self, request):
+        category = request.query.get("category", "general")
+        return await self._respond({
+            "status": "ok",
+            "totalResults": 5,
+            "articles": [
+                {"title": f"{category} headline {i}", "source": {"name": "Bench News"}, "description": "Details."}
+                for i in range(5)
+            ]
+        })
+
+    async def _trivia(self, request):
+        amount = int(request.query.get("amount", 10))
+        return await self._respond({
+            "response_code": 0,
+            "results": [
+                {
+                    "category": "General Knowledge",
+                    "type": "multiple",
+                    "difficulty": "easy",
+                    "question": f"Benchmark question #{next(self._serial)}?",
+                    "correct_answer": "Yes",
+                    "incorrect_answers": ["No", "Maybe", "Never"]
+                }
+                for _ in range(amount)
+            ]
+        })
+
+    async def _official_jokes(self, request):
+        return await self._respond([
+            {"setup": f"Joke #{next(self._serial)}", "punchline": "Punchline."} for _ in range(10)
+        ])
+
+    async def _jokeapi_jokes(self, request):
+        amount = int(request.query.get("amount", 1))
+        return await self._respond({
+            "error": False,
+            "amount": amount,
+            "jokes": [{"setup": f"Joke #{next(self._serial)}", "delivery": "Delivery."} for _ in range(amount)]
+        })
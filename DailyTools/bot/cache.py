@@ -0,0 +1,73 @@
+import re
+import time
+from collections import OrderedDict
+
+# Coordinates are rounded to this many decimals (~1 km) so nearby
+# shared locations land on the same cache entry
+COORD_PRECISION = 2
+
+_coords_pattern = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+_whitespace_pattern = re.compile(r"\s+")
+
+
+# Normalize a city name or "lat,lon" string into a cache key
+def normalize_location(query):
+    match = _coords_pattern.match(query)
+    if match:
+        lat = round(float(match.group(1)), COORD_PRECISION)
+        lon = round(float(match.group(2)), COORD_PRECISION)
+        return f"{lat:.{COORD_PRECISION}f},{lon:.{COORD_PRECISION}f}"
+    return _whitespace_pattern.sub(" ", query).strip().casefold()
+
+
+# Bounded LRU cache whose entries expire after `ttl` seconds
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
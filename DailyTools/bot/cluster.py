@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import struct
+import sys
+
+from telethon import utils
+from telethon.extensions import BinaryReader
+from telethon.tl import types
+
+logger = logging.getLogger(__name__)
+
+# Frames are a 4-byte big-endian length followed by that many bytes
+_frame_header = struct.Struct(">I")
+# Each frame body starts with the number of TL objects that follow
+_count_header = struct.Struct(">H")
+
+# Frames buffered per worker while it is disconnected or slow
+MAX_BACKLOG = 10000
+
+# Seconds to wait before restarting a worker that exited
+RESTART_DELAY = 5
+
+
+def shard_for(key, workers):
+    return key % workers
+
+
+# The user an update belongs to, so all of a user's updates go to one worker.
+# Updates without an obvious user go to shard 0.
+def update_user_id(update):
+    user_id = getattr(update, "user_id", None)
+    if isinstance(user_id, int):
+        return user_id
+    message = getattr(update, "message", None)
+    if isinstance(message, types.Message):
+        return utils.get_peer_id(message.from_id or message.peer_id)
+    return 0
+
+
+# Serialize an update plus the users/chats it references
+def encode_update(update):
+    entities = list(getattr(update, "_entities", {}).values())
+    parts = [_count_header.pack(1 + len(entities)), bytes(update)]
+    parts.extend(bytes(entity) for entity in entities)
+    return b"".join(parts)
+
+
+def decode_update(data):
+    (count,) = _count_header.unpack_from(data)
+    with BinaryReader(data[_count_header.size:]) as reader:
+        objects = [reader.tgread_object() for _ in range(count)]
+    update, entities = objects[0], objects[1:]
+    users = [entity for entity in entities if isinstance(entity, types.User)]
+    chats = [entity for entity in entities if not isinstance(entity, types.User)]
+    return update, users, chats
+
+
+async def _read_frame(reader):
+    header = await reader.readexactly(_frame_header.size)
+    (length,) = _frame_header.unpack(header)
+    return await reader.readexactly(length)
+
+
+def _write_frame(writer, data):
+    writer.write(_frame_header.pack(len(data)) + data)
+
+
+# Exclusive lock on a file, held for the life of the process. Used so only
+# one process at a time can own a given worker shard (and its reminders).
+class ProcessLock:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def acquire(self):
+        self._file = open(self.path, "a+")
+        try:
+            if sys.platform == "win32":
+                import msvcrt
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._file = None
+            return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Receiving side of multi-process mode. Installed on the one client that
+# receives updates, it replaces local handler dispatch with forwarding:
+# every update is sent, in arrival order, to the worker that owns its user.
+# Workers connect over a local TCP socket and announce their shard index;
+# frames for a worker that is down are buffered (up to MAX_BACKLOG).
+class UpdateDispatcher:
+    def __init__(self, workers, host="127.0.0.1", port=8765):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self._queues = [asyncio.Queue(MAX_BACKLOG) for _ in range(workers)]
+        self._server = None
+        self.forwarded = 0
+        self.dropped = 0
+
+    def install(self, client):
+        client._dispatch_update = self.forward
+
+    async def forward(self, update):
+        shard = shard_for(update_user_id(update), self.workers)
+        try:
+            self._queues[shard].put_nowait(encode_update(update))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Worker %s backlog is full; dropping update", shard)
+            return
+        self.forwarded += 1
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve_worker, self.host, self.port)
+        logger.info("Update dispatcher listening on %s:%s for %s workers", self.host, self.port, self.workers)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve_worker(self, reader, writer):
+        try:
+            (shard,) = struct.unpack(">H", await reader.readexactly(2))
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+        if shard >= self.workers:
+            logger.error("Rejecting connection for unknown worker %s", shard)
+            writer.close()
+            return
+
+        logger.info("Worker %s connected", shard)
+        queue = self._queues[shard]
+        data = None
+        try:
+            while True:
+                data = await queue.get()
+                _write_frame(writer, data)
+                await writer.drain()
+                data = None
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning("Worker %s disconnected: %s", shard, e)
+        finally:
+            # Keep the frame that failed to send for the next connection
+            if data is not None:
+                self._requeue_front(queue, data)
+            writer.close()
+
+    @staticmethod
+    def _requeue_front(queue, data):
+        pending = [data]
+        while not queue.empty():
+            pending.append(queue.get_nowait())
+        for item in pending[:MAX_BACKLOG]:
+            queue.put_nowait(item)
+
+    def stats(self):
+        return {
+            "forwarded": self.forwarded,
+            "dropped": self.dropped,
+            "backlog": [queue.qsize() for queue in self._queues]
+        }
+
+
+# Start `workers` copies of this script in worker mode and restart any that exit
+async def supervise_workers(script, workers):
+    async def run(shard):
+        while True:
+            process = await asyncio.create_subprocess_exec(sys.executable, script, "--worker", str(shard))
+            try:
+                code = await process.wait()
+            except asyncio.CancelledError:
+                process.terminate()
+                await process.wait()
+                raise
+            logger.error("Worker %s exited with code %s; restarting in %ss", shard, code, RESTART_DELAY)
+            await asyncio.sleep(RESTART_DELAY)
+
+    await asyncio.gather(*(run(shard) for shard in range(workers)))
+
+
+# Worker side: reads forwarded updates from the dispatcher and runs them
+# through the local client's handlers, one at a time in arrival order. The
+# handlers only queue each update in its user's mailbox, so this keeps
+# per-user ordering, and a full mailbox pool stops reading from the socket.
+class WorkerInbox:
+    def __init__(self, client, shard, host="127.0.0.1", port=8765):
+        self.client = client
+        self.shard = shard
+        self.host = host
+        self.port = port
+        self._task = None
+        self.received = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                logger.warning("Worker %s can't reach the dispatcher: %s", self.shard, e)
+                await asyncio.sleep(1)
+                continue
+            writer.write(struct.pack(">H", self.shard))
+            try:
+                while True:
+                    await self._dispatch(await _read_frame(reader))
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                logger.warning("Worker %s lost the dispatcher: %s", self.shard, e)
+            finally:
+                writer.close()
+            await asyncio.sleep(1)
+
+    async def _dispatch(self, data):
+        update, users, chats = decode_update(data)
+        self.received += 1
+        self.client._preprocess_updates([update], users, chats)
+        await self.client._dispatch_update(update)
+
+    def stats(self):
+        return {"shard": self.shard, "received": self.received}
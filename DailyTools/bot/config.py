@@ -0,0 +1,166 @@
+import logging
+import os
+import sys
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+# Raised for missing or invalid settings; the message lists every problem
+class ConfigError(ValueError):
+    pass
+
+
+# Environment variables whose names don't follow the field name
+_ENV_NAMES = {
+    "weather_api_key": "W_API",
+    "news_api_key": "NEWS_API"
+}
+
+STORAGE_BACKENDS = ("sqlite", "memory")
+
+
+def _parse_bool(value):
+    value = value.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(value)
+
+
+_PARSERS = {int: int, float: float, str: str, bool: _parse_bool}
+
+
+# Every setting the bot reads, typed and with its default. Each field is
+# read from the upper-cased environment variable of the same name (see
+# _ENV_NAMES for the exceptions); `worker_shard` comes from `--worker N`.
+@dataclass(frozen=True)
+class Settings:
+    # Telegram credentials; only needed to connect
+    api_id: int = 0
+    api_hash: str = ""
+    bot_token: str = ""
+    # Third-party API keys
+    weather_api_key: str = ""
+    news_api_key: str = ""
+
+    weather_cache_ttl: int = 600
+    weather_cache_size: int = 2048
+    news_refresh_interval: int = 1800
+    storage_backend: str = "sqlite"
+    storage_path: str = "bot.db"
+    conversation_timeout: int = 600
+    rate_limit_burst: int = 10
+    rate_limit_per_second: float = 0.5
+    # Mailbox workers, i.e. the most update handlers running at once
+    max_concurrent_handlers: int = 100
+    # Updates queued bot-wide before the update loop is made to wait, and per user before dropping
+    mailbox_max_pending: int = 10000
+    mailbox_max_per_user: int = 20
+    send_rate_per_second: float = 25.0
+    trivia_batch_size: int = 50
+    # Digest locations fetched at once when a delivery slot comes due
+    digest_fetch_concurrency: int = 10
+
+    # Upstream endpoints; overridable so benchmarks can point them at local stubs
+    weather_api_url: str = "http://api.weatherapi.com/v1/forecast.json"
+    news_api_url: str = "https://newsapi.org/v2/top-headlines"
+    trivia_api_url: str = "https://opentdb.com/api.php"
+    official_joke_api_url: str = "https://official-joke-api.appspot.com/random_ten"
+    jokeapi_url: str = "https://v2.jokeapi.dev/joke/Any"
+
+    # Multi-process mode: workers > 0 runs one receiver plus this many workers
+    workers: int = 0
+    cluster_port: int = 8765
+    # Shard index when started by the receiver as a worker, otherwise None
+    worker_shard: Optional[int] = None
+    # Local Prometheus endpoint; 0 turns instrumentation off
+    metrics_port: int = 0
+
+    log_file: str = "bot.log"
+    log_level: str = "INFO"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backups: int = 5
+    # One JSON object per line (with user_id, handler and latency fields)
+    log_json: bool = False
+
+    # Each worker rotates its own log file so processes never share one
+    @property
+    def log_path(self):
+        if self.worker_shard is None:
+            return self.log_file
+        root, ext = os.path.splitext(self.log_file)
+        return f"{root}.worker{self.worker_shard}{ext}"
+
+    def problems(self):
+        problems = []
+        for name in ("weather_cache_ttl", "weather_cache_size", "news_refresh_interval", "conversation_timeout",
+                     "rate_limit_burst", "rate_limit_per_second", "max_concurrent_handlers",
+                     "mailbox_max_pending", "mailbox_max_per_user", "send_rate_per_second",
+                     "trivia_batch_size", "digest_fetch_concurrency", "log_max_bytes"):
+            if getattr(self, name) <= 0:
+                problems.append(f"{name.upper()} must be positive")
+        if self.workers < 0:
+            problems.append("WORKERS can't be negative")
+        if self.log_backups < 0:
+            problems.append("LOG_BACKUPS can't be negative")
+        for name in ("cluster_port", "metrics_port"):
+            if not 0 <= getattr(self, name) <= 65535:
+                problems.append(f"{name.upper()} must be a port number")
+        if self.storage_backend not in STORAGE_BACKENDS:
+            problems.append(f"STORAGE_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}")
+        if not isinstance(logging.getLevelName(self.log_level), int):
+            problems.append(f"LOG_LEVEL '{self.log_level}' is not a logging level")
+        if self.worker_shard is not None and not 0 <= self.worker_shard < max(1, self.workers):
+            problems.append(f"--worker {self.worker_shard} is outside 0..WORKERS-1")
+        return problems
+
+    # Connecting needs all three Telegram credentials
+    def require_credentials(self):
+        missing = [name.upper() for name in ("api_id", "api_hash", "bot_token") if not getattr(self, name)]
+        if missing:
+            raise ConfigError(f"Missing Telegram credentials: {', '.join(missing)}")
+
+
+def _worker_shard(argv):
+    if "--worker" not in argv:
+        return None
+    index = argv.index("--worker") + 1
+    if index >= len(argv):
+        raise ConfigError("--worker needs a shard number")
+    try:
+        return int(argv[index])
+    except ValueError:
+        raise ConfigError(f"--worker expects a number, got '{argv[index]}'") from None
+
+
+# Read and validate settings from the environment (after loading .env) and
+# the command line. Raises ConfigError listing everything that's wrong.
+def load_settings(environ=None, argv=None):
+    if environ is None:
+        load_dotenv()
+        environ = os.environ
+    values = {"worker_shard": _worker_shard(sys.argv if argv is None else argv)}
+    errors = []
+    for field in fields(Settings):
+        if field.name == "worker_shard":
+            continue
+        name = _ENV_NAMES.get(field.name, field.name.upper())
+        raw = environ.get(name)
+        if raw is None or raw == "":
+            continue
+        try:
+            values[field.name] = _PARSERS[field.type](raw)
+        except ValueError:
+            errors.append(f"{name}={raw!r} is not a valid {field.type.__name__}")
+    if "log_level" in values:
+        values["log_level"] = values["log_level"].upper()
+
+    if not errors:
+        settings = Settings(**values)
+        errors = settings.problems()
+    if errors:
+        raise ConfigError("Invalid settings:\n  " + "\n  ".join(errors))
+    return settings
@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on a single sleep so wall-clock jumps (suspend, NTP) are noticed
+MAX_SLEEP = 60
+
+
+def _zone(name):
+    if not name or name == "UTC":
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        logger.warning("Unknown time zone %s; using UTC", name)
+        return timezone.utc
+
+
+# Unix time of the next `HH:MM` in the given zone strictly after `now`.
+# Adding a day to an aware datetime keeps the wall-clock time across DST.
+def next_delivery(time_of_day, tz_name, now):
+    hour, minute = map(int, time_of_day.split(":"))
+    local = datetime.fromtimestamp(now, _zone(tz_name))
+    due = local.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if due.timestamp() <= now:
+        due += timedelta(days=1)
+    return due.timestamp()
+
+
+# Daily weather digests. A subscription is a dict with the normalized
+# `location`, a display `label`, the local delivery `time` ("HH:MM"), the
+# location's `tz` and the subscriber's temperature `unit`; it is persisted
+# through the storage backend. Subscribers are indexed by delivery slot
+# (tz, time) and the run loop sleeps only until the earliest slot is due.
+# Everything due together is grouped by location, so each location is
+# fetched once per run and rendered once per unit however many users share
+# it. `fetch(location)` returns weather data or None, `render(data, unit)`
+# the message text, and `deliver(user_id, text)` queues the send and
+# returns its future. Slots missed while the bot was down are skipped.
+class DigestScheduler:
+    def __init__(self, fetch, render, deliver, storage, owns=None, fetch_concurrency=10):
+        self._fetch = fetch
+        self._render = render
+        self._deliver = deliver
+        self._storage = storage
+        self._owns = owns
+        self.fetch_concurrency = fetch_concurrency
+        self._subscriptions = {}
+        self._slots = {}
+        # Due time of each slot's live heap entry; older entries are skipped
+        self._slot_due = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._runs = set()
+        self.delivered = 0
+        self.failed = 0
+        self.fetches = 0
+        self.fetch_failures = 0
+
+    async def load(self):
+        loaded = await self._storage.all_digests()
+        if self._owns is not None:
+            loaded = [(user_id, digest) for user_id, digest in loaded if self._owns(user_id)]
+        for user_id, digest in loaded:
+            self._index(user_id, digest)
+        logger.info("Loaded %s digest subscriptions", len(loaded))
+        return len(loaded)
+
+    def get(self, user_id):
+        return self._subscriptions.get(user_id)
+
+    async def subscribe(self, user_id, digest):
+        await self._storage.set_digest(user_id, digest)
+        self._unindex(user_id)
+        self._index(user_id, digest)
+
+    async def unsubscribe(self, user_id):
+        self._unindex(user_id)
+        return await self._storage.delete_digest(user_id)
+
+    # Keep a subscription's unit in step with the user's preference
+    async def set_unit(self, user_id, unit):
+        digest = self._subscriptions.get(user_id)
+        if digest is not None and digest["unit"] != unit:
+            await self.subscribe(user_id, {**digest, "unit": unit})
+
+    def _index(self, user_id, digest):
+        self._subscriptions[user_id] = digest
+        slot = (digest["tz"], digest["time"])
+        subscribers = self._slots.get(slot)
+        if subscribers is None:
+            subscribers = self._slots[slot] = set()
+            self._schedule(slot, time.time())
+        subscribers.add(user_id)
+
+    def _unindex(self, user_id):
+        digest = self._subscriptions.pop(user_id, None)
+        if digest is None:
+            return
+        slot = (digest["tz"], digest["time"])
+        subscribers = self._slots[slot]
+        subscribers.discard(user_id)
+        if not subscribers:
+            # The heap entry is left in place and skipped when it comes due
+            del self._slots[slot]
+            del self._slot_due[slot]
+
+    def _schedule(self, slot, now):
+        due = next_delivery(slot[1], slot[0], now)
+        self._slot_due[slot] = due
+        heapq.heappush(self._heap, (due, next(self._seq), slot))
+        if self._heap[0][2] == slot:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._runs) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._runs.clear()
+
+    # Pop every slot due by `now`, schedule its next delivery and return
+    # the subscribers to deliver to
+    def _pop_due(self, now):
+        user_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, slot = heapq.heappop(self._heap)
+            if self._slot_due.get(slot) != due:
+                continue
+            user_ids.extend(self._slots[slot])
+            self._schedule(slot, max(now, due))
+        return user_ids
+
+    # Deliver every slot due by `now` (default: the current time) and wait
+    # until the messages have been sent
+    async def run_due(self, now=None):
+        return await self._deliver_to(self._pop_due(time.time() if now is None else now))
+
+    async def _deliver_to(self, user_ids):
+        groups = {}
+        for user_id in user_ids:
+            digest = self._subscriptions.get(user_id)
+            if digest is not None:
+                groups.setdefault(digest["location"], {}).setdefault(digest["unit"], []).append(user_id)
+        if not groups:
+            return 0
+        started = time.monotonic()
+        gate = asyncio.Semaphore(self.fetch_concurrency)
+        results = await asyncio.gather(*(self._deliver_location(location, by_unit, gate) for location, by_unit in groups.items()))
+        delivered = sum(results)
+        logger.info(
+            "Digest run: %s subscribers, %s locations, %s delivered in %.1fs",
+            len(user_ids), len(groups), delivered, time.monotonic() - started
+        )
+        return delivered
+
+    async def _deliver_location(self, location, by_unit, gate):
+        async with gate:
+            self.fetches += 1
+            try:
+                data = await self._fetch(location)
+            except Exception as e:
+                logger.error("Digest fetch failed for %s: %s", location, e)
+                data = None
+        if data is None:
+            self.fetch_failures += 1
+            self.failed += sum(len(user_ids) for user_ids in by_unit.values())
+            return 0
+
+        sends = []
+        for unit, user_ids in by_unit.items():
+            text = self._render(data, unit)
+            sends.extend(self._deliver(user_id, text) for user_id in user_ids)
+        delivered = 0
+        for result in await asyncio.gather(*sends, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.failed += 1
+            else:
+                delivered += 1
+        self.delivered += delivered
+        return delivered
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            user_ids = self._pop_due(time.time())
+            if user_ids:
+                # Sending can take a while; don't hold up the next slot
+                run = asyncio.create_task(self._deliver_to(user_ids))
+                self._runs.add(run)
+                run.add_done_callback(self._runs.discard)
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(max(self._heap[0][0] - time.time(), 0), MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "slots": len(self._slots),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures
+        }
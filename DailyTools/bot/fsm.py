@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Where one user is in a conversation flow. `data` holds flow-specific
+# values (note title, guess target, ...) and stays None for simple states.
+class Conversation:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self, state, data, expires_at):
+        self.state = state
+        self.data = data
+        self.expires_at = expires_at
+
+
+# Declarative conversation engine. Each state is registered with a text
+# handler and an idle timeout; text from a user is routed with one dict
+# lookup on their current state. Idle conversations are dropped by a
+# single background sweep.
+class ConversationFSM:
+    def __init__(self, default_timeout=300, sweep_interval=60):
+        self.default_timeout = default_timeout
+        self.sweep_interval = sweep_interval
+        self._handlers = {}
+        self._timeouts = {}
+        self._active = {}
+        self._task = None
+        self.expired = 0
+
+    # @conversations.state("waiting_for_city", timeout=120) -> handler(event, conversation)
+    def state(self, name, timeout=None):
+        def decorator(handler):
+            if name in self._handlers:
+                raise ValueError(f"State '{name}' is already registered")
+            self._handlers[name] = handler
+            self._timeouts[name] = timeout or self.default_timeout
+            return handler
+        return decorator
+
+    def set(self, user_id, state, **data):
+        if state not in self._handlers:
+            raise KeyError(f"Unknown conversation state '{state}'")
+        conversation = Conversation(state, data or None, time.monotonic() + self._timeouts[state])
+        self._active[user_id] = conversation
+        return conversation
+
+    def get(self, user_id):
+        conversation = self._active.get(user_id)
+        if conversation is not None and conversation.expires_at < time.monotonic():
+            del self._active[user_id]
+            self.expired += 1
+            return None
+        return conversation
+
+    def clear(self, user_id):
+        self._active.pop(user_id, None)
+
+    # Run the handler for the user's current state; False if there is none
+    async def dispatch(self, event):
+        user_id = event.sender_id
+        conversation = self.get(user_id)
+        if conversation is None:
+            return False
+
+        conversation.expires_at = time.monotonic() + self._timeouts[conversation.state]
+        await self._handlers[conversation.state](event, conversation)
+        return True
+
+    def active_count(self):
+        return len(self._active)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            now = time.monotonic()
+            stale = [user_id for user_id, conversation in self._active.items() if conversation.expires_at < now]
+            for user_id in stale:
+                del self._active[user_id]
+            self.expired += len(stale)
+            if stale:
+                logger.info("Expired %s idle conversations, %s active", len(stale), len(self._active))
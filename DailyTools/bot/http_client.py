@@ -0,0 +1,61 @@
+import asyncio
+import logging
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Connection pool limits
+TOTAL_CONNECTIONS = 100
+CONNECTIONS_PER_HOST = 20
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+# Default timeout for a single upstream call (seconds)
+DEFAULT_TIMEOUT = 10
+
+# One session shared by every outbound API call
+_session = None
+_session_lock = asyncio.Lock()
+
+
+async def get_session():
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    async with _session_lock:
+        if _session is None or _session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=TOTAL_CONNECTIONS,
+                limit_per_host=CONNECTIONS_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                use_dns_cache=True,
+                keepalive_timeout=KEEPALIVE_TIMEOUT
+            )
+            _session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT)
+            )
+            logger.info("HTTP session opened")
+    return _session
+
+
+# GET a URL and decode the JSON body. Returns (status, data); data is None
+# when the response is not a 200.
+async def fetch_json(url, params=None, timeout=None):
+    session = await get_session()
+    request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+    async with session.get(url, params=params, timeout=request_timeout) as response:
+        if response.status != 200:
+            return response.status, None
+        data = await response.json(content_type=None)
+        return response.status, data
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("HTTP session closed")
+    _session = None
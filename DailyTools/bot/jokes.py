@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from collections import deque
+
+from resilience import Upstream
+
+logger = logging.getLogger(__name__)
+
+
+# Ring buffer of ready-to-send jokes. When it drops to `low_water` a
+# background task refills it in batches from whichever provider is
+# healthiest; a provider that keeps failing is skipped by its circuit
+# breaker until it recovers. `providers` maps a name to
+# `fetch(amount, timeout)`, which returns a list of formatted jokes.
+# `observer(name)` may supply a per-provider Upstream observe callback.
+class JokePool:
+    def __init__(self, providers, size=100, low_water=20, batch_size=10, observer=None):
+        self.size = size
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self._providers = {
+            name: (fetch, Upstream(name, observe=observer(name) if observer else None))
+            for name, fetch in providers.items()
+        }
+        self._jokes = deque(maxlen=size)
+        self._refill_task = None
+        self.served = 0
+        self.misses = 0
+
+    def start(self):
+        self._refill()
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    # Next joke, or None if the buffer is empty and no provider could fill it.
+    # Only waits on the network when the buffer has run dry.
+    async def get(self):
+        if len(self._jokes) <= self.low_water:
+            refill = self._refill()
+            if not self._jokes:
+                self.misses += 1
+                await asyncio.shield(refill)
+        if not self._jokes:
+            return None
+        self.served += 1
+        return self._jokes.popleft()
+
+    def _refill(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._load())
+        return self._refill_task
+
+    async def _load(self):
+        while len(self._jokes) + self.batch_size <= self.size:
+            jokes = await self._fetch_batch()
+            if not jokes:
+                break
+            known = set(self._jokes)
+            fresh = [joke for joke in jokes if joke not in known]
+            if not fresh:
+                break
+            self._jokes.extend(fresh)
+
+    # Healthiest provider first; falls through to the next one on failure
+    async def _fetch_batch(self):
+        ranked = sorted(self._providers.items(), key=lambda item: item[1][1].breaker.score)
+        for name, (fetch, upstream) in ranked:
+            try:
+                return await upstream.call(lambda timeout: fetch(self.batch_size, timeout))
+            except Exception as e:
+                logger.error("Joke provider %s failed: %r", name, e)
+        return None
+
+    def stats(self):
+        return {
+            "buffered": len(self._jokes),
+            "served": self.served,
+            "misses": self.misses,
+            "providers": {name: upstream.stats() for name, (_, upstream) in self._providers.items()}
+        }
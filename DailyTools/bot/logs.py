@@ -0,0 +1,127 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# (user_id, handler name) of the update being handled by the current task
+_update_context = contextvars.ContextVar("update_context", default=(None, None))
+
+# Handlers slower than this are logged at WARNING instead of DEBUG
+SLOW_HANDLER_SECONDS = 1.0
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+# Copies the current update's user id and handler name onto every record
+class UpdateContextFilter(logging.Filter):
+    def filter(self, record):
+        user_id, handler = _update_context.get()
+        if not hasattr(record, "user_id"):
+            record.user_id = user_id
+        if not hasattr(record, "handler"):
+            record.handler = handler
+        return True
+
+
+# One JSON object per line; `latency` is included when a record carries it
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "user_id": getattr(record, "user_id", None),
+            "handler": getattr(record, "handler", None)
+        }
+        latency = getattr(record, "latency", None)
+        if latency is not None:
+            entry["latency"] = round(latency, 6)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Enqueues records untouched. The stock QueueHandler formats the message and
+# renders tracebacks on the logging thread (here, the event loop) and drops
+# exc_info; records stay in-process, so the listener thread can do it all.
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+# Route all logging through a queue so the event loop never waits on disk
+# or the console: the root logger only enqueues records, and a listener
+# thread formats them and writes to a size-rotated file and stderr.
+# Returns the started QueueListener; it is stopped (and drained) at exit.
+def setup_logging(path="bot.log", level=logging.INFO, max_bytes=10 * 1024 * 1024, backups=5, json_lines=False):
+    formatter = JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(records)
+    queue_handler.addFilter(UpdateContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(records, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Handler decorator that tags log records with the update's user and the
+# handler's name, and logs how long the handler took
+def log_context(name=None):
+    def decorator(handler):
+        label = name or handler.__name__
+
+        @functools.wraps(handler)
+        async def wrapper(event, *args):
+            token = _update_context.set((getattr(event, "sender_id", None), label))
+            started = time.perf_counter()
+            try:
+                return await handler(event, *args)
+            finally:
+                latency = time.perf_counter() - started
+                if latency >= SLOW_HANDLER_SECONDS:
+                    logger.warning("Slow handler %s took %.3fs", label, latency, extra={"latency": latency})
+                elif logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Handled %s in %.3fs", label, latency, extra={"latency": latency})
+                _update_context.reset(token)
+        return wrapper
+    return decorator
+
+
+# Times consecutive startup phases and logs them on one line
+class StartupTimer:
+    def __init__(self, started=None):
+        self._started = self._last = started if started is not None else time.perf_counter()
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        logger.info(
+            "Started in %.3fs (%s)", self._last - self._started,
+            ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases)
+        )
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class _Mailbox:
+    __slots__ = ("jobs", "dropped")
+
+    def __init__(self):
+        self.jobs = deque()
+        self.dropped = 0
+
+
+# Runs update handlers on a fixed pool of worker coroutines, one update per
+# user at a time and in arrival order, so a user's quick successive messages
+# can't race on their conversation state. A user's mailbox exists only while
+# it has work: it is created on submit and dropped as soon as it drains.
+# Each user may queue `max_per_user` updates (further ones are dropped), and
+# once `max_pending` updates are queued in total `submit` waits for space,
+# which pushes back on the update loop instead of piling up coroutines.
+# `observe(wait)`, if given, is called with each job's queueing delay.
+class UserMailboxes:
+    def __init__(self, workers=100, max_pending=10000, max_per_user=20, observe=None):
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self._observe = observe
+        self._workers = workers
+        self._tasks = []
+        self._mailboxes = {}
+        # Users with queued work and no job running, in the order they became ready
+        self._ready = asyncio.Queue()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self.pending = 0
+        self.busy = 0
+        self.submitted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Queue `factory()` behind the user's earlier updates. Returns a future
+    # that resolves once it has run, or None if the user's mailbox is full.
+    async def submit(self, user_id, factory):
+        if self.pending >= self.max_pending:
+            self.throttled += 1
+            while self.pending >= self.max_pending:
+                self._has_space.clear()
+                await self._has_space.wait()
+
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = _Mailbox()
+            self._ready.put_nowait(user_id)
+        elif len(mailbox.jobs) >= self.max_per_user:
+            self.dropped += 1
+            mailbox.dropped += 1
+            if mailbox.dropped == 1:
+                logger.warning("Mailbox for user %s is full; dropping updates", user_id)
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        mailbox.jobs.append((factory, future, time.monotonic()))
+        self.pending += 1
+        self.submitted += 1
+        return future
+
+    async def _worker(self):
+        while True:
+            user_id = await self._ready.get()
+            mailbox = self._mailboxes[user_id]
+            factory, future, enqueued_at = mailbox.jobs.popleft()
+            self.pending -= 1
+            if self.pending < self.max_pending:
+                self._has_space.set()
+            if self._observe is not None:
+                self._observe(time.monotonic() - enqueued_at)
+
+            self.busy += 1
+            try:
+                await factory()
+            except Exception:
+                self.failed += 1
+                logger.exception("Unhandled exception in handler for user %s", user_id)
+            finally:
+                self.busy -= 1
+                if not future.done():
+                    future.set_result(None)
+                if mailbox.jobs:
+                    self._ready.put_nowait(user_id)
+                else:
+                    del self._mailboxes[user_id]
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "users": len(self._mailboxes),
+            "busy": self.busy,
+            "workers": self._workers,
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "throttled": self.throttled
+        }
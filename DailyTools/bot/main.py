@@ -1,1169 +1,1392 @@
+import time
+
+# Reference point for the startup timings
+STARTED_AT = time.perf_counter()
+
 from telethon import TelegramClient, events
 from telethon.tl.custom import Button
-from telethon.tl.types import InputMediaPhoto
 import asyncio
-import aiohttp
 import logging
 import os
 import random
 import re
-import time
+import signal
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from cache import TTLCache, normalize_location
+from config import load_settings
+from fsm import ConversationFSM
+from http_client import fetch_json, close_session
+from logs import StartupTimer, log_context, setup_logging
+from mailboxes import UserMailboxes
+from metrics import Metrics
+from notes import NotesService
+from pagination import Paginator
+from ratelimit import RateLimiter, CHEAP, EXPENSIVE
+from resilience import StaleResult, Upstream, UpstreamError
+from router import CallbackRouter, CommandRouter
+from scheduler import ReminderScheduler
+from screens import build_screens, HELP_TOPICS, SETTING_CONFIRMATIONS
+from sender import OutboundQueue, NOTIFICATION
+from singleflight import SingleFlight
+from storage import create_storage
 
-# Credentials
-API_ID = os.getenv('API_ID')
-API_HASH = os.getenv('API_HASH')
-BOT_TOKEN = os.getenv('BOT_TOKEN')
-W_API = os.getenv('W_API')
-NEWS_API = os.getenv('NEWS_API')
+# Validated settings from the environment, .env and the command line
+settings = load_settings()
 
-# Initialize the Telegram client
-client = TelegramClient('s1', API_ID, API_HASH).start(bot_token=BOT_TOKEN)
+# News categories offered in the news menu
+NEWS_CATEGORIES = ("world", "business", "health", "science", "sports", "technology")
 
-# Dictionary to track user messages for rate-limiting
-user_last_message = {}
+# newsapi.org has no "world" category; top headlines live under "general"
+NEWS_API_CATEGORIES = {"world": "general"}
 
-# Dictionary to track user preferences
-user_preferences = {}
+# Most notes listed for one Find Note search
+NOTE_SEARCH_LIMIT = 10
 
-# Dictionary for reminders
-user_reminders = {}
+# The Telegram client; created by create_app when the bot starts
+client = None
 
-# Simple state management for conversation flows
-user_states = {}
+# Background feature services (joke and trivia pools, news feed, daily
+# digests); built by create_services when the bot starts
+joke_pool = None
+news_feed = None
+trivia_pool = None
+digests = None
 
-# Dictionary for user game scores
-user_scores = {}
+# Paced outbound messages; interactive replies go before reminders. The
+# global send rate is split between workers so the bot as a whole keeps to it.
+outbound = OutboundQueue(global_rate=settings.send_rate_per_second / max(1, settings.workers))
 
-# Dictionary for trivia answers
-trivia_answers = {}
+# Handler and upstream latency histograms, counters and gauges
+metrics = Metrics(enabled=settings.metrics_port > 0)
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
+# Inline button callbacks, dispatched by handle_callback
+callbacks = CallbackRouter(wrap=lambda handler: log_context()(metrics.instrument()(handler)))
+
+# Commands, shared locations and text input, dispatched by handle_message
+commands = CommandRouter(wrap=lambda handler: log_context()(metrics.instrument()(handler)))
+
+# Per-user ordered execution of updates on a bounded pool of workers
+mailbox_wait = metrics.histogram("bot_mailbox_wait_seconds", "Time updates wait in a user's mailbox before running")
+mailboxes = UserMailboxes(
+    workers=settings.max_concurrent_handlers,
+    max_pending=settings.mailbox_max_pending,
+    max_per_user=settings.mailbox_max_per_user,
+    observe=mailbox_wait.observe if metrics.enabled else None
+)
+
+# Per-user token buckets; the mailbox worker pool caps running handlers
+rate_limiter = RateLimiter(capacity=settings.rate_limit_burst, refill_rate=settings.rate_limit_per_second)
+
+# News may call the upstream API; everything else is a menu edit or served from memory
+def callback_cost(event):
+    data = event.data.decode('utf-8')
+    if data.startswith("news_") and data != "news_menu":
+        return EXPENSIVE
+    return CHEAP
+
+def weather_command_cost(event):
+    return EXPENSIVE if event.command.args else CHEAP
+
+def location_cost(event):
+    return EXPENSIVE if event.geo else 0
+
+def text_input_cost(event):
+    conversation = conversations.get(event.sender_id)
+    if conversation is None:
+        return 0
+    if conversation.state in ("waiting_for_city", "waiting_for_forecast_city", "waiting_for_digest_location"):
+        return EXPENSIVE
+    return CHEAP
+
+# Preferences, notes, reminders and game scores
+storage = create_storage(settings.storage_backend, settings.storage_path)
+
+# Paged list views, re-rendered only after the underlying list changes
+notes_pages = Paginator(
+    "notes",
+    "📝 **Your Notes:**\n\n",
+    lambda note: f"**{note['title']}** (ID: {note['id']})\nCreated: {note.get('created_at', 'Unknown date')}\n\n"
 )
+reminders_pages = Paginator(
+    "reminders",
+    "⏰ **Your Active Reminders:**\n\n",
+    lambda reminder: (
+        f"**{reminder['text']}** (ID: {reminder['id']})\n"
+        f"Time: {datetime.fromtimestamp(reminder['time']).strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    )
+)
+
+# Notes with per-user id counters and a keyword index
+notes = NotesService(storage, on_change=notes_pages.invalidate)
+
+# Conversation flows waiting for text input; idle ones expire
+conversations = ConversationFSM(default_timeout=settings.conversation_timeout)
+
+# Formatted weather replies keyed by normalized location
+weather_cache = TTLCache(maxsize=settings.weather_cache_size, ttl=settings.weather_cache_ttl)
+
+# Concurrent identical upstream fetches share one request
+upstream_calls = SingleFlight()
+
+# Breakers, adaptive timeouts and stale fallbacks for each third-party API
+weather_api = Upstream("weatherapi", observe=metrics.upstream_observer("weatherapi"))
+news_api = Upstream("newsapi", observe=metrics.upstream_observer("newsapi"))
+# Open Trivia DB allows one request per 5 seconds, so never retry it at once
+trivia_api = Upstream("opentdb", retries=0, observe=metrics.upstream_observer("opentdb"))
+
+# GET JSON through an Upstream; server errors and throttling count as failures.
+# Only 200 responses are kept as the stale fallback for `key`, which is
+# raised as StaleResult with its original fetch time.
+async def call_api(upstream, url, params=None, key=None):
+    async def attempt(timeout):
+        status, data = await fetch_json(url, params=params, timeout=timeout)
+        if status >= 500 or status == 429:
+            raise UpstreamError(f"{upstream.name} returned status {status}")
+        return status, data
+    return await upstream.call(attempt, key, cacheable=lambda result: result[0] == 200)
+
 logger = logging.getLogger(__name__)
 
-# Main menu buttons
-async def get_main_menu_buttons():
-    return [
-        [Button.inline("🌤️ Weather", b"weather_menu"), Button.inline("😂 Jokes", b"joke")],
-        [Button.inline("📰 News", b"news_menu"), Button.inline("🎮 Games", b"games_menu")],
-        [Button.inline("⏰ Reminders", b"reminder_menu"), Button.inline("📝 Notes", b"notes_menu")],
-        [Button.inline("⚙️ Settings", b"settings"), Button.inline("ℹ️ About", b"about")],
-        [Button.inline("❓ Help", b"help")]
-    ]
+# Static keyboards and texts, built once and shared by commands and callbacks
+screens = build_screens(NEWS_CATEGORIES)
+
+# Send a registered screen as a new message, or edit the current one to it
+async def respond_screen(event, key, *values):
+    text, buttons = screens.get(key, *values)
+    await outbound.respond(event, text, buttons=buttons)
+
+async def edit_screen(event, key, *values):
+    text, buttons = screens.get(key, *values)
+    await outbound.edit(event, text, buttons=buttons)
+
+# Current preference values in the order the settings screen takes them
+async def settings_values(user_id):
+    prefs = await storage.get_preferences(user_id)
+    return prefs['temperature_unit'], prefs['notifications'], prefs['theme']
 
 # Start command
-@client.on(events.NewMessage(pattern='/start'))
+@commands.command("start")
+@rate_limiter.limit()
 async def start(event):
     user = await event.get_sender()
-    user_id = event.sender_id
     username = user.username or user.first_name
     
-    # Initialize user preferences if not exists
-    if user_id not in user_preferences:
-        user_preferences[user_id] = {
-            "temperature_unit": "celsius",
-            "language": "english",
-            "notifications": True,
-            "theme": "light",
-            "notes": []
-        }
-    
     welcome_text = f"👋 Hello, {username}!\n\nI'm your personal assistant bot. How can I help you today?"
     
-    buttons = await get_main_menu_buttons()
-    await event.respond(welcome_text, buttons=buttons)
-    logger.info(f"User {event.sender_id} started the bot")
+    await outbound.respond(event, welcome_text, buttons=screens.keyboard("main_menu"))
+    logger.info("User %s started the bot", event.sender_id)
 
 # Help menu
-@client.on(events.NewMessage(pattern='/help'))
+@commands.command("help")
+@rate_limiter.limit()
 async def help_command(event):
-    buttons = [
-        [Button.inline("🤖 Bot Commands", b"help_commands")],
-        [Button.inline("🌐 Weather", b"help_weather"), Button.inline("📰 News", b"help_news")],
-        [Button.inline("😂 Jokes", b"help_jokes"), Button.inline("🎮 Games", b"help_games")],
-        [Button.inline("⏰ Reminders", b"help_reminders"), Button.inline("📝 Notes", b"help_notes")],
-        [Button.inline("⚙️ Settings", b"help_settings")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("Choose a help topic:", buttons=buttons)
+    await respond_screen(event, "help")
 
 # About command
-@client.on(events.NewMessage(pattern='/about'))
+@commands.command("about")
+@rate_limiter.limit()
 async def about_command(event):
-    about_text = (
-        "📱 **Telegram Assistant Bot**\n\n"
-        "I'm a versatile bot designed to make your Telegram experience better.\n"
-        "I can provide weather updates, tell jokes, deliver news, set reminders, and more!\n\n"
-        "Version: 2.1.0\n"
-        "Created with ❤️ using Telethon\n\n"
-        "Type /help to see all available commands."
-    )
-    buttons = [[Button.inline("🔙 Back to Main Menu", b"main_menu")]]
-    await event.respond(about_text, buttons=buttons)
+    await respond_screen(event, "about")
 
 # Weather command with city input
-@client.on(events.NewMessage(pattern='/weather'))
+@commands.command("weather")
+@rate_limiter.limit(weather_command_cost)
 async def weather_command(event):
     # Check if command includes a city
-    command_parts = event.message.text.split(' ', 1)
-    if len(command_parts) > 1:
-        city = command_parts[1].strip()
+    city = event.command.args
+    if city:
         weather_info, success = await get_weather_data(city)
         
-        buttons = [[Button.inline("🔙 Back to Weather Menu", b"weather_menu")]]
-        await event.respond(weather_info, buttons=buttons)
+        await outbound.respond(event, weather_info, buttons=screens.keyboard("back_to_weather"))
     else:
         buttons = [
             [Button.inline("🔍 Search City", b"weather_search")],
             [Button.location("📍 Share Location")],
             [Button.inline("🔙 Back to Main Menu", b"main_menu")]
         ]
-        await event.respond("How would you like to get the weather?", buttons=buttons)
+        await outbound.respond(event, "How would you like to get the weather?", buttons=buttons)
 
 # Location handler
-@client.on(events.NewMessage)
+@commands.location()
+@rate_limiter.limit(location_cost)
 async def handle_location(event):
     if event.geo:
         lat = event.geo.lat
         lon = event.geo.long
+        # A location shared while subscribing is for the daily digest
+        conversation = conversations.get(event.sender_id)
+        if conversation is not None and conversation.state == "waiting_for_digest_location":
+            await choose_digest_location(event, f"{lat},{lon}")
+            return True
         # Get weather based on coordinates
         weather_info, success = await get_weather_data(f"{lat},{lon}")
         
-        buttons = [[Button.inline("🔙 Back to Weather Menu", b"weather_menu")]]
-        await event.respond(weather_info, buttons=buttons)
+        await outbound.respond(event, weather_info, buttons=screens.keyboard("back_to_weather"))
         return True
     return False
 
 # City input handler
 async def get_weather_data(city):
-    try:
-        api_key = W_API
-        url = f'http://api.weatherapi.com/v1/forecast.json?q={city}&key={api_key}&days=3&aqi=yes&alerts=yes'
+    cache_key = normalize_location(city)
+    cached = weather_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    # Format the weather info with emojis
-                    location = data['location']
-                    current = data['current']
-                    forecast = data['forecast']['forecastday']
+    return await upstream_calls.do(("weather", cache_key), lambda: fetch_weather_data(city, cache_key))
+
+# Raw weatherapi forecast; `cache_key` keys the stale fallback
+async def request_weather(query, cache_key):
+    params = {'q': query, 'key': settings.weather_api_key, 'days': 3, 'aqi': 'yes', 'alerts': 'yes'}
+    return await call_api(weather_api, settings.weather_api_url, params=params, key=cache_key)
+
+def weather_emoji(condition):
+    condition = condition.lower()
+    if "rain" in condition:
+        return "🌧️"
+    if "cloud" in condition:
+        return "☁️"
+    if "snow" in condition:
+        return "❄️"
+    if "storm" in condition or "thunder" in condition:
+        return "⛈️"
+    if "fog" in condition or "mist" in condition:
+        return "🌫️"
+    return "☀️"
+
+async def fetch_weather_data(city, cache_key):
+    try:
+        try:
+            status, data = await request_weather(city, cache_key)
+            updated_at, fresh = time.time(), True
+        except StaleResult as stale:
+            (status, data), updated_at, fresh = stale.result, stale.fetched_at, False
+        if status == 200:
+            # Format the weather info with emojis
+            location = data['location']
+            current = data['current']
+            forecast = data['forecast']['forecastday']
                     
-                    condition = current['condition']['text']
-                    temp_c = current['temp_c']
-                    temp_f = current['temp_f']
-                    humidity = current['humidity']
-                    wind_kph = current['wind_kph']
+            condition = current['condition']['text']
+            temp_c = current['temp_c']
+            temp_f = current['temp_f']
+            humidity = current['humidity']
+            wind_kph = current['wind_kph']
                     
-                    # Add emojis based on condition
-                    condition_emoji = "☀️"
-                    if "rain" in condition.lower():
-                        condition_emoji = "🌧️"
-                    elif "cloud" in condition.lower():
-                        condition_emoji = "☁️"
-                    elif "snow" in condition.lower():
-                        condition_emoji = "❄️"
-                    elif "storm" in condition.lower() or "thunder" in condition.lower():
-                        condition_emoji = "⛈️"
-                    elif "fog" in condition.lower() or "mist" in condition.lower():
-                        condition_emoji = "🌫️"
+            # Add emojis based on condition
+            condition_emoji = weather_emoji(condition)
                     
-                    # Current weather
-                    weather_info = (
-                        f"🌡️ **Weather in {location['name']}, {location['country']}**\n\n"
-                        f"🌡️ Temperature: **{temp_c}°C** / **{temp_f}°F**\n"
-                        f"{condition_emoji} Condition: **{condition}**\n"
-                        f"💧 Humidity: **{humidity}%**\n"
-                        f"💨 Wind: **{wind_kph} km/h**\n"
-                    )
+            # Current weather
+            weather_info = (
+                f"🌡️ **Weather in {location['name']}, {location['country']}**\n\n"
+                f"🌡️ Temperature: **{temp_c}°C** / **{temp_f}°F**\n"
+                f"{condition_emoji} Condition: **{condition}**\n"
+                f"💧 Humidity: **{humidity}%**\n"
+                f"💨 Wind: **{wind_kph} km/h**\n"
+            )
                     
-                    # Air quality if available
-                    if 'air_quality' in current and 'us-epa-index' in current['air_quality']:
-                        aqi = current['air_quality']['us-epa-index']
-                        aqi_status = "Good 👍" if aqi <= 2 else "Moderate 👌" if aqi <= 4 else "Poor 👎"
-                        weather_info += f"🌬️ Air Quality: **{aqi_status}**\n"
+            # Air quality if available
+            if 'air_quality' in current and 'us-epa-index' in current['air_quality']:
+                aqi = current['air_quality']['us-epa-index']
+                aqi_status = "Good 👍" if aqi <= 2 else "Moderate 👌" if aqi <= 4 else "Poor 👎"
+                weather_info += f"🌬️ Air Quality: **{aqi_status}**\n"
                     
-                    # Add forecast for next 3 days
-                    weather_info += "\n**3-Day Forecast:**\n"
-                    for day in forecast:
-                        date = datetime.strptime(day['date'], '%Y-%m-%d').strftime('%a, %b %d')
-                        day_condition = day['day']['condition']['text']
-                        day_emoji = "☀️"
-                        if "rain" in day_condition.lower():
-                            day_emoji = "🌧️"
-                        elif "cloud" in day_condition.lower():
-                            day_emoji = "☁️"
-                        elif "snow" in day_condition.lower():
-                            day_emoji = "❄️"
+            # Add forecast for next 3 days
+            weather_info += "\n**3-Day Forecast:**\n"
+            for day in forecast:
+                date = datetime.strptime(day['date'], '%Y-%m-%d').strftime('%a, %b %d')
+                day_condition = day['day']['condition']['text']
+                day_emoji = "☀️"
+                if "rain" in day_condition.lower():
+                    day_emoji = "🌧️"
+                elif "cloud" in day_condition.lower():
+                    day_emoji = "☁️"
+                elif "snow" in day_condition.lower():
+                    day_emoji = "❄️"
                         
-                        weather_info += (
-                            f"• **{date}**: {day_emoji} {day_condition}, "
-                            f"Max: {day['day']['maxtemp_c']}°C, Min: {day['day']['mintemp_c']}°C\n"
-                        )
+                weather_info += (
+                    f"• **{date}**: {day_emoji} {day_condition}, "
+                    f"Max: {day['day']['maxtemp_c']}°C, Min: {day['day']['mintemp_c']}°C\n"
+                )
                     
-                    weather_info += f"\n📅 Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                    return weather_info, True
-                else:
-                    return f"Sorry, I couldn't fetch the weather for '{city}'. Please check the spelling or try another location.", False
+            weather_info += f"\n📅 Last Updated: {datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')}"
+            if fresh:
+                weather_cache.set(cache_key, (weather_info, True))
+            else:
+                # Not cached, so the next request tries the provider again
+                weather_info += "\n⚠️ The weather service is unavailable; this is the last known report."
+            return weather_info, True
+        else:
+            return f"Sorry, I couldn't fetch the weather for '{city}'. Please check the spelling or try another location.", False
     except Exception as e:
-        logger.error(f"Weather error: {str(e)}")
+        logger.error("Weather error: %r", e)
         return "An error occurred while fetching the weather. Please try again.", False
 
 # Weather city search conversation handler
-@client.on(events.CallbackQuery(data=b"weather_search"))
+@callbacks.route("weather_search")
 async def weather_search(event):
-    await event.edit("Please type the city name (e.g., 'London', 'New York'):")
+    await outbound.edit(event, "Please type the city name (e.g., 'London', 'New York'):")
     
     # Set a flag to indicate we're waiting for a city
     user_id = event.sender_id
-    user_states[user_id] = "waiting_for_city"
+    conversations.set(user_id, "waiting_for_city")
 
 # Weather button callback
-@client.on(events.CallbackQuery(data=b"weather_menu"))
+@callbacks.route("weather_menu")
 async def weather_menu_callback(event):
-    buttons = [
-        [Button.inline("🔍 Search City", b"weather_search")],
-        [Button.inline("🌡️ Weather Forecast", b"weather_forecast")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.edit("Weather Menu:", buttons=buttons)
+    await edit_screen(event, "weather_menu")
 
 # Weather forecast callback
-@client.on(events.CallbackQuery(data=b"weather_forecast"))
+@callbacks.route("weather_forecast")
 async def weather_forecast_callback(event):
-    await event.edit("Please type the city name for a forecast:")
+    await outbound.edit(event, "Please type the city name for a forecast:")
     
     # Set a flag to indicate we're waiting for a city for forecast
     user_id = event.sender_id
-    user_states[user_id] = "waiting_for_forecast_city"
+    conversations.set(user_id, "waiting_for_forecast_city")
 
 # Handle text messages for various inputs
-@client.on(events.NewMessage(func=lambda e: e.text and not e.text.startswith('/')))
+@commands.text()
+@rate_limiter.limit(text_input_cost)
 async def handle_text_input(event):
+    return await conversations.dispatch(event)
+
+@conversations.state("waiting_for_city")
+async def waiting_for_city(event, conversation):
     user_id = event.sender_id
+    city = event.text.strip()
+    weather_info, success = await get_weather_data(city)
     
-    if user_id not in user_states:
-        return False
-        
-    state = user_states[user_id]
+    await outbound.respond(event, weather_info, buttons=screens.keyboard("back_to_weather"))
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_forecast_city")
+async def waiting_for_forecast_city(event, conversation):
+    user_id = event.sender_id
+    city = event.text.strip()
+    weather_info, success = await get_weather_data(city)
+    
+    await outbound.respond(event, weather_info, buttons=screens.keyboard("back_to_weather"))
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_note_title")
+async def waiting_for_note_title(event, conversation):
+    user_id = event.sender_id
+    note_title = event.text.strip()
+    conversations.set(user_id, "waiting_for_note_content", title=note_title)
+    await outbound.respond(event, f"📝 Title: **{note_title}**\n\nNow please type the content of your note:")
+
+@conversations.state("waiting_for_reminder_text")
+async def waiting_for_reminder_text(event, conversation):
+    user_id = event.sender_id
+    reminder_text = event.text.strip()
+    conversations.set(user_id, "waiting_for_reminder_time", text=reminder_text)
+    await outbound.respond(event, 
+        f"📝 Reminder text: **{reminder_text}**\n\n"
+        "Now please specify when to remind you.\n"
+        "Examples: 10m (10 minutes), 2h (2 hours), 1d (1 day), or enter a specific time like '14:30'"
+    )
+
+@conversations.state("waiting_for_note_content")
+async def waiting_for_note_content(event, conversation):
+    user_id = event.sender_id
+    note_content = event.text.strip()
+    note_title = conversation.data["title"]
+    
+    # Save the note
+    note = await notes.create(user_id, note_title, note_content)
+    note_id = note["id"]
+    
+    await outbound.respond(event, f"✅ Note saved successfully!\n\nTitle: **{note_title}**\nID: {note_id}", buttons=screens.keyboard("note_saved"))
     
-    # Skip if no active state
-    if state is None:
-        return False
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_reminder_time")
+async def waiting_for_reminder_time(event, conversation):
+    user_id = event.sender_id
+    time_input = event.text.strip().lower()
+    reminder_text = conversation.data["text"]
+    
+    # Parse the time input
+    delay_seconds = 0
+    reminder_time = None
+    
+    # Try to match patterns like "5m", "2h", "1d"
+    time_match = re.match(r"(\d+)([mhd])", time_input)
+    if time_match:
+        value = int(time_match.group(1))
+        unit = time_match.group(2)
         
-    # If state is a string (for simple states)
-    if isinstance(state, str):
-        if state == "waiting_for_city":
-            city = event.text.strip()
-            weather_info, success = await get_weather_data(city)
-            
-            buttons = [[Button.inline("🔙 Back to Weather Menu", b"weather_menu")]]
-            await event.respond(weather_info, buttons=buttons)
-            
-            # Reset the state
-            user_states[user_id] = None
-            return True
-            
-        elif state == "waiting_for_forecast_city":
-            city = event.text.strip()
-            weather_info, success = await get_weather_data(city)
-            
-            buttons = [[Button.inline("🔙 Back to Weather Menu", b"weather_menu")]]
-            await event.respond(weather_info, buttons=buttons)
-            
-            # Reset the state
-            user_states[user_id] = None
-            return True
-            
-        elif state == "waiting_for_note_title":
-            note_title = event.text.strip()
-            user_states[user_id] = {"state": "waiting_for_note_content", "title": note_title}
-            await event.respond(f"📝 Title: **{note_title}**\n\nNow please type the content of your note:")
-            return True
+        if unit == 'm':
+            delay_seconds = value * 60
+        elif unit == 'h':
+            delay_seconds = value * 60 * 60
+        elif unit == 'd':
+            delay_seconds = value * 24 * 60 * 60
             
-        elif state == "waiting_for_reminder_text":
-            reminder_text = event.text.strip()
-            user_states[user_id] = {"state": "waiting_for_reminder_time", "text": reminder_text}
-            await event.respond(
-                f"📝 Reminder text: **{reminder_text}**\n\n"
-                "Now please specify when to remind you.\n"
-                "Examples: 10m (10 minutes), 2h (2 hours), 1d (1 day), or enter a specific time like '14:30'"
-            )
-            return True
-            
-    # If state is a dictionary (for complex states)
-    elif isinstance(state, dict):
-        if state.get("state") == "waiting_for_note_content":
-            note_content = event.text.strip()
-            note_title = state.get("title", "Untitled")
+        reminder_time = datetime.now() + timedelta(seconds=delay_seconds)
+    else:
+        # Try to match specific time like "14:30"
+        time_match = re.match(r"(\d{1,2}):(\d{2})", time_input)
+        if time_match:
+            hours = int(time_match.group(1))
+            minutes = int(time_match.group(2))
             
-            # Ensure user has preferences initialized
-            if user_id not in user_preferences:
-                user_preferences[user_id] = {"notes": []}
-            elif "notes" not in user_preferences[user_id]:
-                user_preferences[user_id]["notes"] = []
+            now = datetime.now()
+            reminder_time = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
             
-            # Generate note ID
-            note_id = 1
-            if user_preferences[user_id]["notes"]:
-                note_id = max(note["id"] for note in user_preferences[user_id]["notes"]) + 1
+            # If the time is already passed today, set it for tomorrow
+            if reminder_time < now:
+                reminder_time += timedelta(days=1)
                 
-            # Save the note
-            user_preferences[user_id]["notes"].append({
-                "id": note_id,
-                "title": note_title,
-                "content": note_content,
-                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            })
-            
-            buttons = [[Button.inline("📝 View Notes", b"view_notes"), Button.inline("🔙 Main Menu", b"main_menu")]]
-            await event.respond(f"✅ Note saved successfully!\n\nTitle: **{note_title}**\nID: {note_id}", buttons=buttons)
-            
-            # Reset the state
-            user_states[user_id] = None
-            return True
+            delay_seconds = (reminder_time - now).total_seconds()
+        else:
+            # Invalid time format
+            await outbound.respond(event, 
+                "⚠️ Invalid time format. Please use formats like:\n"
+                "10m (10 minutes)\n"
+                "2h (2 hours)\n"
+                "1d (1 day)\n"
+                "14:30 (specific time)"
+            )
+            return
+    
+    # Generate reminder ID
+    reminders = await storage.get_reminders(user_id)
+    reminder_id = 1
+    if reminders:
+        reminder_id = max(reminder["id"] for reminder in reminders) + 1
         
-        elif state.get("state") == "waiting_for_reminder_time":
-            time_input = event.text.strip().lower()
-            reminder_text = state.get("text", "Reminder")
-            
-            # Parse the time input
-            delay_seconds = 0
-            reminder_time = None
-            
-            # Try to match patterns like "5m", "2h", "1d"
-            time_match = re.match(r"(\d+)([mhd])", time_input)
-            if time_match:
-                value = int(time_match.group(1))
-                unit = time_match.group(2)
-                
-                if unit == 'm':
-                    delay_seconds = value * 60
-                elif unit == 'h':
-                    delay_seconds = value * 60 * 60
-                elif unit == 'd':
-                    delay_seconds = value * 24 * 60 * 60
-                    
-                reminder_time = datetime.now() + timedelta(seconds=delay_seconds)
-            else:
-                # Try to match specific time like "14:30"
-                time_match = re.match(r"(\d{1,2}):(\d{2})", time_input)
-                if time_match:
-                    hours = int(time_match.group(1))
-                    minutes = int(time_match.group(2))
-                    
-                    now = datetime.now()
-                    reminder_time = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
-                    
-                    # If the time is already passed today, set it for tomorrow
-                    if reminder_time < now:
-                        reminder_time += timedelta(days=1)
-                        
-                    delay_seconds = (reminder_time - now).total_seconds()
-                else:
-                    # Invalid time format
-                    await event.respond(
-                        "⚠️ Invalid time format. Please use formats like:\n"
-                        "10m (10 minutes)\n"
-                        "2h (2 hours)\n"
-                        "1d (1 day)\n"
-                        "14:30 (specific time)"
-                    )
-                    return True
-            
-            # Initialize reminders for this user if not exists
-            if user_id not in user_reminders:
-                user_reminders[user_id] = []
-                
-            # Generate reminder ID
-            reminder_id = 1
-            if user_reminders[user_id]:
-                reminder_id = max(reminder["id"] for reminder in user_reminders[user_id]) + 1
-                
-            # Add the reminder
-            reminder = {
-                "id": reminder_id,
-                "text": reminder_text,
-                "time": reminder_time.timestamp() if reminder_time else (time.time() + delay_seconds),
-                "created_at": time.time()
-            }
-            user_reminders[user_id].append(reminder)
-            
-            # Schedule the reminder
-            asyncio.create_task(send_reminder(user_id, reminder_id, reminder_text, delay_seconds))
-            
-            formatted_time = reminder_time.strftime('%Y-%m-%d %H:%M:%S') if reminder_time else f"in {time_input}"
-            
-            buttons = [[Button.inline("⏰ View Reminders", b"view_reminders"), Button.inline("🔙 Main Menu", b"main_menu")]]
-            await event.respond(
-                f"✅ Reminder set successfully!\n\n"
-                f"📝 {reminder_text}\n"
-                f"⏰ {formatted_time}\n"
-                f"🆔 Reminder ID: {reminder_id}",
-                buttons=buttons
+    # Add the reminder
+    reminder = {
+        "id": reminder_id,
+        "text": reminder_text,
+        "time": reminder_time.timestamp() if reminder_time else (time.time() + delay_seconds),
+        "created_at": time.time()
+    }
+    
+    # Save and schedule the reminder
+    await reminder_scheduler.add(user_id, reminder)
+    
+    formatted_time = reminder_time.strftime('%Y-%m-%d %H:%M:%S') if reminder_time else f"in {time_input}"
+    
+    await outbound.respond(event, 
+        f"✅ Reminder set successfully!\n\n"
+        f"📝 {reminder_text}\n"
+        f"⏰ {formatted_time}\n"
+        f"🆔 Reminder ID: {reminder_id}",
+        buttons=screens.keyboard("reminder_saved")
+    )
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("playing_number_guess", timeout=1800)
+async def playing_number_guess(event, conversation):
+    user_id = event.sender_id
+    try:
+        guess = int(event.text.strip())
+        target = conversation.data["number"]
+        attempts = conversation.data["attempts"] + 1
+        
+        if guess < 1 or guess > 100:
+            await outbound.respond(event, "Please enter a valid number between 1 and 100!")
+            return
+        
+        if guess == target:
+            await outbound.respond(event, 
+                f"🎉 Congratulations! You got it in {attempts} attempts!\n"
+                f"The number was {target}",
+                buttons=screens.keyboard("number_result")
             )
-            
-            # Reset the state
-            user_states[user_id] = None
-            return True
-            
-        elif state.get("state") == "playing_number_guess":
-            try:
-                guess = int(event.text.strip())
-                target = state.get("number")
-                attempts = state.get("attempts", 0) + 1
-                
-                if guess < 1 or guess > 100:
-                    await event.respond("Please enter a valid number between 1 and 100!")
-                    return True
-                
-                if guess == target:
-                    buttons = [
-                        [Button.inline("🎮 Play Again", b"game_number")],
-                        [Button.inline("🔙 Games Menu", b"games_menu")]
-                    ]
-                    await event.respond(
-                        f"🎉 Congratulations! You got it in {attempts} attempts!\n"
-                        f"The number was {target}",
-                        buttons=buttons
-                    )
-                    user_states[user_id] = None
-                else:
-                    hint = "higher" if guess < target else "lower"
-                    user_states[user_id]["attempts"] = attempts
-                    await event.respond(f"Try {hint}! (Attempt {attempts})")
-            except ValueError:
-                await event.respond("Please enter a valid number between 1 and 100!")
-            return True
+            conversations.clear(user_id)
+        else:
+            hint = "higher" if guess < target else "lower"
+            conversation.data["attempts"] = attempts
+            await outbound.respond(event, f"Try {hint}! (Attempt {attempts})")
+    except ValueError:
+        await outbound.respond(event, "Please enter a valid number between 1 and 100!")
+
+@conversations.state("waiting_for_note_search")
+async def waiting_for_note_search(event, conversation):
+    user_id = event.sender_id
+    query = event.text.strip()
+    matches = await notes.search(user_id, query, limit=NOTE_SEARCH_LIMIT)
     
-    return False
+    buttons = screens.keyboard("note_search")
+    if not matches:
+        await outbound.respond(event, f"No notes found for '{query}'.", buttons=buttons)
+    else:
+        results_text = f"🔍 **Notes matching '{query}':**\n\n"
+        for note in matches:
+            results_text += f"**{note['title']}** (ID: {note['id']})\n"
+        await outbound.respond(event, results_text, buttons=buttons)
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_note_id")
+async def waiting_for_note_id(event, conversation):
+    user_id = event.sender_id
+    try:
+        note_id = int(event.text.strip())
+    except ValueError:
+        await outbound.respond(event, "Please enter a valid note ID (a number).")
+        return
+    
+    note = await notes.get(user_id, note_id)
+    buttons = screens.keyboard("note_result")
+    if note is None:
+        await outbound.respond(event, f"⚠️ No note found with ID {note_id}.", buttons=buttons)
+    else:
+        await outbound.respond(event, 
+            f"📝 **{note['title']}**\n\n"
+            f"{note['content']}\n\n"
+            f"Created: {note.get('created_at', 'Unknown date')}\n"
+            f"ID: {note['id']}",
+            buttons=buttons
+        )
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_note_delete_id")
+async def waiting_for_note_delete_id(event, conversation):
+    user_id = event.sender_id
+    try:
+        note_id = int(event.text.strip())
+    except ValueError:
+        await outbound.respond(event, "Please enter a valid note ID (a number).")
+        return
+    
+    buttons = screens.keyboard("note_result")
+    if await notes.delete(user_id, note_id):
+        await outbound.respond(event, f"🗑️ Note {note_id} deleted.", buttons=buttons)
+    else:
+        await outbound.respond(event, f"⚠️ No note found with ID {note_id}.", buttons=buttons)
+    
+    # Reset the state
+    conversations.clear(user_id)
+
+@conversations.state("waiting_for_reminder_delete_id")
+async def waiting_for_reminder_delete_id(event, conversation):
+    user_id = event.sender_id
+    try:
+        reminder_id = int(event.text.strip())
+    except ValueError:
+        await outbound.respond(event, "Please enter a valid reminder ID (a number).")
+        return
+    
+    buttons = screens.keyboard("reminder_result")
+    if await reminder_scheduler.cancel(user_id, reminder_id):
+        await outbound.respond(event, f"🗑️ Reminder {reminder_id} deleted.", buttons=buttons)
+    else:
+        await outbound.respond(event, f"⚠️ No reminder found with ID {reminder_id}.", buttons=buttons)
+    
+    # Reset the state
+    conversations.clear(user_id)
 
 # Function to send reminder when time is up
-async def send_reminder(user_id, reminder_id, text, delay_seconds):
-    await asyncio.sleep(delay_seconds)
+async def send_reminder(user_id, reminder):
+    text = reminder["text"]
     
-    # Check if reminder still exists
-    if user_id in user_reminders:
-        reminder_exists = False
-        for reminder in user_reminders[user_id]:
-            if reminder["id"] == reminder_id:
-                reminder_exists = True
-                break
-        
-        if reminder_exists:
-            # Remove the reminder
-            user_reminders[user_id] = [r for r in user_reminders[user_id] if r["id"] != reminder_id]
-            
-            # Send the reminder
-            buttons = [[Button.inline("⏰ Set New Reminder", b"set_reminder"), Button.inline("🔙 Main Menu", b"main_menu")]]
-            try:
-                await client.send_message(
-                    user_id,
-                    f"⏰ **REMINDER**\n\n📝 {text}\n\n⌚ Time's up!",
-                    buttons=buttons
-                )
-                logger.info(f"Reminder sent to user {user_id}: {text}")
-            except Exception as e:
-                logger.error(f"Failed to send reminder to {user_id}: {e}")
+    # Send the reminder
+    buttons = screens.keyboard("reminder_delivered")
+    try:
+        await outbound.send(
+            user_id,
+            lambda: client.send_message(user_id, f"⏰ **REMINDER**\n\n📝 {text}\n\n⌚ Time's up!", buttons=buttons),
+            lane=NOTIFICATION
+        )
+        logger.info("Reminder sent to user %s: %s", user_id, text)
+    except Exception as e:
+        logger.error("Failed to send reminder to %s: %s", user_id, e)
+
+# Whether this process handles the given user (always true in single-process mode)
+def owns_user(user_id):
+    if settings.worker_shard is None:
+        return True
+    from cluster import shard_for
+    return shard_for(user_id, settings.workers) == settings.worker_shard
+
+# Pending reminders, persisted through storage so they survive restarts
+reminder_scheduler = ReminderScheduler(send_reminder, storage, on_change=reminders_pages.invalidate, owns=owns_user)
+
+# Forecast for a digest location; None if it can't be fetched. Concurrent
+# requests for the same location share one upstream call.
+async def fetch_digest_weather(location):
+    try:
+        status, data = await upstream_calls.do(("forecast", location), lambda: request_weather(location, location))
+    except StaleResult as stale:
+        # An older forecast still beats skipping the day's digest
+        status, data = stale.result
+    except Exception as e:
+        logger.error("Digest weather error for %s: %r", location, e)
+        return None
+    return data if status == 200 else None
+
+# Daily digest text in one temperature unit
+def format_digest(data, unit):
+    suffix, symbol = ("f", "°F") if unit == "fahrenheit" else ("c", "°C")
+    location = data['location']
+    current = data['current']
+    today = data['forecast']['forecastday'][0]['day']
+    condition = current['condition']['text']
+    return (
+        f"📬 **Daily Weather for {location['name']}, {location['country']}**\n\n"
+        f"{weather_emoji(condition)} Now: **{current[f'temp_{suffix}']}{symbol}**, {condition}\n"
+        f"📅 Today: {today['condition']['text']}, "
+        f"Max: {today[f'maxtemp_{suffix}']}{symbol}, Min: {today[f'mintemp_{suffix}']}{symbol}\n"
+        f"💧 Humidity: **{current['humidity']}%**\n"
+        f"💨 Wind: **{current['wind_kph']} km/h**"
+    )
+
+# Queue a digest behind interactive replies; returns the send's future
+def send_digest(user_id, text):
+    buttons = screens.keyboard("digest_delivered")
+    return outbound.submit(user_id, lambda: client.send_message(user_id, text, buttons=buttons), lane=NOTIFICATION)
+
+# Digest menu: the current subscription, or an offer to subscribe
+def digest_screen(user_id):
+    digest = digests.get(user_id)
+    if digest is None:
+        return ("digest_off",)
+    return ("digest_on", digest["label"], digest["time"])
+
+@commands.command("digest")
+@rate_limiter.limit()
+async def digest_command(event):
+    await respond_screen(event, *digest_screen(event.sender_id))
+
+@callbacks.route("digest_menu")
+async def digest_menu_callback(event):
+    await edit_screen(event, *digest_screen(event.sender_id))
+
+@callbacks.route("digest_subscribe")
+async def digest_subscribe_callback(event):
+    await outbound.edit(event, "📬 Type a city name or share your location for your daily forecast:")
+    conversations.set(event.sender_id, "waiting_for_digest_location")
+
+@callbacks.route("digest_unsubscribe")
+async def digest_unsubscribe_callback(event):
+    await digests.unsubscribe(event.sender_id)
+    await edit_screen(event, "digest_cancelled")
+
+# Check a digest location with one fetch, then ask for the delivery time
+async def choose_digest_location(event, query):
+    location = normalize_location(query)
+    data = await fetch_digest_weather(location)
+    if data is None:
+        await outbound.respond(event, f"Sorry, I couldn't find weather for '{query}'. Please try another city:")
+        return
+    place = data['location']
+    label = f"{place['name']}, {place['country']}"
+    conversations.set(
+        event.sender_id, "waiting_for_digest_time",
+        location=location, label=label, tz=place.get('tz_id') or "UTC"
+    )
+    await outbound.respond(event, 
+        f"📍 **{label}**\n\n"
+        "What time should your forecast arrive each day?\n"
+        "Use the local time there, e.g. 07:30"
+    )
+
+@conversations.state("waiting_for_digest_location")
+async def waiting_for_digest_location(event, conversation):
+    await choose_digest_location(event, event.text.strip())
+
+@conversations.state("waiting_for_digest_time")
+async def waiting_for_digest_time(event, conversation):
+    user_id = event.sender_id
+    time_match = re.fullmatch(r"(\d{1,2}):(\d{2})", event.text.strip())
+    if not time_match or int(time_match.group(1)) > 23 or int(time_match.group(2)) > 59:
+        await outbound.respond(event, "⚠️ Invalid time format. Please use HH:MM, e.g. 07:30 or 18:00")
+        return
+    
+    delivery_time = f"{int(time_match.group(1)):02d}:{time_match.group(2)}"
+    unit = (await storage.get_preferences(user_id))['temperature_unit']
+    digest = {**conversation.data, "time": delivery_time, "unit": unit}
+    await digests.subscribe(user_id, digest)
+    
+    await outbound.respond(event, 
+        f"✅ Daily forecast set!\n\n"
+        f"📍 {digest['label']}\n"
+        f"⏰ Every day at {delivery_time}",
+        buttons=screens.keyboard("digest_saved")
+    )
+    
+    # Reset the state
+    conversations.clear(user_id)
 
 # Joke command
-@client.on(events.NewMessage(pattern='/joke'))
+@commands.command("joke")
+@rate_limiter.limit()
 async def joke_command(event):
     joke_text = await get_joke()
-    
-    buttons = [
-        [Button.inline("😂 Another Joke", b"joke")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond(joke_text, buttons=buttons)
+    await outbound.respond(event, joke_text, buttons=screens.keyboard("joke"))
 
 # Function to get a joke
 async def get_joke():
-    joke_apis = [
-        'https://official-joke-api.appspot.com/random_joke',
-        'https://v2.jokeapi.dev/joke/Any?blacklistFlags=nsfw,religious,political,racist,sexist&type=twopart'
-    ]
-    
-    api_url = random.choice(joke_apis)
-    
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    if api_url.startswith('https://official-joke-api'):
-                        joke_text = f"😂 **Joke Time!**\n\n{data['setup']}\n\n🤣 {data['punchline']}"
-                    else:
-                        joke_text = f"😂 **Joke Time!**\n\n{data['setup']}\n\n🤣 {data['delivery']}"
-                    
-                    return joke_text
-                else:
-                    return "Sorry, I couldn't fetch a joke right now. Please try again later."
-    except Exception as e:
-        logger.error(f"Joke error: {str(e)}")
-        return "Sorry, I couldn't fetch a joke right now. Please try again later."
+    joke_text = await joke_pool.get()
+    return joke_text or "Sorry, I couldn't fetch a joke right now. Please try again later."
+
+def format_joke(setup, punchline):
+    return f"😂 **Joke Time!**\n\n{setup}\n\n🤣 {punchline}"
+
+async def fetch_official_jokes(amount, timeout):
+    # This API only serves fixed batches of ten
+    status, data = await fetch_json(settings.official_joke_api_url, timeout=timeout)
+    if status != 200 or not data:
+        raise UpstreamError(f"official-joke-api returned status {status}")
+    return [format_joke(joke['setup'], joke['punchline']) for joke in data[:amount]]
+
+async def fetch_jokeapi_jokes(amount, timeout):
+    status, data = await fetch_json(
+        settings.jokeapi_url,
+        params={'blacklistFlags': 'nsfw,religious,political,racist,sexist', 'type': 'twopart', 'amount': amount},
+        timeout=timeout
+    )
+    if status != 200 or not data or data.get('error'):
+        raise UpstreamError(f"jokeapi returned status {status}")
+    jokes = data['jokes'] if 'jokes' in data else [data]
+    return [format_joke(joke['setup'], joke['delivery']) for joke in jokes]
 
 # News command
-@client.on(events.NewMessage(pattern='/news'))
+@commands.command("news")
+@rate_limiter.limit()
 async def news_command(event):
-    buttons = [
-        [Button.inline("🌍 World", b"news_world"), Button.inline("💼 Business", b"news_business")],
-        [Button.inline("🏥 Health", b"news_health"), Button.inline("🔬 Science", b"news_science")],
-        [Button.inline("⚽ Sports", b"news_sports"), Button.inline("💻 Technology", b"news_technology")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("📰 Select a news category:", buttons=buttons)
+    await respond_screen(event, "news_menu")
 
 # Function to get news
 async def get_news(category='general'):
+    return await news_feed.get(category)
+
+async def load_news(category):
+    return await upstream_calls.do(("news", category), lambda: fetch_news(category))
+
+async def fetch_news(category):
     try:
-        api_key = NEWS_API
+        api_key = settings.news_api_key
         if not api_key:
-            return "News API key is missing. Please set the NEWS_API environment variable."
+            return "News API key is missing. Please set the NEWS_API environment variable.", False
             
-        url = f'https://newsapi.org/v2/top-headlines?category={category}&pageSize=5&apiKey={api_key}'
+        url = settings.news_api_url
+        params = {'category': NEWS_API_CATEGORIES.get(category, category), 'pageSize': 5, 'apiKey': api_key}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    
-                    if data['status'] == 'ok' and data['totalResults'] > 0:
-                        news_text = f"📰 **Top {category.capitalize()} News:**\n\n"
+        try:
+            status, data = await call_api(news_api, url, params=params, key=category)
+            updated_at, fresh = time.time(), True
+        except StaleResult as stale:
+            (status, data), updated_at, fresh = stale.result, stale.fetched_at, False
+        if status == 200:
+            if data['status'] == 'ok' and data['totalResults'] > 0:
+                news_text = f"📰 **Top {category.capitalize()} News:**\n\n"
                         
-                        for i, article in enumerate(data['articles'][:5], 1):
-                            title = article['title']
-                            source = article['source']['name']
-                            description = article.get('description', 'No description available')
+                for i, article in enumerate(data['articles'][:5], 1):
+                    title = article['title']
+                    source = article['source']['name']
+                    description = article.get('description', 'No description available')
                             
-                            news_text += f"**{i}. {title}**\n"
-                            news_text += f"Source: {source}\n"
-                            news_text += f"{description}\n\n"
+                    news_text += f"**{i}. {title}**\n"
+                    news_text += f"Source: {source}\n"
+                    news_text += f"{description}\n\n"
                         
-                        news_text += f"📅 Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                        return news_text
-                    else:
-                        return f"No news available for the {category} category at the moment."
-                else:
-                    return f"Error: API returned status code {response.status}. Please check your News API key."
+                news_text += f"📅 Last Updated: {datetime.fromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S')}"
+                if not fresh:
+                    news_text += "\n⚠️ News is unavailable right now; these are the last known headlines."
+                # Stale headlines are shown but not stored by the news feed as fresh
+                return news_text, fresh
+            else:
+                return f"No news available for the {category} category at the moment.", False
+        else:
+            return f"Error: API returned status code {status}. Please check your News API key.", False
     except Exception as e:
-        logger.error(f"News error: {str(e)}")
-        return "Sorry, I couldn't fetch the news right now. Please try again later."
+        logger.error("News error: %r", e)
+        return "Sorry, I couldn't fetch the news right now. Please try again later.", False
 
 # Notes command
-@client.on(events.NewMessage(pattern='/notes'))
+@commands.command("notes")
+@rate_limiter.limit()
 async def notes_command(event):
     await notes_menu(event)
 
 async def notes_menu(event):
-    buttons = [
-        [Button.inline("📝 Create Note", b"create_note"), Button.inline("📋 View Notes", b"view_notes")],
-        [Button.inline("🔍 Find Note", b"find_note"), Button.inline("🗑️ Delete Note", b"delete_note")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("📝 Notes Menu:", buttons=buttons)
+    await respond_screen(event, "notes_menu")
 
 # Reminders command
-@client.on(events.NewMessage(pattern='/reminders'))
+@commands.command("reminders")
+@rate_limiter.limit()
 async def reminders_command(event):
     await reminder_menu(event)
 
 async def reminder_menu(event):
-    buttons = [
-        [Button.inline("⏰ Set Reminder", b"set_reminder"), Button.inline("📋 View Reminders", b"view_reminders")],
-        [Button.inline("🗑️ Delete Reminder", b"delete_reminder")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("⏰ Reminders Menu:", buttons=buttons)
+    await respond_screen(event, "reminder_menu")
 
 # Games command
-@client.on(events.NewMessage(pattern='/games'))
+@commands.command("games")
+@rate_limiter.limit()
 async def games_command(event):
     await games_menu(event)
 
 async def games_menu(event):
-    buttons = [
-        [Button.inline("🎲 Dice Game", b"game_dice"), Button.inline("🔢 Number Guess", b"game_number")],
-        [Button.inline("✂️ Rock Paper Scissors", b"game_rps"), Button.inline("🎯 Trivia", b"game_trivia")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("🎮 Games Menu:", buttons=buttons)
+    await respond_screen(event, "games_menu")
 
 # Settings command
-@client.on(events.NewMessage(pattern='/settings'))
+@commands.command("settings")
+@rate_limiter.limit()
 async def settings_command(event):
-    user_id = event.sender_id
-    
-    # Initialize user preferences if not exists
-    if user_id not in user_preferences:
-        user_preferences[user_id] = {
-            "temperature_unit": "celsius",
-            "language": "english",
-            "notifications": True,
-            "theme": "light",
-            "notes": []
-        }
-    
-    buttons = [
-        [Button.inline("🌡️ Temperature Unit", b"settings_temp"), Button.inline("🔔 Notifications", b"settings_notif")],
-        [Button.inline("🎨 Theme", b"settings_theme")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.respond("⚙️ Settings Menu:", buttons=buttons)
+    await respond_screen(event, "settings", *await settings_values(event.sender_id))
 
 # Features command
-@client.on(events.NewMessage(pattern='/features'))
+@commands.command("features")
+@rate_limiter.limit()
 async def features_command(event):
-    features_text = (
-        "🔍 **Available Features:**\n\n"
-        "• 🌤️ **Weather**: Get current weather and forecasts\n"
-        "• 😂 **Jokes**: Enjoy random jokes\n"
-        "• 📰 **News**: Read the latest news by category\n"
-        "• 📝 **Notes**: Create and manage notes\n"
-        "• ⏰ **Reminders**: Set and manage reminders\n"
-        "• 🎮 **Games**: Play fun mini-games\n"
-        "• ⚙️ **Settings**: Customize your experience\n"
-        "• ❓ **Help**: Get assistance with bot commands\n"
-        "• ℹ️ **About**: Learn more about this bot\n\n"
-        "What would you like to try?"
-    )
-    buttons = await get_main_menu_buttons()
-    await event.respond(features_text, buttons=buttons)
+    await respond_screen(event, "features")
 
 # Joke callback
-@client.on(events.CallbackQuery(data=b"joke"))
+@callbacks.route("joke")
 async def joke_callback(event):
     joke_text = await get_joke()
-    buttons = [
-        [Button.inline("😂 Another Joke", b"joke")],
-        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-    ]
-    await event.edit(joke_text, buttons=buttons)
+    await outbound.edit(event, joke_text, buttons=screens.keyboard("joke"))
+
+# Function to get a trivia question
+async def get_trivia_question(user_id):
+    return await trivia_pool.next(user_id)
+
+async def fetch_trivia_questions(amount):
+    status, data = await call_api(trivia_api, settings.trivia_api_url, params={'amount': amount, 'type': 'multiple'})
+    if status == 200 and data['response_code'] == 0:
+        return data['results']
+    logger.warning("Trivia API returned status %s, response code %s", status, data and data.get('response_code'))
+    return []
+
+# Every incoming message goes through the command router, queued behind
+# the user's earlier updates. The returned future resolves once it has run.
+@log_context()
+@metrics.instrument(in_flight=False)
+async def handle_message(event):
+    return await mailboxes.submit(event.sender_id, lambda: commands.dispatch(event))
 
 # Callback query handlers
-@client.on(events.CallbackQuery)
+@log_context()
+@metrics.instrument(in_flight=False)
 async def handle_callback(event):
-    data = event.data.decode('utf-8')
+    return await mailboxes.submit(event.sender_id, lambda: route_callback(event))
+
+@rate_limiter.limit(callback_cost)
+async def route_callback(event):
+    await callbacks.dispatch(event)
+
+# Main menu handlers
+@callbacks.route("main_menu")
+async def main_menu_callback(event):
+    await edit_screen(event, "main_menu")
+
+@callbacks.route("about")
+async def about_callback(event):
+    await edit_screen(event, "about")
+
+@callbacks.route("help")
+async def help_callback(event):
+    await edit_screen(event, "help")
+
+# Help submenu handlers
+@callbacks.route(*HELP_TOPICS)
+async def help_topic_callback(event):
+    await edit_screen(event, event.data.decode())
+
+# News category handlers
+@callbacks.prefix("news_")
+async def news_category_callback(event, category):
+    if category not in NEWS_CATEGORIES:
+        return
+    news_text = await get_news(category)
+    await outbound.edit(event, news_text, buttons=screens.keyboard(f"news_{category}"))
+
+@callbacks.route("news_menu")
+async def news_menu_callback(event):
+    await edit_screen(event, "news_menu")
+
+# Notes menu handlers
+@callbacks.route("notes_menu")
+async def notes_menu_callback(event):
+    await notes_menu(event)
+
+@callbacks.route("create_note")
+async def create_note_callback(event):
     user_id = event.sender_id
+    await outbound.edit(event, "Please enter a title for your note:")
+    conversations.set(user_id, "waiting_for_note_title")
+
+# Render one page of the notes list; `cursor` is the id of the first note shown
+async def show_notes_page(event, cursor=None):
+    user_id = event.sender_id
+    page = await notes_pages.page(user_id, lambda: notes.list(user_id), cursor)
+    if page is None:
+        await edit_screen(event, "no_notes")
+        return
     
-    # Main menu handlers
-    if data == "main_menu":
-        buttons = await get_main_menu_buttons()
-        await event.edit("Main Menu:", buttons=buttons)
-    
-    elif data == "about":
-        about_text = (
-            "📱 **Telegram Assistant Bot**\n\n"
-            "I'm a versatile bot designed to make your Telegram experience better.\n"
-            "I can provide weather updates, tell jokes, deliver news, set reminders, and more!\n\n"
-            "Version: 2.1.0\n"
-            "Created with ❤️ using Telethon\n\n"
-            "Type /help to see all available commands."
-        )
-        buttons = [[Button.inline("🔙 Back to Main Menu", b"main_menu")]]
-        await event.edit(about_text, buttons=buttons)
-    
-    elif data == "help":
-        buttons = [
-            [Button.inline("🤖 Bot Commands", b"help_commands")],
-            [Button.inline("🌐 Weather", b"help_weather"), Button.inline("📰 News", b"help_news")],
-            [Button.inline("😂 Jokes", b"help_jokes"), Button.inline("🎮 Games", b"help_games")],
-            [Button.inline("⏰ Reminders", b"help_reminders"), Button.inline("📝 Notes", b"help_notes")],
-            [Button.inline("⚙️ Settings", b"help_settings")],
-            [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-        ]
-        await event.edit("Choose a help topic:", buttons=buttons)
-    
-    # Help submenu handlers
-    elif data == "help_commands":
-        commands_text = (
-            "🤖 **Bot Commands:**\n\n"
-            "/start - Start the bot and show main menu\n"
-            "/help - Show help menu\n"
-            "/about - Information about the bot\n"
-            "/weather - Get weather updates\n"
-            "/joke - Get a random joke\n"
-            "/news - Browse news categories\n"
-            "/notes - Manage your notes\n"
-            "/reminders - Set and manage reminders\n"
-            "/games - Play mini-games\n"
-            "/settings - Customize your preferences\n"
-            "/features - See all available features"
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(commands_text, buttons=buttons)
-    
-    elif data == "help_weather":
-        help_text = (
-            "🌤️ **Weather Feature:**\n\n"
-            "Get current weather conditions and forecasts for any location.\n\n"
-            "**Usage:**\n"
-            "• /weather - Opens the weather menu\n"
-            "• /weather [city] - Gets weather for specific city\n"
-            "• Share your location - Gets weather for your current location\n\n"
-            "The weather data includes temperature, condition, humidity, wind speed, and a 3-day forecast."
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_news":
-        help_text = (
-            "📰 **News Feature:**\n\n"
-            "Get the latest news from various categories.\n\n"
-            "**Usage:**\n"
-            "• /news - Opens the news category menu\n\n"
-            "**Available Categories:**\n"
-            "• World\n• Business\n• Health\n• Science\n• Sports\n• Technology"
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_jokes":
-        help_text = (
-            "😂 **Jokes Feature:**\n\n"
-            "Enjoy random jokes for entertainment.\n\n"
-            "**Usage:**\n"
-            "• /joke - Get a random joke\n"
-            "• 'Another Joke' button - Get another random joke"
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_games":
-        help_text = (
-            "🎮 **Games Feature:**\n\n"
-            "Play fun mini-games right in your chat.\n\n"
-            "**Available Games:**\n"
-            "• 🎲 Dice Game - Roll dice and try your luck\n"
-            "• 🔢 Number Guess - Guess a number between 1-100\n"
-            "• ✂️ Rock Paper Scissors - Play against the bot\n"
-            "• 🎯 Trivia - Test your knowledge\n\n"
-            "Use /games to access the games menu."
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_reminders":
-        help_text = (
-            "⏰ **Reminders Feature:**\n\n"
-            "Set and manage reminders for important tasks.\n\n"
-            "**Usage:**\n"
-            "• /reminders - Opens the reminders menu\n"
-            "• 'Set Reminder' - Create a new reminder\n"
-            "• 'View Reminders' - See all your active reminders\n"
-            "• 'Delete Reminder' - Remove a specific reminder\n\n"
-            "You can set reminders using formats like:\n"
-            "• 10m (10 minutes)\n• 2h (2 hours)\n• 1d (1 day)\n• 14:30 (specific time)"
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_notes":
-        help_text = (
-            "📝 **Notes Feature:**\n\n"
-            "Create and manage personal notes.\n\n"
-            "**Usage:**\n"
-            "• /notes - Opens the notes menu\n"
-            "• 'Create Note' - Add a new note\n"
-            "• 'View Notes' - See all your saved notes\n"
-            "• 'Find Note' - Search for specific notes\n"
-            "• 'Delete Note' - Remove a specific note"
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    elif data == "help_settings":
-        help_text = (
-            "⚙️ **Settings Feature:**\n\n"
-            "Customize your bot experience.\n\n"
-            "**Available Settings:**\n"
-            "• 🌡️ Temperature Unit - Choose between Celsius/Fahrenheit\n"
-            "• 🔔 Notifications - Enable/disable notifications\n"
-            "• 🎨 Theme - Choose between light/dark theme\n\n"
-            "Your settings are saved for future sessions."
-        )
-        buttons = [[Button.inline("🔙 Back to Help", b"help")]]
-        await event.edit(help_text, buttons=buttons)
-    
-    # News category handlers
-    elif data.startswith("news_"):
-        category = data.split("_")[1]
-        news_text = await get_news(category)
-        
-        buttons = [
-            [Button.inline("🔙 News Categories", b"news_menu")],
-            [Button.inline("🔄 Refresh", f"news_{category}")],
-            [Button.inline("🔙 Main Menu", b"main_menu")]
-        ]
-        await event.edit(news_text, buttons=buttons)
-    
-    elif data == "news_menu":
-        buttons = [
-            [Button.inline("🌍 World", b"news_world"), Button.inline("💼 Business", b"news_business")],
-            [Button.inline("🏥 Health", b"news_health"), Button.inline("🔬 Science", b"news_science")],
-            [Button.inline("⚽ Sports", b"news_sports"), Button.inline("💻 Technology", b"news_technology")],
-            [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-        ]
-        await event.edit("📰 Select a news category:", buttons=buttons)
-    
-    # Notes menu handlers
-    elif data == "notes_menu":
-        await notes_menu(event)
-    
-    elif data == "create_note":
-        await event.edit("Please enter a title for your note:")
-        user_states[user_id] = "waiting_for_note_title"
-    
-    elif data == "view_notes":
-        if user_id not in user_preferences or "notes" not in user_preferences[user_id] or not user_preferences[user_id]["notes"]:
-            buttons = [
-                [Button.inline("📝 Create Note", b"create_note")],
-                [Button.inline("🔙 Notes Menu", b"notes_menu")]
-            ]
-            await event.edit("You don't have any notes yet. Create one?", buttons=buttons)
-        else:
-            notes = user_preferences[user_id]["notes"]
-            notes_text = "📝 **Your Notes:**\n\n"
-            
-            for note in notes:
-                created_at = note.get("created_at", "Unknown date")
-                notes_text += f"**{note['title']}** (ID: {note['id']})\n"
-                notes_text += f"Created: {created_at}\n\n"
-            
-            buttons = [
-                [Button.inline("📝 Create Note", b"create_note"), Button.inline("📖 View Note", b"view_note_by_id")],
-                [Button.inline("🗑️ Delete Note", b"delete_note"), Button.inline("🔙 Notes Menu", b"notes_menu")]
-            ]
-            await event.edit(notes_text, buttons=buttons)
-    
-    elif data == "view_note_by_id":
-        if user_id not in user_preferences or "notes" not in user_preferences[user_id] or not user_preferences[user_id]["notes"]:
-            buttons = [[Button.inline("🔙 Notes Menu", b"notes_menu")]]
-            await event.edit("You don't have any notes yet.", buttons=buttons)
-        else:
-            await event.edit("Please enter the ID of the note you want to view:")
-            user_states[user_id] = "waiting_for_note_id"
-    
-    elif data == "delete_note":
-        if user_id not in user_preferences or "notes" not in user_preferences[user_id] or not user_preferences[user_id]["notes"]:
-            buttons = [[Button.inline("🔙 Notes Menu", b"notes_menu")]]
-            await event.edit("You don't have any notes to delete.", buttons=buttons)
-        else:
-            await event.edit("Please enter the ID of the note you want to delete:")
-            user_states[user_id] = "waiting_for_note_delete_id"
+    notes_text, nav_row = page
+    buttons = [
+        [Button.inline("📝 Create Note", b"create_note"), Button.inline("📖 View Note", b"view_note_by_id")],
+        [Button.inline("🗑️ Delete Note", b"delete_note"), Button.inline("🔙 Notes Menu", b"notes_menu")]
+    ]
+    if nav_row:
+        buttons.insert(0, nav_row)
+    await outbound.edit(event, notes_text, buttons=buttons)
+
+@callbacks.route("view_notes")
+async def view_notes_callback(event):
+    await show_notes_page(event)
+
+@callbacks.prefix("notes_page_")
+async def notes_page_callback(event, cursor):
+    await show_notes_page(event, int(cursor))
+
+@callbacks.route("view_note_by_id")
+async def view_note_by_id_callback(event):
+    user_id = event.sender_id
+    if not await notes.count(user_id):
+        buttons = screens.keyboard("back_to_notes")
+        await outbound.edit(event, "You don't have any notes yet.", buttons=buttons)
+    else:
+        await outbound.edit(event, "Please enter the ID of the note you want to view:")
+        conversations.set(user_id, "waiting_for_note_id")
+
+@callbacks.route("delete_note")
+async def delete_note_callback(event):
+    user_id = event.sender_id
+    if not await notes.count(user_id):
+        buttons = screens.keyboard("back_to_notes")
+        await outbound.edit(event, "You don't have any notes to delete.", buttons=buttons)
+    else:
+        await outbound.edit(event, "Please enter the ID of the note you want to delete:")
+        conversations.set(user_id, "waiting_for_note_delete_id")
+
+@callbacks.route("find_note")
+async def find_note_callback(event):
+    user_id = event.sender_id
+    await outbound.edit(event, "Please enter a keyword to search in your notes:")
+    conversations.set(user_id, "waiting_for_note_search")
+
+# Reminder menu handlers
+@callbacks.route("reminder_menu")
+async def reminder_menu_callback(event):
+    await reminder_menu(event)
+
+@callbacks.route("set_reminder")
+async def set_reminder_callback(event):
+    user_id = event.sender_id
+    await outbound.edit(event, "Please enter the text for your reminder (what you want to be reminded about):")
+    conversations.set(user_id, "waiting_for_reminder_text")
+
+# Render one page of the reminders list; `cursor` is the id of the first reminder shown
+async def show_reminders_page(event, cursor=None):
+    user_id = event.sender_id
+    page = await reminders_pages.page(user_id, lambda: storage.get_reminders(user_id), cursor)
+    if page is None:
+        await edit_screen(event, "no_reminders")
+        return
     
-    elif data == "find_note":
-        await event.edit("Please enter a keyword to search in your notes:")
-        user_states[user_id] = "waiting_for_note_search"
+    reminders_text, nav_row = page
+    buttons = [
+        [Button.inline("⏰ Set Reminder", b"set_reminder"), Button.inline("🗑️ Delete Reminder", b"delete_reminder")],
+        [Button.inline("🔙 Reminders Menu", b"reminder_menu")]
+    ]
+    if nav_row:
+        buttons.insert(0, nav_row)
+    await outbound.edit(event, reminders_text, buttons=buttons)
+
+@callbacks.route("view_reminders")
+async def view_reminders_callback(event):
+    await show_reminders_page(event)
+
+@callbacks.prefix("reminders_page_")
+async def reminders_page_callback(event, cursor):
+    await show_reminders_page(event, int(cursor))
+
+@callbacks.route("delete_reminder")
+async def delete_reminder_callback(event):
+    user_id = event.sender_id
+    if not await storage.get_reminders(user_id):
+        buttons = screens.keyboard("back_to_reminders")
+        await outbound.edit(event, "You don't have any active reminders to delete.", buttons=buttons)
+    else:
+        await outbound.edit(event, "Please enter the ID of the reminder you want to delete:")
+        conversations.set(user_id, "waiting_for_reminder_delete_id")
+
+# Games menu handlers
+@callbacks.route("games_menu")
+async def games_menu_callback(event):
+    await games_menu(event)
+
+@callbacks.route("game_dice")
+async def game_dice_callback(event):
+    # Roll a dice
+    dice_result = random.randint(1, 6)
+    await outbound.edit(event, f"🎲 You rolled a **{dice_result}**!", buttons=screens.keyboard("dice_result"))
+
+@callbacks.route("game_number")
+async def game_number_callback(event):
+    user_id = event.sender_id
+    # Start a number guessing game
+    number = random.randint(1, 100)
+    conversations.set(user_id, "playing_number_guess", number=number, attempts=0)
     
-    # Reminder menu handlers
-    elif data == "reminder_menu":
-        await reminder_menu(event)
+    await outbound.edit(event, 
+        "🔢 **Number Guessing Game**\n\n"
+        "I'm thinking of a number between 1 and 100.\n"
+        "Try to guess it in as few attempts as possible!\n\n"
+        "Enter your guess:"
+    )
+
+@callbacks.route("game_rps")
+async def game_rps_callback(event):
+    # Rock Paper Scissors game
+    await edit_screen(event, "game_rps")
+
+@callbacks.prefix("rps_")
+async def rps_choice_callback(event, player_choice):
+    choices = ["rock", "paper", "scissors"]
+    bot_choice = random.choice(choices)
     
-    elif data == "set_reminder":
-        await event.edit("Please enter the text for your reminder (what you want to be reminded about):")
-        user_states[user_id] = "waiting_for_reminder_text"
+    # Determine winner
+    if player_choice == bot_choice:
+        result = "It's a tie! 🤝"
+    elif (player_choice == "rock" and bot_choice == "scissors") or \
+         (player_choice == "paper" and bot_choice == "rock") or \
+         (player_choice == "scissors" and bot_choice == "paper"):
+        result = "You win! 🎉"
+    else:
+        result = "I win! 😎"
     
-    elif data == "view_reminders":
-        if user_id not in user_reminders or not user_reminders[user_id]:
-            buttons = [
-                [Button.inline("⏰ Set Reminder", b"set_reminder")],
-                [Button.inline("🔙 Reminders Menu", b"reminder_menu")]
-            ]
-            await event.edit("You don't have any active reminders. Set one?", buttons=buttons)
-        else:
-            reminders = user_reminders[user_id]
-            reminders_text = "⏰ **Your Active Reminders:**\n\n"
-            
-            for reminder in reminders:
-                reminder_time = datetime.fromtimestamp(reminder["time"])
-                time_str = reminder_time.strftime('%Y-%m-%d %H:%M:%S')
-                
-                reminders_text += f"**{reminder['text']}** (ID: {reminder['id']})\n"
-                reminders_text += f"Time: {time_str}\n\n"
-            
-            buttons = [
-                [Button.inline("⏰ Set Reminder", b"set_reminder"), Button.inline("🗑️ Delete Reminder", b"delete_reminder")],
-                [Button.inline("🔙 Reminders Menu", b"reminder_menu")]
-            ]
-            await event.edit(reminders_text, buttons=buttons)
+    # Emojis for choices
+    choice_emojis = {"rock": "✊", "paper": "✋", "scissors": "✂️"}
     
-    elif data == "delete_reminder":
-        if user_id not in user_reminders or not user_reminders[user_id]:
-            buttons = [[Button.inline("🔙 Reminders Menu", b"reminder_menu")]]
-            await event.edit("You don't have any active reminders to delete.", buttons=buttons)
+    await outbound.edit(event, 
+        f"✂️ **Rock Paper Scissors**\n\n"
+        f"Your choice: {choice_emojis[player_choice]} {player_choice.capitalize()}\n"
+        f"My choice: {choice_emojis[bot_choice]} {bot_choice.capitalize()}\n\n"
+        f"**{result}**",
+        buttons=screens.keyboard("rps_result")
+    )
+
+@callbacks.route("game_trivia")
+async def game_trivia_callback(event):
+    user_id = event.sender_id
+    # Trivia game
+    try:
+        question = await get_trivia_question(user_id)
+        if question:
+            correct_answer = question.correct_answer
+            answers = question.incorrect_answers + [correct_answer]
+            random.shuffle(answers)
+                    
+            # The open question is a conversation, so an unanswered one expires
+            conversations.set(user_id, "answering_trivia", answer=correct_answer, index=answers.index(correct_answer))
+                    
+            buttons = []
+            for i, answer in enumerate(answers):
+                buttons.append([Button.inline(answer, f"trivia_{i}")])
+                    
+            buttons.append([Button.inline("🔙 Games Menu", b"games_menu")])
+                    
+            await outbound.edit(event, 
+                f"🎯 **Trivia Question**\n\n"
+                f"Category: {question.category}\n"
+                f"Difficulty: {question.difficulty.capitalize()}\n\n"
+                f"Question: {question.text}\n\n"
+                f"Select your answer:",
+                buttons=buttons
+            )
         else:
-            await event.edit("Please enter the ID of the reminder you want to delete:")
-            user_states[user_id] = "waiting_for_reminder_delete_id"
-    
-    # Games menu handlers
-    elif data == "games_menu":
-        await games_menu(event)
-    
-    elif data == "game_dice":
-        # Roll a dice
-        dice_result = random.randint(1, 6)
-        
-        buttons = [
-            [Button.inline("🎲 Roll Again", b"game_dice")],
-            [Button.inline("🔙 Games Menu", b"games_menu")]
-        ]
-        await event.edit(f"🎲 You rolled a **{dice_result}**!", buttons=buttons)
-    
-    elif data == "game_number":
-        # Start a number guessing game
-        number = random.randint(1, 100)
-        user_states[user_id] = {"state": "playing_number_guess", "number": number, "attempts": 0}
-        
-        await event.edit(
-            "🔢 **Number Guessing Game**\n\n"
-            "I'm thinking of a number between 1 and 100.\n"
-            "Try to guess it in as few attempts as possible!\n\n"
-            "Enter your guess:"
-        )
-    
-    elif data == "game_rps":
-        # Rock Paper Scissors game
-        buttons = [
-            [Button.inline("✊ Rock", b"rps_rock"), Button.inline("✋ Paper", b"rps_paper"), Button.inline("✂️ Scissors", b"rps_scissors")],
-            [Button.inline("🔙 Games Menu", b"games_menu")]
-        ]
-        await event.edit("✂️ **Rock Paper Scissors**\n\nMake your choice:", buttons=buttons)
-    
-    elif data.startswith("rps_"):
-        player_choice = data.split("_")[1]
-        choices = ["rock", "paper", "scissors"]
-        bot_choice = random.choice(choices)
+            await outbound.edit(event, "Failed to fetch a trivia question. Please try again.")
+    except Exception as e:
+        logger.error("Trivia error: %s", e)
+        await outbound.edit(event, "An error occurred while fetching the trivia question. Please try again.")
+
+@callbacks.prefix("trivia_")
+async def trivia_answer_callback(event, answer_index):
+    user_id = event.sender_id
+    conversation = conversations.get(user_id)
+    if conversation is not None and conversation.state == "answering_trivia":
+        correct_answer, correct_index = conversation.data["answer"], conversation.data["index"]
         
-        # Determine winner
-        if player_choice == bot_choice:
-            result = "It's a tie! 🤝"
-        elif (player_choice == "rock" and bot_choice == "scissors") or \
-             (player_choice == "paper" and bot_choice == "rock") or \
-             (player_choice == "scissors" and bot_choice == "paper"):
-            result = "You win! 🎉"
+        if answer_index == str(correct_index):
+            result = "✅ Correct! Great job!"
+            # Update user's score
+            await storage.incr_score(user_id, "trivia")
         else:
-            result = "I win! 😎"
+            result = f"❌ Wrong! The correct answer was: {correct_answer}"
         
-        # Emojis for choices
-        choice_emojis = {"rock": "✊", "paper": "✋", "scissors": "✂️"}
+        await outbound.edit(event, 
+            f"🎯 **Trivia Result**\n\n"
+            f"{result}\n\n"
+            f"Your score: {await storage.get_score(user_id, 'trivia')}",
+            buttons=screens.keyboard("trivia_result")
+        )
         
-        buttons = [
-            [Button.inline("🎮 Play Again", b"game_rps")],
-            [Button.inline("🔙 Games Menu", b"games_menu")]
-        ]
-        await event.edit(
-            f"✂️ **Rock Paper Scissors**\n\n"
-            f"Your choice: {choice_emojis[player_choice]} {player_choice.capitalize()}\n"
-            f"My choice: {choice_emojis[bot_choice]} {bot_choice.capitalize()}\n\n"
-            f"**{result}**",
-            buttons=buttons
+        # Clear the stored answer
+        conversations.clear(user_id)
+
+@conversations.state("answering_trivia")
+async def answering_trivia(event, conversation):
+    await outbound.respond(event, "🎯 Tap one of the answers above to reply!")
+
+# Settings handlers
+@callbacks.route("settings")
+async def settings_callback(event):
+    await edit_screen(event, "settings", *await settings_values(event.sender_id))
+
+@callbacks.route("settings_temp")
+async def settings_temp_callback(event):
+    current_unit = (await storage.get_preferences(event.sender_id))['temperature_unit']
+    await edit_screen(event, "settings_temp", current_unit)
+
+@callbacks.route("settings_notif")
+async def settings_notif_callback(event):
+    current_status = (await storage.get_preferences(event.sender_id))['notifications']
+    await edit_screen(event, "settings_notif", current_status)
+
+@callbacks.route("settings_theme")
+async def settings_theme_callback(event):
+    current_theme = (await storage.get_preferences(event.sender_id))['theme']
+    await edit_screen(event, "settings_theme", current_theme)
+
+# Preference written by each settings button
+SETTING_CHOICES = {
+    "set_temp_celsius": ('temperature_unit', 'celsius'),
+    "set_temp_fahrenheit": ('temperature_unit', 'fahrenheit'),
+    "set_notif_on": ('notifications', True),
+    "set_notif_off": ('notifications', False),
+    "set_theme_light": ('theme', 'light'),
+    "set_theme_dark": ('theme', 'dark')
+}
+
+@callbacks.route(*SETTING_CONFIRMATIONS)
+async def set_preference_callback(event):
+    choice = event.data.decode()
+    key, value = SETTING_CHOICES[choice]
+    await storage.set_preference(event.sender_id, key, value)
+    if key == 'temperature_unit':
+        await digests.set_unit(event.sender_id, value)
+    await edit_screen(event, choice)
+
+# Gauges read at scrape time
+metrics.gauge_callback("bot_reminders_pending", "Reminders waiting to fire", lambda: len(reminder_scheduler))
+metrics.gauge_callback("bot_mailbox_pending", "Updates queued in user mailboxes", lambda: mailboxes.pending)
+metrics.gauge_callback("bot_mailbox_users", "Users with queued or running updates", lambda: mailboxes.stats()["users"])
+metrics.gauge_callback("bot_mailbox_dropped", "Updates dropped because a user's mailbox was full", lambda: mailboxes.dropped)
+metrics.gauge_callback(
+    "bot_outbound_queue_depth", "Messages waiting to be sent, by lane",
+    lambda: {(lane,): depth for lane, depth in outbound.stats()["depth"].items()}, ("lane",)
+)
+metrics.gauge_callback("bot_conversations_active", "Users in the middle of a conversation flow", conversations.active_count)
+metrics.gauge_callback("bot_rate_limited_users", "Users with a live rate-limit bucket", lambda: rate_limiter.stats()["tracked_users"])
+metrics.gauge_callback("bot_weather_cache_entries", "Cached weather replies", lambda: len(weather_cache))
+metrics.gauge_callback(
+    "bot_upstream_circuit_open", "1 while a provider's circuit breaker is open",
+    lambda: {(api.name,): int(api.breaker.state == "open") for api in (weather_api, news_api, trivia_api)},
+    ("provider",)
+)
+
+# Multi-process mode: this process only receives updates and forwards each
+# one to the worker that owns its user
+async def run_receiver(timer):
+    from cluster import UpdateDispatcher, supervise_workers
+    dispatcher = UpdateDispatcher(settings.workers, port=settings.cluster_port)
+    dispatcher.install(client)
+    await dispatcher.start()
+    if metrics.enabled:
+        metrics.gauge_callback(
+            "bot_dispatcher_backlog", "Updates waiting to be forwarded, by worker",
+            lambda: {(str(shard),): size for shard, size in enumerate(dispatcher.stats()["backlog"])}, ("worker",)
         )
-    
-    elif data == "game_trivia":
-        # Trivia game
+        await metrics.serve(port=settings.metrics_port)
+    supervisor = asyncio.create_task(supervise_workers(os.path.abspath(__file__), settings.workers))
+    timer.mark("receiver")
+    timer.report()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        supervisor.cancel()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get('https://opentdb.com/api.php?amount=1&type=multiple') as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        if data['response_code'] == 0 and data['results']:
-                            question_data = data['results'][0]
-                            question = question_data['question']
-                            correct_answer = question_data['correct_answer']
-                            answers = question_data['incorrect_answers'] + [correct_answer]
-                            random.shuffle(answers)
-                            
-                            trivia_answers[user_id] = correct_answer
-                            
-                            buttons = []
-                            for i, answer in enumerate(answers):
-                                buttons.append([Button.inline(answer, f"trivia_{i}")])
-                            
-                            buttons.append([Button.inline("🔙 Games Menu", b"games_menu")])
-                            
-                            await event.edit(
-                                f"🎯 **Trivia Question**\n\n"
-                                f"Category: {question_data['category']}\n"
-                                f"Difficulty: {question_data['difficulty'].capitalize()}\n\n"
-                                f"Question: {question}\n\n"
-                                f"Select your answer:",
-                                buttons=buttons
-                            )
-                        else:
-                            await event.edit("Failed to fetch a trivia question. Please try again.")
-                    else:
-                        await event.edit("Failed to fetch a trivia question. Please try again.")
-        except Exception as e:
-            logger.error(f"Trivia error: {str(e)}")
-            await event.edit("An error occurred while fetching the trivia question. Please try again.")
-    
-    elif data.startswith("trivia_"):
-        if user_id in trivia_answers:
-            correct_answer = trivia_answers[user_id]
-            user_answer = event.data_match.group().decode('utf-8').split('_')[1]
-            answer_index = int(user_answer)
-            
-            # Get the actual answer text from the button
-            answer_text = None
-            for row in event.message.buttons:
-                for button in row:
-                    if button.data == event.data:
-                        answer_text = button.text
-                        break
-                if answer_text:
-                    break
-            
-            if answer_text == correct_answer:
-                result = "✅ Correct! Great job!"
-                # Update user's score
-                if user_id not in user_scores:
-                    user_scores[user_id] = {"trivia": 1}
-                elif "trivia" not in user_scores[user_id]:
-                    user_scores[user_id]["trivia"] = 1
-                else:
-                    user_scores[user_id]["trivia"] += 1
-            else:
-                result = f"❌ Wrong! The correct answer was: {correct_answer}"
-            
-            buttons = [
-                [Button.inline("🎯 Another Question", b"game_trivia")],
-                [Button.inline("🔙 Games Menu", b"games_menu")]
-            ]
-            
-            await event.edit(
-                f"🎯 **Trivia Result**\n\n"
-                f"{result}\n\n"
-                f"Your score: {user_scores.get(user_id, {}).get('trivia', 0)}",
-                buttons=buttons
+            await supervisor
+        except asyncio.CancelledError:
+            pass
+        await dispatcher.stop()
+        await metrics.stop()
+        logger.info("Dispatcher stats: %s", dispatcher.stats())
+
+# Application factory: creates this process's Telegram client and registers
+# the update handlers on it. Nothing connects until the client is started.
+# Pass `telegram_client` to run the handlers on another client (e.g. a stub).
+def create_app(telegram_client=None):
+    global client
+    if telegram_client is None:
+        settings.require_credentials()
+        if settings.worker_shard is None:
+            # Updates are dispatched one at a time: handlers only queue them in
+            # a mailbox, so a full mailbox pool holds back the update loop itself
+            telegram_client = TelegramClient('s1', settings.api_id, settings.api_hash, sequential_updates=True)
+        else:
+            # Workers get their updates from the receiver and only use their
+            # own session to reply
+            telegram_client = TelegramClient(
+                f's1-worker{settings.worker_shard}', settings.api_id, settings.api_hash, receive_updates=False
             )
-            
-            # Clear the stored answer
-            if user_id in trivia_answers:
-                del trivia_answers[user_id]
-    
-    # Settings handlers
-    elif data == "settings":
-        user_prefs = user_preferences.get(user_id, {
-            "temperature_unit": "celsius",
-            "language": "english",
-            "notifications": True,
-            "theme": "light",
-            "notes": []
-        })
-        
-        buttons = [
-            [Button.inline("🌡️ Temperature Unit", b"settings_temp"), Button.inline("🔔 Notifications", b"settings_notif")],
-            [Button.inline("🎨 Theme", b"settings_theme")],
-            [Button.inline("🔙 Back to Main Menu", b"main_menu")]
-        ]
-        
-        await event.edit(
-            f"⚙️ **Your Settings:**\n\n"
-            f"🌡️ Temperature Unit: {user_prefs.get('temperature_unit', 'celsius').capitalize()}\n"
-            f"🔔 Notifications: {'Enabled' if user_prefs.get('notifications', True) else 'Disabled'}\n"
-            f"🎨 Theme: {user_prefs.get('theme', 'light').capitalize()}\n",
-            buttons=buttons
-        )
-    
-    elif data == "settings_temp":
-        current_unit = user_preferences.get(user_id, {}).get('temperature_unit', 'celsius')
-        buttons = [
-            [Button.inline("°C Celsius", b"set_temp_celsius"), Button.inline("°F Fahrenheit", b"set_temp_fahrenheit")],
-            [Button.inline("🔙 Back to Settings", b"settings")]
-        ]
-        await event.edit(
-            f"🌡️ **Temperature Unit**\n\n"
-            f"Current setting: {current_unit.capitalize()}\n\n"
-            f"Select your preferred unit:",
-            buttons=buttons
-        )
-    
-    elif data == "set_temp_celsius":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['temperature_unit'] = 'celsius'
-        await event.edit("✅ Temperature unit set to Celsius", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
-    
-    elif data == "set_temp_fahrenheit":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['temperature_unit'] = 'fahrenheit'
-        await event.edit("✅ Temperature unit set to Fahrenheit", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
-    
-    elif data == "settings_notif":
-        current_status = user_preferences.get(user_id, {}).get('notifications', True)
-        buttons = [
-            [Button.inline("🔔 Enable", b"set_notif_on"), Button.inline("🔕 Disable", b"set_notif_off")],
-            [Button.inline("🔙 Back to Settings", b"settings")]
-        ]
-        await event.edit(
-            f"🔔 **Notifications**\n\n"
-            f"Current setting: {'Enabled' if current_status else 'Disabled'}\n\n"
-            f"Select your preference:",
-            buttons=buttons
-        )
-    
-    elif data == "set_notif_on":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['notifications'] = True
-        await event.edit("✅ Notifications enabled", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
-    
-    elif data == "set_notif_off":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['notifications'] = False
-        await event.edit("✅ Notifications disabled", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
-    
-    elif data == "settings_theme":
-        current_theme = user_preferences.get(user_id, {}).get('theme', 'light')
-        buttons = [
-            [Button.inline("☀️ Light", b"set_theme_light"), Button.inline("🌙 Dark", b"set_theme_dark")],
-            [Button.inline("🔙 Back to Settings", b"settings")]
-        ]
-        await event.edit(
-            f"🎨 **Theme**\n\n"
-            f"Current setting: {current_theme.capitalize()}\n\n"
-            f"Select your preference:",
-            buttons=buttons
-        )
-    
-    elif data == "set_theme_light":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['theme'] = 'light'
-        await event.edit("✅ Theme set to Light", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
-    
-    elif data == "set_theme_dark":
-        if user_id not in user_preferences:
-            user_preferences[user_id] = {}
-        user_preferences[user_id]['theme'] = 'dark'
-        await event.edit("✅ Theme set to Dark", buttons=[[Button.inline("🔙 Back to Settings", b"settings")]])
+    telegram_client.add_event_handler(handle_message, events.NewMessage)
+    telegram_client.add_event_handler(handle_callback, events.CallbackQuery)
+    client = telegram_client
+    return client
+
+# Records are queued and written by a background thread
+def configure_logging():
+    setup_logging(
+        settings.log_path,
+        level=settings.log_level,
+        max_bytes=settings.log_max_bytes,
+        backups=settings.log_backups,
+        json_lines=settings.log_json
+    )
 
 # Run the client
 async def main():
-    await client.run_until_disconnected()
+    timer = StartupTimer(STARTED_AT)
+    timer.mark("import")
+    configure_logging()
+    timer.mark("logging")
+
+    if settings.worker_shard is not None:
+        from cluster import ProcessLock
+        # Only one live process may own a shard and its reminders
+        shard_lock = ProcessLock(f"{settings.storage_path}.worker{settings.worker_shard}.lock")
+        if not shard_lock.acquire():
+            logger.error("Worker %s is already running elsewhere; exiting", settings.worker_shard)
+            return
+
+    create_app()
+    # A SIGTERM (e.g. from a process manager or the receiver) disconnects, so
+    # shutdown below still stops the services and flushes queued writes
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(client.disconnect()))
+    except NotImplementedError:
+        # Not available on Windows event loops
+        pass
+    await client.start(bot_token=settings.bot_token)
+    # Lets the router ignore commands addressed to other bots in groups
+    me = await client.get_me()
+    commands.set_username(me.username)
+    timer.mark("connect")
+
+    if settings.workers and settings.worker_shard is None:
+        await run_receiver(timer)
+        return
+
+    inbox = None
+    if settings.worker_shard is not None:
+        from cluster import WorkerInbox
+        inbox = WorkerInbox(client, settings.worker_shard, port=settings.cluster_port)
+        inbox.start()
+
+    if metrics.enabled:
+        # Workers each get their own port after the receiver's
+        await metrics.serve(port=settings.metrics_port + (0 if settings.worker_shard is None else settings.worker_shard + 1))
+    await start_services(timer)
+    timer.report()
+    try:
+        await client.run_until_disconnected()
+    finally:
+        if inbox is not None:
+            await inbox.stop()
+        await metrics.stop()
+        await stop_services()
+
+# Builds the background feature services once. Their modules are imported
+# here, so importing main.py (e.g. to benchmark handlers) doesn't load them.
+def create_services():
+    global joke_pool, news_feed, trivia_pool, digests
+    if digests is not None:
+        return
+    from digests import DigestScheduler
+    from jokes import JokePool
+    from news_feed import NewsFeed
+    from trivia import TriviaPool
+
+    # Pre-fetched jokes from both providers, refilled in the background
+    joke_pool = JokePool({
+        "official-joke-api": fetch_official_jokes,
+        "jokeapi": fetch_jokeapi_jokes
+    }, observer=metrics.upstream_observer)
+    # Pre-rendered news for every menu category, refreshed in the background
+    news_feed = NewsFeed(load_news, NEWS_CATEGORIES, interval=settings.news_refresh_interval)
+    # Trivia questions fetched in bulk and served from memory
+    trivia_pool = TriviaPool(fetch_trivia_questions, batch_size=settings.trivia_batch_size)
+    # Daily weather digests, batched by location at each delivery slot
+    digests = DigestScheduler(
+        fetch_digest_weather, format_digest, send_digest, storage,
+        owns=owns_user, fetch_concurrency=settings.digest_fetch_concurrency
+    )
+
+    metrics.gauge_callback("bot_digest_subscribers", "Users subscribed to the daily weather digest", lambda: len(digests))
+    metrics.gauge_callback("bot_trivia_pool_size", "Trivia questions in the pool", lambda: trivia_pool.stats()["pooled"])
+    metrics.gauge_callback("bot_joke_pool_size", "Jokes in the buffer", lambda: joke_pool.stats()["buffered"])
+
+# Background services the handlers rely on. Also used by the benchmarks,
+# which drive the handlers without connecting to Telegram. Feature services
+# are built before the mailbox workers start, so no handler runs without them.
+async def start_services(timer=None):
+    create_services()
+    mailboxes.start()
+    outbound.start()
+    await storage.start()
+    if timer is not None:
+        timer.mark("storage")
+    await reminder_scheduler.load()
+    reminder_scheduler.start()
+    if timer is not None:
+        timer.mark("reminders")
+    await digests.load()
+    digests.start()
+    if timer is not None:
+        timer.mark("digests")
+    conversations.start()
+    rate_limiter.start()
+    trivia_pool.start()
+    joke_pool.start()
+    if settings.news_api_key:
+        news_feed.start()
+    if timer is not None:
+        timer.mark("services")
+
+async def stop_services():
+    await mailboxes.stop()
+    await news_feed.stop()
+    await conversations.stop()
+    await rate_limiter.stop()
+    await trivia_pool.stop()
+    await joke_pool.stop()
+    await reminder_scheduler.stop()
+    await digests.stop()
+    await storage.close()
+    await outbound.stop()
+    logger.info("Mailbox stats: %s", mailboxes.stats())
+    logger.info("Digest stats: %s", digests.stats())
+    logger.info(
+        "Upstream call stats: %s, weather cache: %s, trivia: %s, jokes: %s",
+        upstream_calls.stats(), weather_cache.stats(), trivia_pool.stats(), joke_pool.stats()
+    )
+    logger.info("Upstream health: %s", {api.name: api.stats() for api in (weather_api, news_api, trivia_api)})
+    await close_session()
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
+    # On Ctrl+C asyncio.run cancels main(), whose cleanup runs before exiting
     try:
-        loop.run_until_complete(main())
+        asyncio.run(main())
     except KeyboardInterrupt:
-        print("Bot stopped by user!")
-    finally:
-        loop.close()
\ No newline at end of file
+        print("Bot stopped by user!")
\ No newline at end of file
@@ -0,0 +1,224 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+# Gauge read from a function at scrape time, so it costs nothing in between.
+# `fn()` returns a number, or a dict of label tuple -> number.
+class CallbackGauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._fn = fn
+
+    def samples(self):
+        value = self._fn()
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, sample in value.items():
+            yield self.name, _format_labels(self.labelnames, labels), sample
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labelnames + ("le",), labels + (bound,)),
+                    cumulative
+                )
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative
+
+
+# Metric registry plus the bot's standard instrumentation. When disabled,
+# `instrument` returns handlers unwrapped and observers are no-ops, so
+# nothing is measured unless the metrics endpoint is turned on.
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._families = {}
+        self._server = None
+        self.handler_duration = self.histogram(
+            "bot_handler_duration_seconds", "Time spent in each update handler", ("handler",)
+        )
+        self.handler_errors = self.counter(
+            "bot_handler_errors_total", "Exceptions raised by update handlers", ("handler", "type")
+        )
+        self.in_flight = self.gauge("bot_handlers_in_flight", "Handlers currently running")
+        self.upstream_duration = self.histogram(
+            "bot_upstream_duration_seconds", "Latency of each upstream API attempt", ("provider",)
+        )
+        self.upstream_errors = self.counter(
+            "bot_upstream_errors_total", "Failed upstream API attempts", ("provider", "type")
+        )
+
+    def _register(self, family):
+        if family.name in self._families:
+            raise ValueError(f"Metric '{family.name}' is already registered")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def gauge_callback(self, name, help, fn, labelnames=()):
+        return self._register(CallbackGauge(name, help, fn, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    # Decorator timing a handler; labels it with the handler's name. Nested
+    # handlers (e.g. routed callbacks) pass in_flight=False so the gauge
+    # counts each update once.
+    def instrument(self, name=None, in_flight=True):
+        def decorator(handler):
+            if not self.enabled:
+                return handler
+            label = name or handler.__name__
+            gauge = self.in_flight if in_flight else None
+
+            @functools.wraps(handler)
+            async def wrapper(*args, **kwargs):
+                if gauge is not None:
+                    gauge.inc()
+                started = time.perf_counter()
+                try:
+                    return await handler(*args, **kwargs)
+                except Exception as e:
+                    self.handler_errors.inc(label, type(e).__name__)
+                    raise
+                finally:
+                    self.handler_duration.observe(time.perf_counter() - started, label)
+                    if gauge is not None:
+                        gauge.dec()
+            return wrapper
+        return decorator
+
+    # Callback for resilience.Upstream: observe(latency, error)
+    def upstream_observer(self, provider):
+        if not self.enabled:
+            return None
+
+        def observe(latency, error):
+            self.upstream_duration.observe(latency, provider)
+            if error is not None:
+                self.upstream_errors.inc(provider, type(error).__name__)
+        return observe
+
+    def render(self):
+        lines = []
+        for family in self._families.values():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            try:
+                for name, labels, value in family.samples():
+                    lines.append(f"{name}{labels} {value}")
+            except Exception as e:
+                logger.error("Failed collecting metric %s: %s", family.name, e)
+        return "\n".join(lines) + "\n"
+
+    # Minimal HTTP server answering GET /metrics in Prometheus text format
+    async def serve(self, host="127.0.0.1", port=9100):
+        self._server = await asyncio.start_server(self._handle_scrape, host, port)
+        logger.info("Metrics available at http://%s:%s/metrics", host, port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_scrape(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Drain the headers; the request has no body we care about
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
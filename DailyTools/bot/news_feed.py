@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Keeps pre-rendered news for a fixed set of categories in memory and
+# refreshes them all from a single background task. `fetch(category)`
+# must return (news_text, success); only successful results are stored.
+class NewsFeed:
+    def __init__(self, fetch, categories, interval=1800):
+        self._fetch = fetch
+        self.categories = tuple(categories)
+        self.interval = interval
+        # Entries older than this are treated as cold and fetched live
+        self.max_age = interval * 2
+        self._entries = {}
+        self._task = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.refresh_all()
+            await asyncio.sleep(self.interval)
+
+    async def refresh_all(self):
+        results = await asyncio.gather(
+            *(self.refresh(category) for category in self.categories),
+            return_exceptions=True
+        )
+        warm = sum(1 for result in results if result is True)
+        logger.info("News feed refreshed %s/%s categories", warm, len(self.categories))
+
+    async def refresh(self, category):
+        try:
+            news_text, success = await self._fetch(category)
+        except Exception as e:
+            logger.error("News refresh error for %s: %s", category, e)
+            return False
+        if success:
+            self._entries[category] = (news_text, time.time())
+        return success
+
+    # Serve a category from memory, falling back to a live fetch when it is cold
+    async def get(self, category):
+        entry = self._entries.get(category)
+        if entry is None or time.time() - entry[1] > self.max_age:
+            news_text, success = await self._fetch(category)
+            if success:
+                self._entries[category] = (news_text, time.time())
+            return news_text
+
+        news_text, fetched_at = entry
+        age_minutes = int((time.time() - fetched_at) // 60)
+        if age_minutes < 1:
+            return f"{news_text}\n🕒 Refreshed just now"
+        return f"{news_text}\n🕒 Refreshed {age_minutes} min ago"
+
+    def stats(self):
+        now = time.time()
+        return {category: int(now - fetched_at) for category, (_, fetched_at) in self._entries.items()}
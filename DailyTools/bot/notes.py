@@ -0,0 +1,136 @@
+import math
+import re
+from collections import OrderedDict
+from datetime import datetime
+
+# Matches in a title count for more than matches in the body
+TITLE_WEIGHT = 3
+
+_token_pattern = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [token.casefold() for token in _token_pattern.findall(text)]
+
+
+# One user's notes: notes by id, the next id to hand out and an inverted
+# index of token -> {note_id: weight} kept in step with every add/remove.
+class NoteIndex:
+    __slots__ = ("notes", "next_id", "postings")
+
+    def __init__(self, notes=(), next_id=1):
+        self.notes = {}
+        self.next_id = next_id
+        self.postings = {}
+        for note in notes:
+            self.add(note)
+
+    def add(self, note):
+        self.notes[note["id"]] = note
+        self.next_id = max(self.next_id, note["id"] + 1)
+        for token, weight in self._weights(note).items():
+            self.postings.setdefault(token, {})[note["id"]] = weight
+
+    def remove(self, note_id):
+        note = self.notes.pop(note_id, None)
+        if note is None:
+            return None
+        for token in self._weights(note):
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(note_id, None)
+                if not posting:
+                    del self.postings[token]
+        return note
+
+    @staticmethod
+    def _weights(note):
+        weights = {}
+        for token in tokenize(note["title"]):
+            weights[token] = weights.get(token, 0) + TITLE_WEIGHT
+        for token in tokenize(note["content"]):
+            weights[token] = weights.get(token, 0) + 1
+        return weights
+
+    # Notes matching any query token, best first. Rarer tokens weigh more
+    # (idf) and notes matching more of the query rank above partial matches.
+    def search(self, query, limit=10):
+        scores = {}
+        matched = {}
+        total = len(self.notes)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + total / len(posting))
+            for note_id, weight in posting.items():
+                scores[note_id] = scores.get(note_id, 0.0) + weight * idf
+                matched[note_id] = matched.get(note_id, 0) + 1
+
+        ranked = sorted(scores, key=lambda note_id: (matched[note_id], scores[note_id], note_id), reverse=True)
+        return [self.notes[note_id] for note_id in ranked[:limit]]
+
+
+# Notes subsystem used by the handlers. Indexes are built from storage the
+# first time a user touches their notes and kept in a bounded LRU; every
+# change is written through to storage and reported to `on_change(user_id)`.
+class NotesService:
+    def __init__(self, storage, cache_size=1000, on_change=None):
+        self._storage = storage
+        self._on_change = on_change
+        self.cache_size = cache_size
+        self._indexes = OrderedDict()
+
+    async def _index(self, user_id):
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            return index
+
+        notes = await self._storage.get_notes(user_id)
+        last_id = await self._storage.get_last_note_id(user_id)
+        index = self._indexes.setdefault(user_id, NoteIndex(notes, last_id + 1))
+        while len(self._indexes) > self.cache_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def create(self, user_id, title, content):
+        index = await self._index(user_id)
+        note = {
+            "id": index.next_id,
+            "title": title,
+            "content": content,
+            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        index.add(note)
+        await self._storage.add_note(user_id, note)
+        self._changed(user_id)
+        return note
+
+    async def get(self, user_id, note_id):
+        index = await self._index(user_id)
+        return index.notes.get(note_id)
+
+    async def list(self, user_id):
+        index = await self._index(user_id)
+        return list(index.notes.values())
+
+    async def count(self, user_id):
+        index = await self._index(user_id)
+        return len(index.notes)
+
+    async def delete(self, user_id, note_id):
+        index = await self._index(user_id)
+        if index.remove(note_id) is None:
+            return False
+        await self._storage.delete_note(user_id, note_id)
+        self._changed(user_id)
+        return True
+
+    def _changed(self, user_id):
+        if self._on_change is not None:
+            self._on_change(user_id)
+
+    async def search(self, user_id, query, limit=10):
+        index = await self._index(user_id)
+        return index.search(query, limit)
@@ -0,0 +1,78 @@
+import bisect
+from collections import OrderedDict
+
+from telethon.tl.custom import Button
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+# Cursor-paginated list view. Items must be sorted by `key(item)` (an int id);
+# the cursor in the button data is the key of the first item on the page, so
+# pages stay stable while items are added or removed elsewhere in the list.
+# Rendered pages are cached per user until `invalidate(user_id)` is called.
+class Paginator:
+    def __init__(self, name, header, render_item, key=lambda item: item["id"], page_size=10, cache_size=1000):
+        self.name = name
+        self.header = header
+        self.render_item = render_item
+        self.key = key
+        self.page_size = page_size
+        self.cache_size = cache_size
+        # Keep every page under Telegram's limit whatever the items contain
+        self.max_item_length = (MAX_MESSAGE_LENGTH - len(header) - 64) // page_size
+        self._cache = OrderedDict()
+
+    @property
+    def prefix(self):
+        return f"{self.name}_page_"
+
+    # Returns (text, nav_row) for the page starting at `cursor`, or None when
+    # the list is empty. `load_items` is only awaited on a cache miss; nav_row
+    # is empty for single-page lists.
+    async def page(self, user_id, load_items, cursor=None):
+        pages = self._cache.get(user_id)
+        if pages is not None:
+            self._cache.move_to_end(user_id)
+            cached = pages.get(cursor)
+            if cached is not None:
+                return cached
+        else:
+            pages = self._cache[user_id] = {}
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        items = await load_items()
+        if not items:
+            return None
+        rendered = pages[cursor] = self._render(items, cursor)
+        return rendered
+
+    def _render(self, items, cursor):
+        keys = [self.key(item) for item in items]
+        start = 0 if cursor is None else bisect.bisect_left(keys, cursor)
+        if start >= len(items):
+            start = max(0, len(items) - self.page_size)
+        end = min(start + self.page_size, len(items))
+
+        parts = [self.header]
+        for item in items[start:end]:
+            text = self.render_item(item)
+            if len(text) > self.max_item_length:
+                text = text[:self.max_item_length - 2] + "…\n"
+            parts.append(text)
+
+        total_pages = max(1, -(-len(items) // self.page_size))
+        current_page = start // self.page_size + 1
+        nav_row = []
+        if start > 0:
+            previous_key = keys[max(0, start - self.page_size)]
+            nav_row.append(Button.inline("⬅️ Previous", f"{self.prefix}{previous_key}"))
+        if end < len(items):
+            nav_row.append(Button.inline("Next ➡️", f"{self.prefix}{keys[end]}"))
+        if nav_row:
+            parts.append(f"Page {current_page}/{total_pages}")
+        return "".join(parts), nav_row
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id, None)
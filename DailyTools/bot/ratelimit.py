@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Action costs in tokens
+CHEAP = 1
+EXPENSIVE = 3
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.warned = False
+
+
+# Per-user token buckets. Each user may burst up to `capacity` tokens and
+# regains `refill_rate` tokens per second. Buckets that have refilled and
+# sat idle are evicted by a background sweep, so only recently active users
+# cost memory. Concurrency is capped by the worker pool that runs handlers
+# (see mailboxes.UserMailboxes), not here.
+class RateLimiter:
+    def __init__(self, capacity=10, refill_rate=0.5, idle_ttl=600, sweep_interval=60):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._task = None
+        self.allowed = 0
+        self.rejected = 0
+        self.in_flight = 0
+
+    # Take `cost` tokens from the user's bucket; False if they don't have enough
+    def allow(self, user_id, cost=CHEAP):
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.capacity, now)
+        else:
+            bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated) * self.refill_rate)
+            bucket.updated = now
+
+        if bucket.tokens < cost:
+            self.rejected += 1
+            return False
+        bucket.tokens -= cost
+        bucket.warned = False
+        self.allowed += 1
+        return True
+
+    # Handler middleware. `cost` is a number or a function of the event;
+    # a cost of 0 skips the bucket.
+    def limit(self, cost=CHEAP):
+        def decorator(handler):
+            @functools.wraps(handler)
+            async def wrapper(event):
+                event_cost = cost(event) if callable(cost) else cost
+                if event_cost and not self.allow(event.sender_id, event_cost):
+                    await self._reject(event)
+                    return False
+                self.in_flight += 1
+                try:
+                    return await handler(event)
+                finally:
+                    self.in_flight -= 1
+            return wrapper
+        return decorator
+
+    async def _reject(self, event):
+        bucket = self._buckets[event.sender_id]
+        # Tell the user once per throttled stretch instead of on every update
+        if bucket.warned:
+            return
+        bucket.warned = True
+        logger.info("Rate limited user %s", event.sender_id)
+        try:
+            if hasattr(event, "answer"):
+                await event.answer("⏳ Slow down a little, please!")
+            else:
+                await event.respond("⏳ You're sending requests too quickly. Please wait a moment.")
+        except Exception as e:
+            logger.error("Failed to notify rate-limited user %s: %s", event.sender_id, e)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            cutoff = time.monotonic() - self.idle_ttl
+            idle = [user_id for user_id, bucket in self._buckets.items() if bucket.updated < cutoff]
+            for user_id in idle:
+                del self._buckets[user_id]
+
+    def stats(self):
+        return {
+            "tracked_users": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+import aiohttp
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+# Raised instead of calling a provider whose breaker is open
+class CircuitOpenError(Exception):
+    pass
+
+
+# An upstream answered, but not with something usable (bad status, bad body)
+class UpstreamError(Exception):
+    pass
+
+
+# Raised by Upstream.call when the provider failed but an earlier good
+# result for the key is available: `result` was fetched at `fetched_at`
+# (Unix time) and `error` is the failure. Callers decide how to present it.
+class StaleResult(UpstreamError):
+    def __init__(self, result, fetched_at, error):
+        super().__init__(f"stale result from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fetched_at))}: {error!r}")
+        self.result = result
+        self.fetched_at = fetched_at
+        self.error = error
+
+
+# Failures worth another attempt
+RETRYABLE_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError, UpstreamError)
+
+
+# Health of one upstream provider. After `failure_threshold` consecutive
+# failures the breaker opens and calls are refused for `reset_timeout`
+# seconds; then a single trial call is let through (half-open) and its
+# outcome closes or re-opens the breaker. Latency and error rate are
+# tracked as EWMAs, so they describe recent behaviour.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, alpha=0.2):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.alpha = alpha
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.latency = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self._trial_running = False
+
+    def allow(self):
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._trial_running = False
+        if self.state == HALF_OPEN:
+            if self._trial_running:
+                return False
+            self._trial_running = True
+        return True
+
+    def record_success(self, latency):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self._trial_running = False
+        self.error_rate -= self.alpha * self.error_rate
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.alpha * (latency - self.latency)
+        if self.state != CLOSED:
+            logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._trial_running = False
+        self.error_rate += self.alpha * (1 - self.error_rate)
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning("Circuit for %s opened after %s failures", self.name, self.consecutive_failures)
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    # Lower is healthier: recent latency in seconds, inflated by the recent
+    # error rate plus up to a second's penalty. Untried providers score 0.
+    @property
+    def score(self):
+        return (self.latency or 0.0) * (1 + self.error_rate) + self.error_rate
+
+    async def call(self, fn, *args):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+        started = time.monotonic()
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            # Not the provider's fault; just free the half-open trial slot
+            self._trial_running = False
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success(time.monotonic() - started)
+        return result
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "latency": self.latency,
+            "successes": self.successes,
+            "failures": self.failures,
+            "error_rate": self.error_rate
+        }
+
+
+# Per-call timeout derived from the p95 of recent latencies, with headroom.
+# A timed-out call is recorded at the timeout it hit and immediately widens
+# the timeout, so a provider that slows down across the board isn't starved.
+class AdaptiveTimeout:
+    def __init__(self, initial=10.0, minimum=1.0, maximum=10.0, multiplier=2.0, window=200, recompute_every=20):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.recompute_every = recompute_every
+        self.current = initial
+        self.p95 = None
+        self._samples = deque(maxlen=window)
+        self._pending = 0
+
+    def observe(self, latency):
+        self._samples.append(latency)
+        self._pending += 1
+        if self._pending >= self.recompute_every or self.p95 is None:
+            self._pending = 0
+            ordered = sorted(self._samples)
+            self.p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            self.current = min(self.maximum, max(self.minimum, self.p95 * self.multiplier))
+
+    def expired(self, timeout):
+        self._samples.append(timeout)
+        self.current = min(self.maximum, max(self.current, timeout * self.multiplier))
+
+
+# Everything between the bot and one third-party API: a circuit breaker, an
+# adaptive timeout, a few jittered retries and, for keyed calls, the last
+# good result to fall back on when the provider fails (stale-while-error),
+# delivered as a StaleResult so it is never mistaken for a fresh one.
+# `fn(timeout)` performs one attempt and must finish within `timeout`;
+# `observe(latency, error)`, if given, is called after every attempt.
+# `cacheable(result)` decides which results are good enough to fall back
+# on later; by default every successful result is.
+class Upstream:
+    def __init__(self, name, retries=1, backoff=0.25, stale_size=1000, stale_ttl=86400,
+                 min_timeout=1.0, max_timeout=10.0, failure_threshold=5, reset_timeout=30, observe=None):
+        self.name = name
+        self._observe = observe
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(name, failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.timeout = AdaptiveTimeout(initial=max_timeout, minimum=min_timeout, maximum=max_timeout)
+        self._stale = TTLCache(maxsize=stale_size, ttl=stale_ttl)
+        self.calls = 0
+        self.timeouts = 0
+        self.retried = 0
+        self.stale_served = 0
+
+    async def call(self, fn, key=None, cacheable=None):
+        self.calls += 1
+        try:
+            result = await self._attempts(fn)
+        except Exception as e:
+            stale = self._stale.get(key) if key is not None else None
+            if stale is None:
+                raise
+            self.stale_served += 1
+            logger.warning("%s failed (%r); serving stale result for %s", self.name, e, key)
+            raise StaleResult(stale[0], stale[1], e) from e
+        if key is not None and (cacheable is None or cacheable(result)):
+            self._stale.set(key, (result, time.time()))
+        return result
+
+    async def _attempts(self, fn):
+        attempt = 0
+        while True:
+            try:
+                return await self.breaker.call(self._attempt, fn)
+            except RETRYABLE_ERRORS:
+                if attempt >= self.retries:
+                    raise
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def _attempt(self, fn):
+        timeout = self.timeout.current
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout)
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            self.timeout.expired(timeout)
+            self._observed(started, e)
+            raise
+        except Exception as e:
+            self._observed(started, e)
+            raise
+        self.timeout.observe(self._observed(started, None))
+        return result
+
+    def _observed(self, started, error):
+        latency = time.monotonic() - started
+        if self._observe is not None:
+            self._observe(latency, error)
+        return latency
+
+    def stats(self):
+        return {
+            **self.breaker.stats(),
+            "timeout": self.timeout.current,
+            "p95": self.timeout.p95,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "stale_served": self.stale_served
+        }
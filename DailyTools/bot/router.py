@@ -0,0 +1,152 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _TrieNode:
+    __slots__ = ("children", "handler")
+
+    def __init__(self):
+        self.children = {}
+        self.handler = None
+
+
+# Routes callback data to handlers. Exact routes are a dict lookup; prefix
+# routes (e.g. "news_" for "news_<category>") live in a trie and receive the
+# rest of the data as a parameter. Exact routes always win over prefixes and
+# the longest matching prefix wins, so registration order never matters.
+# `wrap`, if given, decorates every handler as it is registered.
+class CallbackRouter:
+    def __init__(self, wrap=None):
+        self._wrap = wrap
+        self._exact = {}
+        self._prefixes = _TrieNode()
+
+    # @router.route("main_menu") -> handler(event)
+    def route(self, *names):
+        def decorator(handler):
+            wrapped = self._wrap(handler) if self._wrap else handler
+            for name in names:
+                if name in self._exact:
+                    raise ValueError(f"Callback route '{name}' is already registered")
+                self._exact[name] = wrapped
+            return handler
+        return decorator
+
+    # @router.prefix("news_") -> handler(event, rest)
+    def prefix(self, prefix):
+        def decorator(handler):
+            node = self._prefixes
+            for char in prefix:
+                node = node.children.setdefault(char, _TrieNode())
+            if node.handler is not None:
+                raise ValueError(f"Callback prefix '{prefix}' is already registered")
+            node.handler = self._wrap(handler) if self._wrap else handler
+            return handler
+        return decorator
+
+    # Returns (handler, args) for the data, or (None, ()) when nothing matches
+    def resolve(self, data):
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, ()
+
+        match = None
+        node = self._prefixes
+        for i, char in enumerate(data):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.handler is not None:
+                match = (node.handler, (data[i + 1:],))
+        return match or (None, ())
+
+    async def dispatch(self, event):
+        data = event.data.decode('utf-8')
+        handler, args = self.resolve(data)
+        if handler is None:
+            logger.warning("No callback route for '%s'", data)
+            return False
+        await handler(event, *args)
+        return True
+
+
+# A parsed "/name@bot args" message; attached to the event as `event.command`
+class Command:
+    __slots__ = ("name", "args")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+
+# Single entry point for NewMessage events. The command token is parsed once
+# and looked up in a table, so the cost per message doesn't grow with the
+# number of commands and "/weatherfoo" no longer matches "/weather".
+# "/cmd@OtherBot" is ignored once `set_username` has been called. Location
+# messages and plain text go straight to their own handlers.
+class CommandRouter:
+    def __init__(self, wrap=None):
+        self._wrap = wrap
+        self._commands = {}
+        self._location = None
+        self._text = None
+        self.username = None
+
+    def set_username(self, username):
+        self.username = username.lower() if username else None
+
+    # @router.command("start") -> handler(event), with event.command set
+    def command(self, *names):
+        def decorator(handler):
+            wrapped = self._wrap(handler) if self._wrap else handler
+            for name in names:
+                if name in self._commands:
+                    raise ValueError(f"Command '/{name}' is already registered")
+                self._commands[name] = wrapped
+            return handler
+        return decorator
+
+    # @router.location() -> handler(event) for messages carrying a location
+    def location(self):
+        def decorator(handler):
+            self._location = self._wrap(handler) if self._wrap else handler
+            return handler
+        return decorator
+
+    # @router.text() -> handler(event) for non-command text
+    def text(self):
+        def decorator(handler):
+            self._text = self._wrap(handler) if self._wrap else handler
+            return handler
+        return decorator
+
+    # Returns (handler, Command) for a command message, or (None, None)
+    def resolve(self, text):
+        parts = text[1:].split(None, 1)
+        if not parts:
+            return None, None
+        name, _, mention = parts[0].partition("@")
+        if mention and self.username is not None and mention.lower() != self.username:
+            return None, None
+        name = name.lower()
+        handler = self._commands.get(name)
+        if handler is None:
+            return None, None
+        return handler, Command(name, parts[1].strip() if len(parts) > 1 else "")
+
+    async def dispatch(self, event):
+        if event.geo:
+            handler = self._location
+        else:
+            text = event.text
+            if not text:
+                return False
+            if text.startswith("/"):
+                handler, event.command = self.resolve(text)
+            else:
+                handler = self._text
+        if handler is None:
+            return False
+        await handler(event)
+        return True
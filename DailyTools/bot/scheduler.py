@@ -0,0 +1,113 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on a single sleep so wall-clock jumps (suspend, NTP) are noticed
+MAX_SLEEP = 60
+
+
+# Single-task reminder engine. Pending reminders sit in a heap ordered by
+# due time and are persisted through the storage backend so they survive
+# restarts; the run loop sleeps only until the earliest one is due.
+# `deliver(user_id, reminder)` is awaited for each reminder when its time
+# comes, and `on_change(user_id)` is called whenever a user's set changes.
+# With several processes sharing storage, `owns(user_id)` limits loading to
+# this process's users so each reminder has exactly one scheduler.
+class ReminderScheduler:
+    def __init__(self, deliver, storage, on_change=None, owns=None):
+        self._deliver = deliver
+        self._storage = storage
+        self._on_change = on_change
+        self._owns = owns
+        self._heap = []
+        self._pending = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Deliveries in progress, kept so stop() can cancel them
+        self._firing = set()
+
+    # Reload persisted reminders into the heap
+    async def load(self):
+        loaded = await self._storage.all_reminders()
+        if self._owns is not None:
+            loaded = [(user_id, reminder) for user_id, reminder in loaded if self._owns(user_id)]
+        for user_id, reminder in loaded:
+            self._push(user_id, reminder)
+        logger.info("Loaded %s pending reminders", len(loaded))
+        return len(loaded)
+
+    async def add(self, user_id, reminder):
+        await self._storage.add_reminder(user_id, reminder)
+        self._push(user_id, reminder)
+        self._changed(user_id)
+
+    async def cancel(self, user_id, reminder_id):
+        # The heap entry is left in place and skipped when it comes due
+        self._pending.pop((user_id, reminder_id), None)
+        removed = await self._storage.delete_reminder(user_id, reminder_id)
+        if removed:
+            self._changed(user_id)
+        return removed
+
+    def _changed(self, user_id):
+        if self._on_change is not None:
+            self._on_change(user_id)
+
+    def _push(self, user_id, reminder):
+        key = (user_id, reminder["id"])
+        self._pending[key] = reminder
+        heapq.heappush(self._heap, (reminder["time"], next(self._seq), key))
+        if self._heap[0][2] == key:
+            self._wakeup.set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, *self._firing) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._firing.clear()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due_time, _, key = heapq.heappop(self._heap)
+                reminder = self._pending.get(key)
+                # Skip cancelled or rescheduled entries
+                if reminder is None or reminder["time"] != due_time:
+                    continue
+                del self._pending[key]
+                fire = asyncio.create_task(self._fire(key[0], reminder))
+                self._firing.add(fire)
+                fire.add_done_callback(self._firing.discard)
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(max(self._heap[0][0] - time.time(), 0), MAX_SLEEP)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, user_id, reminder):
+        # Delete only after delivery so a restart mid-send re-delivers instead of losing it
+        try:
+            await self._deliver(user_id, reminder)
+        except Exception as e:
+            logger.error("Reminder delivery failed for %s: %s", user_id, e)
+        if await self._storage.delete_reminder(user_id, reminder["id"]):
+            self._changed(user_id)
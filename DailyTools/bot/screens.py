@@ -0,0 +1,379 @@
+from collections import OrderedDict
+
+from telethon import TelegramClient
+from telethon.tl.custom import Button
+
+
+# Registry of the bot's fixed screens. Keyboards are converted to Telethon
+# reply markup once when registered and the same object is sent every time.
+# Static screens are (text, markup) pairs; variants render their text from
+# a few per-user values (e.g. current settings) and are cached per value tuple.
+class ScreenRegistry:
+    def __init__(self, cache_size=256):
+        self.cache_size = cache_size
+        self._keyboards = {}
+        self._screens = {}
+        self._variants = {}
+        self._rendered = OrderedDict()
+
+    def add_keyboard(self, key, rows):
+        if key in self._keyboards:
+            raise ValueError(f"Keyboard '{key}' is already registered")
+        self._keyboards[key] = TelegramClient.build_reply_markup(rows)
+        return self._keyboards[key]
+
+    # `keyboard` is the key of a registered keyboard, or None for no buttons
+    def add_screen(self, key, text, keyboard=None):
+        self._check_new(key)
+        self._screens[key] = (text, self._keyboards[keyboard] if keyboard else None)
+
+    # render(*values) -> text
+    def add_variant(self, key, render, keyboard=None):
+        self._check_new(key)
+        self._variants[key] = (render, self._keyboards[keyboard] if keyboard else None)
+
+    def _check_new(self, key):
+        if key in self._screens or key in self._variants:
+            raise ValueError(f"Screen '{key}' is already registered")
+
+    def keyboard(self, key):
+        return self._keyboards[key]
+
+    # (text, markup) for a static screen, or for a variant given its values
+    def get(self, key, *values):
+        screen = self._screens.get(key)
+        if screen is not None:
+            return screen
+
+        cache_key = (key, values)
+        screen = self._rendered.get(cache_key)
+        if screen is not None:
+            self._rendered.move_to_end(cache_key)
+            return screen
+        render, markup = self._variants[key]
+        screen = self._rendered[cache_key] = (render(*values), markup)
+        while len(self._rendered) > self.cache_size:
+            self._rendered.popitem(last=False)
+        return screen
+
+
+ABOUT_TEXT = (
+    "📱 **Telegram Assistant Bot**\n\n"
+    "I'm a versatile bot designed to make your Telegram experience better.\n"
+    "I can provide weather updates, tell jokes, deliver news, set reminders, and more!\n\n"
+    "Version: 2.1.0\n"
+    "Created with ❤️ using Telethon\n\n"
+    "Type /help to see all available commands."
+)
+
+FEATURES_TEXT = (
+    "🔍 **Available Features:**\n\n"
+    "• 🌤️ **Weather**: Get current weather and forecasts\n"
+    "• 😂 **Jokes**: Enjoy random jokes\n"
+    "• 📰 **News**: Read the latest news by category\n"
+    "• 📝 **Notes**: Create and manage notes\n"
+    "• ⏰ **Reminders**: Set and manage reminders\n"
+    "• 🎮 **Games**: Play fun mini-games\n"
+    "• ⚙️ **Settings**: Customize your experience\n"
+    "• ❓ **Help**: Get assistance with bot commands\n"
+    "• ℹ️ **About**: Learn more about this bot\n\n"
+    "What would you like to try?"
+)
+
+# Help topics by callback data
+HELP_TOPICS = {
+    "help_commands": (
+        "🤖 **Bot Commands:**\n\n"
+        "/start - Start the bot and show main menu\n"
+        "/help - Show help menu\n"
+        "/about - Information about the bot\n"
+        "/weather - Get weather updates\n"
+        "/digest - Daily weather forecast\n"
+        "/joke - Get a random joke\n"
+        "/news - Browse news categories\n"
+        "/notes - Manage your notes\n"
+        "/reminders - Set and manage reminders\n"
+        "/games - Play mini-games\n"
+        "/settings - Customize your preferences\n"
+        "/features - See all available features"
+    ),
+    "help_weather": (
+        "🌤️ **Weather Feature:**\n\n"
+        "Get current weather conditions and forecasts for any location.\n\n"
+        "**Usage:**\n"
+        "• /weather - Opens the weather menu\n"
+        "• /weather [city] - Gets weather for specific city\n"
+        "• Share your location - Gets weather for your current location\n"
+        "• /digest - Get a forecast every day at a time you choose\n\n"
+        "The weather data includes temperature, condition, humidity, wind speed, and a 3-day forecast."
+    ),
+    "help_news": (
+        "📰 **News Feature:**\n\n"
+        "Get the latest news from various categories.\n\n"
+        "**Usage:**\n"
+        "• /news - Opens the news category menu\n\n"
+        "**Available Categories:**\n"
+        "• World\n• Business\n• Health\n• Science\n• Sports\n• Technology"
+    ),
+    "help_jokes": (
+        "😂 **Jokes Feature:**\n\n"
+        "Enjoy random jokes for entertainment.\n\n"
+        "**Usage:**\n"
+        "• /joke - Get a random joke\n"
+        "• 'Another Joke' button - Get another random joke"
+    ),
+    "help_games": (
+        "🎮 **Games Feature:**\n\n"
+        "Play fun mini-games right in your chat.\n\n"
+        "**Available Games:**\n"
+        "• 🎲 Dice Game - Roll dice and try your luck\n"
+        "• 🔢 Number Guess - Guess a number between 1-100\n"
+        "• ✂️ Rock Paper Scissors - Play against the bot\n"
+        "• 🎯 Trivia - Test your knowledge\n\n"
+        "Use /games to access the games menu."
+    ),
+    "help_reminders": (
+        "⏰ **Reminders Feature:**\n\n"
+        "Set and manage reminders for important tasks.\n\n"
+        "**Usage:**\n"
+        "• /reminders - Opens the reminders menu\n"
+        "• 'Set Reminder' - Create a new reminder\n"
+        "• 'View Reminders' - See all your active reminders\n"
+        "• 'Delete Reminder' - Remove a specific reminder\n\n"
+        "You can set reminders using formats like:\n"
+        "• 10m (10 minutes)\n• 2h (2 hours)\n• 1d (1 day)\n• 14:30 (specific time)"
+    ),
+    "help_notes": (
+        "📝 **Notes Feature:**\n\n"
+        "Create and manage personal notes.\n\n"
+        "**Usage:**\n"
+        "• /notes - Opens the notes menu\n"
+        "• 'Create Note' - Add a new note\n"
+        "• 'View Notes' - See all your saved notes\n"
+        "• 'Find Note' - Search for specific notes\n"
+        "• 'Delete Note' - Remove a specific note"
+    ),
+    "help_settings": (
+        "⚙️ **Settings Feature:**\n\n"
+        "Customize your bot experience.\n\n"
+        "**Available Settings:**\n"
+        "• 🌡️ Temperature Unit - Choose between Celsius/Fahrenheit\n"
+        "• 🔔 Notifications - Enable/disable notifications\n"
+        "• 🎨 Theme - Choose between light/dark theme\n\n"
+        "Your settings are saved for future sessions."
+    )
+}
+
+# Confirmation shown after each settings button, by callback data
+SETTING_CONFIRMATIONS = {
+    "set_temp_celsius": "✅ Temperature unit set to Celsius",
+    "set_temp_fahrenheit": "✅ Temperature unit set to Fahrenheit",
+    "set_notif_on": "✅ Notifications enabled",
+    "set_notif_off": "✅ Notifications disabled",
+    "set_theme_light": "✅ Theme set to Light",
+    "set_theme_dark": "✅ Theme set to Dark"
+}
+
+
+def _enabled(flag):
+    return 'Enabled' if flag else 'Disabled'
+
+
+def _settings_text(unit, notifications, theme):
+    return (
+        f"⚙️ **Your Settings:**\n\n"
+        f"🌡️ Temperature Unit: {unit.capitalize()}\n"
+        f"🔔 Notifications: {_enabled(notifications)}\n"
+        f"🎨 Theme: {theme.capitalize()}\n"
+    )
+
+
+def build_screens(news_categories=()):
+    screens = ScreenRegistry()
+
+    # Keyboards
+    screens.add_keyboard("main_menu", [
+        [Button.inline("🌤️ Weather", b"weather_menu"), Button.inline("😂 Jokes", b"joke")],
+        [Button.inline("📰 News", b"news_menu"), Button.inline("🎮 Games", b"games_menu")],
+        [Button.inline("⏰ Reminders", b"reminder_menu"), Button.inline("📝 Notes", b"notes_menu")],
+        [Button.inline("⚙️ Settings", b"settings"), Button.inline("ℹ️ About", b"about")],
+        [Button.inline("❓ Help", b"help")]
+    ])
+    screens.add_keyboard("help", [
+        [Button.inline("🤖 Bot Commands", b"help_commands")],
+        [Button.inline("🌐 Weather", b"help_weather"), Button.inline("📰 News", b"help_news")],
+        [Button.inline("😂 Jokes", b"help_jokes"), Button.inline("🎮 Games", b"help_games")],
+        [Button.inline("⏰ Reminders", b"help_reminders"), Button.inline("📝 Notes", b"help_notes")],
+        [Button.inline("⚙️ Settings", b"help_settings")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("weather_menu", [
+        [Button.inline("🔍 Search City", b"weather_search")],
+        [Button.inline("🌡️ Weather Forecast", b"weather_forecast")],
+        [Button.inline("📬 Daily Digest", b"digest_menu")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("digest_off", [
+        [Button.inline("📬 Subscribe", b"digest_subscribe")],
+        [Button.inline("🔙 Back to Weather Menu", b"weather_menu")]
+    ])
+    screens.add_keyboard("digest_on", [
+        [Button.inline("✏️ Change", b"digest_subscribe"), Button.inline("🔕 Unsubscribe", b"digest_unsubscribe")],
+        [Button.inline("🔙 Back to Weather Menu", b"weather_menu")]
+    ])
+    screens.add_keyboard("digest_saved", [
+        [Button.inline("📬 Daily Digest", b"digest_menu"), Button.inline("🔙 Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("digest_delivered", [
+        [Button.inline("🌤️ Weather Menu", b"weather_menu"), Button.inline("🔕 Unsubscribe", b"digest_unsubscribe")]
+    ])
+    screens.add_keyboard("news_menu", [
+        [Button.inline("🌍 World", b"news_world"), Button.inline("💼 Business", b"news_business")],
+        [Button.inline("🏥 Health", b"news_health"), Button.inline("🔬 Science", b"news_science")],
+        [Button.inline("⚽ Sports", b"news_sports"), Button.inline("💻 Technology", b"news_technology")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    for category in news_categories:
+        screens.add_keyboard(f"news_{category}", [
+            [Button.inline("🔙 News Categories", b"news_menu")],
+            [Button.inline("🔄 Refresh", f"news_{category}")],
+            [Button.inline("🔙 Main Menu", b"main_menu")]
+        ])
+    screens.add_keyboard("notes_menu", [
+        [Button.inline("📝 Create Note", b"create_note"), Button.inline("📋 View Notes", b"view_notes")],
+        [Button.inline("🔍 Find Note", b"find_note"), Button.inline("🗑️ Delete Note", b"delete_note")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("reminder_menu", [
+        [Button.inline("⏰ Set Reminder", b"set_reminder"), Button.inline("📋 View Reminders", b"view_reminders")],
+        [Button.inline("🗑️ Delete Reminder", b"delete_reminder")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("games_menu", [
+        [Button.inline("🎲 Dice Game", b"game_dice"), Button.inline("🔢 Number Guess", b"game_number")],
+        [Button.inline("✂️ Rock Paper Scissors", b"game_rps"), Button.inline("🎯 Trivia", b"game_trivia")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("settings", [
+        [Button.inline("🌡️ Temperature Unit", b"settings_temp"), Button.inline("🔔 Notifications", b"settings_notif")],
+        [Button.inline("🎨 Theme", b"settings_theme")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("settings_temp", [
+        [Button.inline("°C Celsius", b"set_temp_celsius"), Button.inline("°F Fahrenheit", b"set_temp_fahrenheit")],
+        [Button.inline("🔙 Back to Settings", b"settings")]
+    ])
+    screens.add_keyboard("settings_notif", [
+        [Button.inline("🔔 Enable", b"set_notif_on"), Button.inline("🔕 Disable", b"set_notif_off")],
+        [Button.inline("🔙 Back to Settings", b"settings")]
+    ])
+    screens.add_keyboard("settings_theme", [
+        [Button.inline("☀️ Light", b"set_theme_light"), Button.inline("🌙 Dark", b"set_theme_dark")],
+        [Button.inline("🔙 Back to Settings", b"settings")]
+    ])
+    screens.add_keyboard("game_rps", [
+        [Button.inline("✊ Rock", b"rps_rock"), Button.inline("✋ Paper", b"rps_paper"), Button.inline("✂️ Scissors", b"rps_scissors")],
+        [Button.inline("🔙 Games Menu", b"games_menu")]
+    ])
+    screens.add_keyboard("rps_result", [
+        [Button.inline("🎮 Play Again", b"game_rps")],
+        [Button.inline("🔙 Games Menu", b"games_menu")]
+    ])
+    screens.add_keyboard("dice_result", [
+        [Button.inline("🎲 Roll Again", b"game_dice")],
+        [Button.inline("🔙 Games Menu", b"games_menu")]
+    ])
+    screens.add_keyboard("number_result", [
+        [Button.inline("🎮 Play Again", b"game_number")],
+        [Button.inline("🔙 Games Menu", b"games_menu")]
+    ])
+    screens.add_keyboard("trivia_result", [
+        [Button.inline("🎯 Another Question", b"game_trivia")],
+        [Button.inline("🔙 Games Menu", b"games_menu")]
+    ])
+    screens.add_keyboard("joke", [
+        [Button.inline("😂 Another Joke", b"joke")],
+        [Button.inline("🔙 Back to Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("note_saved", [
+        [Button.inline("📝 View Notes", b"view_notes"), Button.inline("🔙 Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("reminder_saved", [
+        [Button.inline("⏰ View Reminders", b"view_reminders"), Button.inline("🔙 Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("reminder_delivered", [
+        [Button.inline("⏰ Set New Reminder", b"set_reminder"), Button.inline("🔙 Main Menu", b"main_menu")]
+    ])
+    screens.add_keyboard("note_search", [
+        [Button.inline("🔍 Search Again", b"find_note"), Button.inline("🔙 Notes Menu", b"notes_menu")]
+    ])
+    screens.add_keyboard("note_result", [
+        [Button.inline("📋 View Notes", b"view_notes"), Button.inline("🔙 Notes Menu", b"notes_menu")]
+    ])
+    screens.add_keyboard("reminder_result", [
+        [Button.inline("📋 View Reminders", b"view_reminders"), Button.inline("🔙 Reminders Menu", b"reminder_menu")]
+    ])
+    screens.add_keyboard("no_notes", [
+        [Button.inline("📝 Create Note", b"create_note")],
+        [Button.inline("🔙 Notes Menu", b"notes_menu")]
+    ])
+    screens.add_keyboard("no_reminders", [
+        [Button.inline("⏰ Set Reminder", b"set_reminder")],
+        [Button.inline("🔙 Reminders Menu", b"reminder_menu")]
+    ])
+    screens.add_keyboard("back_to_main", [[Button.inline("🔙 Back to Main Menu", b"main_menu")]])
+    screens.add_keyboard("back_to_help", [[Button.inline("🔙 Back to Help", b"help")]])
+    screens.add_keyboard("back_to_weather", [[Button.inline("🔙 Back to Weather Menu", b"weather_menu")]])
+    screens.add_keyboard("back_to_notes", [[Button.inline("🔙 Notes Menu", b"notes_menu")]])
+    screens.add_keyboard("back_to_reminders", [[Button.inline("🔙 Reminders Menu", b"reminder_menu")]])
+    screens.add_keyboard("back_to_games", [[Button.inline("🔙 Games Menu", b"games_menu")]])
+    screens.add_keyboard("back_to_settings", [[Button.inline("🔙 Back to Settings", b"settings")]])
+
+    # Static screens
+    screens.add_screen("main_menu", "Main Menu:", "main_menu")
+    screens.add_screen("features", FEATURES_TEXT, "main_menu")
+    screens.add_screen("about", ABOUT_TEXT, "back_to_main")
+    screens.add_screen("help", "Choose a help topic:", "help")
+    for topic, text in HELP_TOPICS.items():
+        screens.add_screen(topic, text, "back_to_help")
+    screens.add_screen("weather_menu", "Weather Menu:", "weather_menu")
+    screens.add_screen(
+        "digest_off",
+        "📬 **Daily Digest**\n\nGet the weather for a city or your location every day at a time you choose.",
+        "digest_off"
+    )
+    screens.add_screen("digest_cancelled", "🔕 Daily digest cancelled.", "back_to_weather")
+    screens.add_screen("news_menu", "📰 Select a news category:", "news_menu")
+    screens.add_screen("notes_menu", "📝 Notes Menu:", "notes_menu")
+    screens.add_screen("reminder_menu", "⏰ Reminders Menu:", "reminder_menu")
+    screens.add_screen("games_menu", "🎮 Games Menu:", "games_menu")
+    screens.add_screen("game_rps", "✂️ **Rock Paper Scissors**\n\nMake your choice:", "game_rps")
+    screens.add_screen("no_notes", "You don't have any notes yet. Create one?", "no_notes")
+    screens.add_screen("no_reminders", "You don't have any active reminders. Set one?", "no_reminders")
+    for key, text in SETTING_CONFIRMATIONS.items():
+        screens.add_screen(key, text, "back_to_settings")
+
+    # Per-user variants, keyed by the user's current preference values
+    screens.add_variant("settings", _settings_text, "settings")
+    screens.add_variant("digest_on", lambda label, delivery_time: (
+        f"📬 **Daily Digest**\n\n"
+        f"📍 {label}\n"
+        f"⏰ Every day at {delivery_time}"
+    ), "digest_on")
+    screens.add_variant("settings_temp", lambda unit: (
+        f"🌡️ **Temperature Unit**\n\n"
+        f"Current setting: {unit.capitalize()}\n\n"
+        f"Select your preferred unit:"
+    ), "settings_temp")
+    screens.add_variant("settings_notif", lambda notifications: (
+        f"🔔 **Notifications**\n\n"
+        f"Current setting: {_enabled(notifications)}\n\n"
+        f"Select your preference:"
+    ), "settings_notif")
+    screens.add_variant("settings_theme", lambda theme: (
+        f"🎨 **Theme**\n\n"
+        f"Current setting: {theme.capitalize()}\n\n"
+        f"Select your preference:"
+    ), "settings_theme")
+
+    return screens
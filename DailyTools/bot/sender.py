@@ -0,0 +1,178 @@
+import asyncio
+import itertools
+import logging
+import random
+import time
+
+from telethon.errors import FloodWaitError, ServerError, TimedOutError
+
+logger = logging.getLogger(__name__)
+
+# Errors worth retrying; anything else (bad request, blocked bot, ...) fails at once
+TRANSIENT_ERRORS = (ConnectionError, asyncio.TimeoutError, ServerError, TimedOutError)
+
+# Priority lanes; lower runs first
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+LANE_NAMES = {INTERACTIVE: "interactive", NOTIFICATION: "notification"}
+
+
+class _Job:
+    __slots__ = ("chat_id", "factory", "future", "lane", "enqueued_at", "attempts")
+
+    def __init__(self, chat_id, factory, future, lane):
+        self.chat_id = chat_id
+        self.factory = factory
+        self.future = future
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+# Paces everything the bot sends to Telegram. Jobs are coroutine factories
+# (e.g. `lambda: event.respond(text)`) queued by lane, so interactive replies
+# overtake reminder fan-out. Sends are limited globally and per chat, and a
+# FloodWait pauses all sending for the requested time before the job is
+# retried; transient network/server errors are retried with jittered backoff.
+class OutboundQueue:
+    def __init__(self, global_rate=25, chat_rate=1.0, chat_burst=3, workers=8, max_retries=3):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._workers = workers
+        self._tasks = []
+        self._global_tokens = global_rate
+        self._global_updated = time.monotonic()
+        self._chat_slots = {}
+        self._paused_until = 0.0
+        self._depth = {lane: 0 for lane in LANE_NAMES}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.flood_waits = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Queue a send and return a future for its result
+    def submit(self, chat_id, factory, lane=INTERACTIVE):
+        future = asyncio.get_running_loop().create_future()
+        self._depth[lane] += 1
+        self._put(_Job(chat_id, factory, future, lane))
+        return future
+
+    async def send(self, chat_id, factory, lane=INTERACTIVE):
+        return await self.submit(chat_id, factory, lane)
+
+    # Drop-in replacements for event.respond / event.edit
+    async def respond(self, event, *args, **kwargs):
+        return await self.send(event.chat_id, lambda: event.respond(*args, **kwargs))
+
+    async def edit(self, event, *args, **kwargs):
+        return await self.send(event.chat_id, lambda: event.edit(*args, **kwargs))
+
+    def _put(self, job):
+        self._queue.put_nowait((job.lane, next(self._seq), job))
+
+    def _requeue_later(self, job, delay):
+        asyncio.get_running_loop().call_later(delay, self._put, job)
+
+    # Per-chat token bucket; returns seconds to wait before this chat may send
+    def _chat_delay(self, chat_id, now):
+        tokens, updated = self._chat_slots.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - updated) * self.chat_rate)
+        if tokens < 1:
+            self._chat_slots[chat_id] = (tokens, now)
+            return (1 - tokens) / self.chat_rate
+        self._chat_slots[chat_id] = (tokens - 1, now)
+        if len(self._chat_slots) > 10000:
+            self._prune_chat_slots(now)
+        return 0
+
+    def _prune_chat_slots(self, now):
+        full_after = self.chat_burst / self.chat_rate
+        for chat_id in [c for c, (_, updated) in self._chat_slots.items() if now - updated > full_after]:
+            del self._chat_slots[chat_id]
+
+    async def _acquire_global(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._global_tokens = min(self.global_rate, self._global_tokens + (now - self._global_updated) * self.global_rate)
+            self._global_updated = now
+            if self._global_tokens >= 1:
+                self._global_tokens -= 1
+                return
+            await asyncio.sleep((1 - self._global_tokens) / self.global_rate)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.future.done():
+                self._depth[job.lane] -= 1
+                continue
+
+            delay = self._chat_delay(job.chat_id, time.monotonic())
+            if delay:
+                self._requeue_later(job, delay)
+                continue
+
+            await self._acquire_global()
+            job.attempts += 1
+            try:
+                result = await job.factory()
+            except FloodWaitError as e:
+                self.flood_waits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.seconds)
+                logger.warning("FloodWait for %ss while sending to %s", e.seconds, job.chat_id)
+                self._put(job)
+            except TRANSIENT_ERRORS as e:
+                if job.attempts > self.max_retries:
+                    self._fail(job, e)
+                else:
+                    self.retried += 1
+                    backoff = min(30, 2 ** job.attempts) * random.uniform(0.5, 1.5)
+                    self._requeue_later(job, backoff)
+            except Exception as e:
+                self._fail(job, e)
+            else:
+                self._depth[job.lane] -= 1
+                latency = time.monotonic() - job.enqueued_at
+                self.sent += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                if not job.future.done():
+                    job.future.set_result(result)
+
+    def _fail(self, job, error):
+        self._depth[job.lane] -= 1
+        self.failed += 1
+        logger.error("Failed sending to %s after %s attempts: %s", job.chat_id, job.attempts, error)
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self):
+        return {
+            "depth": {LANE_NAMES[lane]: depth for lane, depth in self._depth.items()},
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "flood_waits": self.flood_waits,
+            "avg_latency": self.latency_total / self.sent if self.sent else 0.0,
+            "max_latency": self.latency_max
+        }
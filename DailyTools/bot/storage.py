@@ -0,0 +1,438 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Preferences packed into UserData.flags: key -> (shift, bits, choices).
+# The first choice is the default and encodes as 0, so defaults are never
+# stored; values outside `choices` fall back to UserData.extra.
+PACKED_PREFERENCES = {
+    "temperature_unit": (0, 1, ("celsius", "fahrenheit")),
+    "notifications": (1, 1, (True, False)),
+    "theme": (2, 1, ("light", "dark")),
+    "language": (3, 3, ("english",))
+}
+
+DEFAULT_PREFERENCES = {key: choices[0] for key, (_, _, choices) in PACKED_PREFERENCES.items()}
+
+# key -> {(type, value): index}; the type keeps 1 and 0 from matching True and False
+_PACKED_INDEX = {
+    key: {(type(choice), choice): index for index, choice in enumerate(choices)}
+    for key, (_, _, choices) in PACKED_PREFERENCES.items()
+}
+
+
+# Everything stored for one user. A user who only changed packed
+# preferences costs one small object; the note, reminder, score and extra
+# preference dicts are created on first write. Notes and reminders are
+# keyed by their id; `last_note_id` is the highest note id ever handed out,
+# so ids of deleted notes are never reused; `digest` is the daily weather
+# subscription, if any.
+class UserData:
+    __slots__ = ("flags", "extra", "notes", "last_note_id", "reminders", "scores", "digest")
+
+    def __init__(self):
+        self.flags = 0
+        self.extra = None
+        self.notes = None
+        self.last_note_id = 0
+        self.reminders = None
+        self.scores = None
+        self.digest = None
+
+    def get_preference(self, key):
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        packed = PACKED_PREFERENCES.get(key)
+        if packed is None:
+            return None
+        shift, bits, choices = packed
+        return choices[(self.flags >> shift) & ((1 << bits) - 1)]
+
+    def set_preference(self, key, value):
+        index = None
+        if key in _PACKED_INDEX and getattr(value, "__hash__", None) is not None:
+            index = _PACKED_INDEX[key].get((type(value), value))
+        if index is not None:
+            shift, bits, _ = PACKED_PREFERENCES[key]
+            self.flags = (self.flags & ~(((1 << bits) - 1) << shift)) | (index << shift)
+            if self.extra is not None:
+                self.extra.pop(key, None)
+                if not self.extra:
+                    self.extra = None
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def preferences(self):
+        prefs = {key: self.get_preference(key) for key in PACKED_PREFERENCES}
+        if self.extra is not None:
+            prefs.update(self.extra)
+        return prefs
+
+
+# Read-only stand-in for users with nothing stored; never mutated
+EMPTY_RECORD = UserData()
+
+
+# Async storage API used by the handlers. Backends provide `_record`, which
+# returns the UserData for a user (for reads, `create=False` allows the
+# shared EMPTY_RECORD for unknown users), and may override `_persist` to
+# write each change somewhere durable.
+class Storage:
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _record(self, user_id, create=True):
+        raise NotImplementedError
+
+    def _persist(self, sql, params):
+        pass
+
+    # Preferences
+    async def get_preferences(self, user_id):
+        record = await self._record(user_id, create=False)
+        return record.preferences()
+
+    async def set_preference(self, user_id, key, value):
+        record = await self._record(user_id)
+        record.set_preference(key, value)
+        self._persist(
+            "INSERT OR REPLACE INTO preferences (user_id, key, value) VALUES (?, ?, ?)",
+            (user_id, key, json.dumps(value))
+        )
+
+    # Notes
+    async def get_notes(self, user_id):
+        record = await self._record(user_id, create=False)
+        return list(record.notes.values()) if record.notes else []
+
+    async def get_note(self, user_id, note_id):
+        record = await self._record(user_id, create=False)
+        return record.notes.get(note_id) if record.notes else None
+
+    async def get_last_note_id(self, user_id):
+        record = await self._record(user_id, create=False)
+        return record.last_note_id
+
+    async def add_note(self, user_id, note):
+        record = await self._record(user_id)
+        if record.notes is None:
+            record.notes = {}
+        record.notes[note["id"]] = note
+        self._persist(
+            "INSERT OR REPLACE INTO notes (user_id, note_id, title, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, note["id"], note["title"], note["content"], note["created_at"])
+        )
+        if note["id"] > record.last_note_id:
+            record.last_note_id = note["id"]
+            self._persist(
+                "INSERT OR REPLACE INTO note_counters (user_id, last_id) VALUES (?, ?)",
+                (user_id, note["id"])
+            )
+
+    async def delete_note(self, user_id, note_id):
+        record = await self._record(user_id, create=False)
+        if not record.notes or record.notes.pop(note_id, None) is None:
+            return False
+        self._persist("DELETE FROM notes WHERE user_id = ? AND note_id = ?", (user_id, note_id))
+        return True
+
+    # Reminders
+    async def get_reminders(self, user_id):
+        record = await self._record(user_id, create=False)
+        return list(record.reminders.values()) if record.reminders else []
+
+    async def add_reminder(self, user_id, reminder):
+        record = await self._record(user_id)
+        if record.reminders is None:
+            record.reminders = {}
+        record.reminders[reminder["id"]] = reminder
+        self._persist(
+            "INSERT OR REPLACE INTO reminders (user_id, reminder_id, text, time, created_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, reminder["id"], reminder["text"], reminder["time"], reminder["created_at"])
+        )
+
+    async def delete_reminder(self, user_id, reminder_id):
+        record = await self._record(user_id, create=False)
+        if not record.reminders or record.reminders.pop(reminder_id, None) is None:
+            return False
+        self._persist("DELETE FROM reminders WHERE user_id = ? AND reminder_id = ?", (user_id, reminder_id))
+        return True
+
+    # Every pending reminder as (user_id, reminder) pairs, for the scheduler
+    async def all_reminders(self):
+        raise NotImplementedError
+
+    # Scores
+    async def get_score(self, user_id, game):
+        record = await self._record(user_id, create=False)
+        return record.scores.get(game, 0) if record.scores else 0
+
+    async def incr_score(self, user_id, game, amount=1):
+        record = await self._record(user_id)
+        if record.scores is None:
+            record.scores = {}
+        score = record.scores.get(game, 0) + amount
+        record.scores[game] = score
+        self._persist(
+            "INSERT OR REPLACE INTO scores (user_id, game, score) VALUES (?, ?, ?)",
+            (user_id, game, score)
+        )
+        return score
+
+    # Daily weather digest subscription
+    async def get_digest(self, user_id):
+        record = await self._record(user_id, create=False)
+        return record.digest
+
+    async def set_digest(self, user_id, digest):
+        record = await self._record(user_id)
+        record.digest = digest
+        self._persist(
+            "INSERT OR REPLACE INTO digests (user_id, location, label, time, tz, unit) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, digest["location"], digest["label"], digest["time"], digest["tz"], digest["unit"])
+        )
+
+    async def delete_digest(self, user_id):
+        record = await self._record(user_id, create=False)
+        if record.digest is None:
+            return False
+        record.digest = None
+        self._persist("DELETE FROM digests WHERE user_id = ?", (user_id,))
+        return True
+
+    # Every subscription as (user_id, digest) pairs, for the digest scheduler
+    async def all_digests(self):
+        raise NotImplementedError
+
+
+# Keeps everything in process memory; nothing survives a restart
+class MemoryStorage(Storage):
+    def __init__(self):
+        self._users = {}
+
+    async def _record(self, user_id, create=True):
+        record = self._users.get(user_id)
+        if record is None:
+            if not create:
+                return EMPTY_RECORD
+            record = self._users[user_id] = UserData()
+        return record
+
+    async def all_reminders(self):
+        return [
+            (user_id, reminder)
+            for user_id, record in self._users.items()
+            if record.reminders
+            for reminder in record.reminders.values()
+        ]
+
+    async def all_digests(self):
+        return [(user_id, record.digest) for user_id, record in self._users.items() if record.digest is not None]
+
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS preferences ("
+    "user_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+    "PRIMARY KEY (user_id, key))",
+    "CREATE TABLE IF NOT EXISTS notes ("
+    "user_id INTEGER NOT NULL, note_id INTEGER NOT NULL, title TEXT NOT NULL, "
+    "content TEXT NOT NULL, created_at TEXT NOT NULL, "
+    "PRIMARY KEY (user_id, note_id))",
+    "CREATE TABLE IF NOT EXISTS note_counters ("
+    "user_id INTEGER PRIMARY KEY, last_id INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS reminders ("
+    "user_id INTEGER NOT NULL, reminder_id INTEGER NOT NULL, text TEXT NOT NULL, "
+    "time REAL NOT NULL, created_at REAL NOT NULL, "
+    "PRIMARY KEY (user_id, reminder_id))",
+    "CREATE TABLE IF NOT EXISTS scores ("
+    "user_id INTEGER NOT NULL, game TEXT NOT NULL, score INTEGER NOT NULL, "
+    "PRIMARY KEY (user_id, game))",
+    "CREATE TABLE IF NOT EXISTS digests ("
+    "user_id INTEGER PRIMARY KEY, location TEXT NOT NULL, label TEXT NOT NULL, "
+    "time TEXT NOT NULL, tz TEXT NOT NULL, unit TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS reminders_by_time ON reminders (time)"
+)
+
+
+# Embedded SQLite backend. Recently used users are kept in a bounded LRU
+# cache; writes update the cache immediately and are queued for a
+# background task that commits them in batches off the event loop.
+class SQLiteStorage(Storage):
+    def __init__(self, path="bot.db", cache_size=10000, flush_interval=0.5, batch_size=500):
+        self.path = path
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._pending = []
+        self._flush_needed = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._db_lock = threading.Lock()
+        self._task = None
+        # Opened by start(), so creating the backend touches no files
+        self._db = None
+
+    def _open(self):
+        # Other worker processes may hold the write lock briefly
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self._db.execute(statement)
+        self._db.commit()
+
+    async def start(self):
+        if self._db is None:
+            self._open()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._db is not None:
+            await self.flush()
+            self._db.close()
+            self._db = None
+
+    def _persist(self, sql, params):
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size:
+            self._flush_needed.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Storage flush failed: %s", e)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                # Put the batch back so the next flush retries it in order
+                self._pending[:0] = batch
+                raise
+
+    def _write_batch(self, batch):
+        with self._db_lock:
+            with self._db:
+                for sql, params in batch:
+                    self._db.execute(sql, params)
+
+    def _load(self, user_id):
+        record = UserData()
+        with self._db_lock:
+            for key, value in self._db.execute(
+                "SELECT key, value FROM preferences WHERE user_id = ?", (user_id,)
+            ):
+                record.set_preference(key, json.loads(value))
+            for note_id, title, content, created_at in self._db.execute(
+                "SELECT note_id, title, content, created_at FROM notes WHERE user_id = ? ORDER BY note_id",
+                (user_id,)
+            ):
+                if record.notes is None:
+                    record.notes = {}
+                record.notes[note_id] = {"id": note_id, "title": title, "content": content, "created_at": created_at}
+                record.last_note_id = max(record.last_note_id, note_id)
+            row = self._db.execute("SELECT last_id FROM note_counters WHERE user_id = ?", (user_id,)).fetchone()
+            if row is not None:
+                record.last_note_id = max(record.last_note_id, row[0])
+            for reminder_id, text, due, created_at in self._db.execute(
+                "SELECT reminder_id, text, time, created_at FROM reminders WHERE user_id = ? ORDER BY reminder_id",
+                (user_id,)
+            ):
+                if record.reminders is None:
+                    record.reminders = {}
+                record.reminders[reminder_id] = {"id": reminder_id, "text": text, "time": due, "created_at": created_at}
+            for game, score in self._db.execute(
+                "SELECT game, score FROM scores WHERE user_id = ?", (user_id,)
+            ):
+                if record.scores is None:
+                    record.scores = {}
+                record.scores[game] = score
+            row = self._db.execute(
+                "SELECT location, label, time, tz, unit FROM digests WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is not None:
+                record.digest = _digest(row)
+        return record
+
+    async def _record(self, user_id, create=True):
+        record = self._cache.get(user_id)
+        if record is not None:
+            self._cache.move_to_end(user_id)
+            return record
+
+        # Queued writes may belong to this user if it was evicted recently
+        await self.flush()
+        record = self._cache.get(user_id)
+        if record is None:
+            record = await asyncio.to_thread(self._load, user_id)
+            record = self._cache.setdefault(user_id, record)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return record
+
+    async def all_reminders(self):
+        await self.flush()
+
+        def query():
+            with self._db_lock:
+                return self._db.execute(
+                    "SELECT user_id, reminder_id, text, time, created_at FROM reminders ORDER BY time"
+                ).fetchall()
+
+        rows = await asyncio.to_thread(query)
+        return [
+            (user_id, {"id": reminder_id, "text": text, "time": due, "created_at": created_at})
+            for user_id, reminder_id, text, due, created_at in rows
+        ]
+
+    async def all_digests(self):
+        await self.flush()
+
+        def query():
+            with self._db_lock:
+                return self._db.execute("SELECT user_id, location, label, time, tz, unit FROM digests").fetchall()
+
+        rows = await asyncio.to_thread(query)
+        return [(row[0], _digest(row[1:])) for row in rows]
+
+
+def _digest(row):
+    location, label, time_of_day, tz, unit = row
+    return {"location": location, "label": label, "time": time_of_day, "tz": tz, "unit": unit}
+
+
+def create_storage(backend="sqlite", path="bot.db"):
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "sqlite":
+        return SQLiteStorage(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,151 @@
+import asyncio
+import html
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class Question:
+    __slots__ = ("serial", "category", "difficulty", "text", "correct_answer", "incorrect_answers")
+
+    def __init__(self, serial, raw):
+        # Open Trivia DB sends HTML entities; decode them once here
+        self.serial = serial
+        self.category = html.unescape(raw["category"])
+        self.difficulty = raw["difficulty"]
+        self.text = html.unescape(raw["question"])
+        self.correct_answer = html.unescape(raw["correct_answer"])
+        self.incorrect_answers = [html.unescape(answer) for answer in raw["incorrect_answers"]]
+
+
+# Local pool of trivia questions refilled in bulk by a background task, so a
+# question is served from memory instead of costing an upstream request.
+# `fetch(amount)` returns a list of raw Open Trivia DB results.
+#
+# Every question gets an increasing serial number; what a user has seen is
+# an int used as a bitset over the serials still in the pool, stored with
+# the serial of bit 0 so it can be shifted lazily when old questions retire.
+class TriviaPool:
+    def __init__(self, fetch, batch_size=50, max_size=500, low_water=10, min_interval=5, max_users=10000):
+        self._fetch = fetch
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.low_water = low_water
+        # Open Trivia DB allows one request per IP every 5 seconds
+        self.min_interval = min_interval
+        self.max_users = max_users
+        self._questions = deque()
+        self._texts = set()
+        self._next_serial = 0
+        self._seen = OrderedDict()
+        self._refill_task = None
+        self._last_fetch = 0.0
+        self.served = 0
+        self.fetches = 0
+        self.duplicates = 0
+
+    @property
+    def _base(self):
+        return self._questions[0].serial if self._questions else self._next_serial
+
+    def start(self):
+        self._refill()
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    # A question this user hasn't seen yet, or None if the pool is empty and
+    # can't be filled. Once a user has seen everything, their history resets.
+    async def next(self, user_id):
+        bits = self._user_bits(user_id)
+        unseen = len(self._questions) - bits.bit_count()
+        if unseen <= self.low_water:
+            refill = self._refill()
+            if unseen == 0 and refill is not None:
+                await asyncio.shield(refill)
+                bits = self._user_bits(user_id)
+                unseen = len(self._questions) - bits.bit_count()
+        if not self._questions:
+            return None
+        if unseen == 0:
+            bits = 0
+
+        index = self._pick(bits)
+        self._seen[user_id] = (self._base, bits | (1 << index))
+        self.served += 1
+        return self._questions[index]
+
+    def _user_bits(self, user_id):
+        entry = self._seen.get(user_id)
+        if entry is None:
+            if len(self._seen) >= self.max_users:
+                self._seen.popitem(last=False)
+            return 0
+        self._seen.move_to_end(user_id)
+        base, bits = entry
+        return bits >> (self._base - base)
+
+    def _pick(self, bits):
+        count = len(self._questions)
+        # Random probes are enough unless the user has seen most of the pool
+        for _ in range(8):
+            index = random.randrange(count)
+            if not bits >> index & 1:
+                return index
+        return random.choice([index for index in range(count) if not bits >> index & 1])
+
+    # Start a background refill unless one is running or we fetched too
+    # recently; returns the running refill task, if any
+    def _refill(self):
+        if self._refill_task is not None and not self._refill_task.done():
+            return self._refill_task
+        if time.monotonic() - self._last_fetch < self.min_interval and self._questions:
+            return None
+        self._refill_task = asyncio.create_task(self._load())
+        return self._refill_task
+
+    async def _load(self):
+        wait = self._last_fetch + self.min_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_fetch = time.monotonic()
+        self.fetches += 1
+        try:
+            results = await self._fetch(self.batch_size)
+        except Exception as e:
+            logger.error("Trivia refill failed: %s", e)
+            return
+        self._add(results)
+
+    def _add(self, results):
+        added = 0
+        for raw in results:
+            question = Question(self._next_serial, raw)
+            if question.text in self._texts:
+                self.duplicates += 1
+                continue
+            self._questions.append(question)
+            self._texts.add(question.text)
+            self._next_serial += 1
+            added += 1
+        while len(self._questions) > self.max_size:
+            self._texts.discard(self._questions.popleft().text)
+        logger.info("Trivia pool refilled with %s questions (%s pooled)", added, len(self._questions))
+
+    def stats(self):
+        return {
+            "pooled": len(self._questions),
+            "served": self.served,
+            "fetches": self.fetches,
+            "duplicates": self.duplicates,
+            "tracked_users": len(self._seen)
+        }